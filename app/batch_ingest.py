@@ -1,42 +1,232 @@
-import os, glob, time, json
-from app.file_loader import split_file
+"""
+同步目录监听：WATCH_PATH 下的文件新增/修改/删除自动同步到知识库。
+
+- 有 watchdog（inotify）时事件驱动，否则退化为按 SYNC_POLL_INTERVAL 轮询
+- 同一文件的连续事件按 SYNC_DEBOUNCE 去抖，写完稳定后才处理；轮询时大小和 mtime 连续两轮不变才处理
+- 大小和 mtime 都没变直接跳过；变了再算 sha256，内容相同（仅 touch）不重新入库
+- 任何一步失败（入库、删除、读文件）都只记日志、不记录指纹，下次事件或全量扫描时重试，监听不退出
+- 文件被删除时调用 delete_by_filename
+- 同步状态存放在 SQLite（WAL），进程崩溃不会写坏
+"""
+import os, time, sqlite3, logging, threading
+from typing import Dict, Optional
+
+from app.config import (
+    QDRANT_COLLECTION,
+    SYNC_WATCH_PATH, SYNC_STATE_DB, SYNC_DEBOUNCE, SYNC_POLL_INTERVAL, SYNC_RESCAN_INTERVAL,
+)
 from app.embedder import Embedder
-from app.qdrant_client import add_texts, init_collection
+from app.ingest import IngestIncomplete, ingest_file, file_sha256
+from app.vector_db import create_db
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # 没装 watchdog 时走轮询
+    Observer = None
+    FileSystemEventHandler = object
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+)
+logger = logging.getLogger("batch-ingest")
 
-WATCH_PATH = "/data/sync_folder"
-HISTORY_FILE = "/data/ingested_files.json"
+WATCH_PATH = os.path.normpath(SYNC_WATCH_PATH)
 EMBEDDER = Embedder()
+DB = create_db(QDRANT_COLLECTION)
+
+
+def is_candidate(path: str) -> bool:
+    # 跳过隐藏文件、Office 锁文件和常见的临时文件
+    name = os.path.basename(path)
+    return not (name.startswith((".", "~$")) or name.endswith((".tmp", ".part", "~")))
+
+
+class SyncState:
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, sha256 TEXT NOT NULL, size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL, segments INTEGER, ingested_at REAL NOT NULL)"
+        )
+
+    def get(self, path: str) -> Optional[Dict]:
+        row = self.conn.execute(
+            "SELECT sha256, size, mtime_ns FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        return {"sha256": row[0], "size": row[1], "mtime_ns": row[2]} if row else None
+
+    def put(self, path: str, sha256: str, size: int, mtime_ns: int, segments: Optional[int] = None):
+        self.conn.execute(
+            "INSERT INTO files(path, sha256, size, mtime_ns, segments, ingested_at) VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(path) DO UPDATE SET sha256 = excluded.sha256, size = excluded.size,"
+            " mtime_ns = excluded.mtime_ns, segments = COALESCE(excluded.segments, files.segments),"
+            " ingested_at = excluded.ingested_at",
+            (path, sha256, size, mtime_ns, segments, time.time()),
+        )
+
+    def invalidate(self, path: str):
+        # 保留条目（文件删除时仍能清掉已写入的分块），但指纹永不匹配，保证下次重试
+        self.conn.execute(
+            "INSERT INTO files(path, sha256, size, mtime_ns, ingested_at) VALUES (?, '', -1, -1, ?)"
+            " ON CONFLICT(path) DO UPDATE SET sha256 = '', size = -1, mtime_ns = -1",
+            (path, time.time()),
+        )
+
+    def remove(self, path: str):
+        self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def paths(self):
+        return [r[0] for r in self.conn.execute("SELECT path FROM files")]
+
 
-def load_history():
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE) as f:
-            return json.load(f)
-    return {}
+def sync_path(state: SyncState, path: str):
+    """把单个路径的当前状态同步到知识库；失败只记日志并作废指纹，不向上抛。"""
+    if not is_candidate(path):
+        return
+    try:
+        _sync_path(state, path)
+    except Exception:
+        # 向量库不可用、文件处理途中被删/被改等
+        logger.exception("%s 同步失败，稍后重试", path)
+        try:
+            state.invalidate(path)
+        except Exception:
+            logger.exception("%s 作废同步状态失败", path)
+
+
+def _sync_path(state: SyncState, path: str):
+    filename = os.path.basename(path)
+    if not os.path.isfile(path):
+        if state.get(path) is not None:
+            DB.delete_by_filename(filename)
+            state.remove(path)
+            logger.info("已删除: %s", path)
+        return
+
+    st = os.stat(path)
+    prev = state.get(path)
+    if prev and prev["size"] == st.st_size and prev["mtime_ns"] == st.st_mtime_ns:
+        return
+    digest = file_sha256(path)
+    if prev and prev["sha256"] == digest:
+        # 只是 touch，内容没变
+        state.put(path, digest, st.st_size, st.st_mtime_ns)
+        return
+    try:
+        # 增量入库：只写新增/变化的分块，删除已不存在的分块
+        segments = ingest_file(path, filename, EMBEDDER, DB)
+    except IngestIncomplete as e:
+        logger.warning("%s 部分同步失败（%s），稍后重试", path, e)
+        state.invalidate(path)
+        return
+    state.put(path, digest, st.st_size, st.st_mtime_ns, segments)
+    logger.info("已同步: %s segments=%d", path, segments)
+
+
+def rescan(state: SyncState, seen: Optional[Dict[str, tuple]] = None):
+    """
+    全量扫描：处理新增/修改，并把已从目录消失的文件当作删除。
+    传 seen 时（轮询模式）只处理大小和 mtime 与上一轮扫描相同的文件，还在写的留到下一轮；seen 原地更新。
+    """
+    present = set()
+    try:
+        entries = list(os.scandir(WATCH_PATH))
+    except FileNotFoundError:
+        logger.warning("同步目录不存在: %s", WATCH_PATH)
+        entries = []
+    except OSError:
+        logger.exception("扫描同步目录失败: %s", WATCH_PATH)
+        return
+    for entry in entries:
+        try:
+            if not (entry.is_file() and is_candidate(entry.path)):
+                continue
+            st = entry.stat()
+        except OSError:
+            continue    # 扫描途中被删除，按缺失处理
+        present.add(entry.path)
+        if seen is not None:
+            sig = (st.st_size, st.st_mtime_ns)
+            if seen.get(entry.path) != sig:
+                seen[entry.path] = sig
+                continue
+        sync_path(state, entry.path)
+    if seen is not None:
+        for path in set(seen) - present:
+            del seen[path]
+    for path in state.paths():
+        if path not in present:
+            sync_path(state, path)
+
+
+class _DebouncedHandler(FileSystemEventHandler):
+    def __init__(self):
+        self.pending: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def _touch(self, path):
+        if path and os.path.dirname(path) == WATCH_PATH:
+            with self.lock:
+                self.pending[path] = time.monotonic()
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        self._touch(os.fsdecode(event.src_path))
+        self._touch(os.fsdecode(getattr(event, "dest_path", "") or ""))
+
+    def due(self):
+        """取出已静默超过去抖时间的路径。"""
+        now = time.monotonic()
+        with self.lock:
+            ready = [p for p, t in self.pending.items() if now - t >= SYNC_DEBOUNCE]
+            for p in ready:
+                del self.pending[p]
+        return ready
 
-def save_history(hist):
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(hist, f)
 
 def main_loop():
-    history = load_history()
-    while True:
-        for fname in glob.glob(WATCH_PATH + "/*"):
-            mtime = int(os.path.getmtime(fname))
-            if fname not in history or history[fname] < mtime:
-                try:
-                    segments = split_file(fname)
-                    texts = [seg["text"] for seg in segments]
-                    payloads = [{k: v for k, v in seg.items() if k != "text"} for seg in segments]
-                    embeddings = EMBEDDER.embed(texts)
-                    init_collection()
-                    add_texts(texts, embeddings, payloads=payloads)
-                    history[fname] = mtime
-                    save_history(history)
-                    print(f"已同步: {fname}")
-                except Exception as e:
-                    print(f"{fname} 同步失败: {e}")
-        time.sleep(300)  # 5分钟一轮
+    state = SyncState(SYNC_STATE_DB)
+    rescan(state)
+
+    observer = None
+    if Observer is not None and os.path.isdir(WATCH_PATH):
+        handler = _DebouncedHandler()
+        try:
+            observer = Observer()
+            observer.schedule(handler, WATCH_PATH, recursive=False)
+            observer.start()
+            logger.info("监听同步目录（事件驱动）: %s", WATCH_PATH)
+        except Exception:
+            logger.exception("启动文件监听失败，改为轮询")
+            observer = None
+
+    if observer is None:
+        logger.info("轮询同步目录: %s（每 %.0fs）", WATCH_PATH, SYNC_POLL_INTERVAL)
+        seen: Dict[str, tuple] = {}
+        while True:
+            time.sleep(SYNC_POLL_INTERVAL)
+            rescan(state, seen)
+
+    last_rescan = time.monotonic()
+    try:
+        while True:
+            time.sleep(min(0.5, SYNC_DEBOUNCE))
+            for path in handler.due():
+                sync_path(state, path)
+            # 兜底全量扫描，防止漏掉事件（如监听队列溢出）
+            if time.monotonic() - last_rescan >= SYNC_RESCAN_INTERVAL:
+                rescan(state)
+                last_rescan = time.monotonic()
+    finally:
+        observer.stop()
+        observer.join()
 
 if __name__ == "__main__":
     main_loop()
-
@@ -0,0 +1,164 @@
+# app/batcher.py
+"""
+异步微批：把并发到达的单条请求攒成一批，一次调用批量接口后把结果分发回各自的等待者。
+
+- 第一条到达后最多再等 max_wait 秒，或攒满 max_batch 条，就发出一批；同一批内相同 key 只算一次
+- 最多 max_inflight 个批次同时在途；在途已满时后续请求留在队列里继续累积，下游恢复后以更大的批次发出
+- 队列有界（max_queue）：排队条目已满时 submit 立即抛 Overloaded，由调用方返回 503，
+  不让等待时间随 QPS 线性增长
+- 事件循环内使用；收集循环在第一次 submit 时启动（空 context，避免把某个请求的 Server-Timing 带进后台任务）
+"""
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from app import metrics
+
+BatchFn = Callable[[List[Any]], Awaitable[Sequence[Any]]]
+
+
+class Overloaded(RuntimeError):
+    """排队已满，下游处理不过来。"""
+
+
+class MicroBatcher:
+    def __init__(self, fn: BatchFn, max_batch: int = 32, max_wait: float = 0.002,
+                 max_queue: int = 1024, max_inflight: int = 4, name: str = "batcher"):
+        self.fn = fn
+        self.name = name
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait)
+        self.max_queue = max(1, max_queue)
+        self.max_inflight = max(1, max_inflight)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._inflight: set = set()
+        self._getter: Optional[asyncio.Task] = None
+        # 已从队列取出、还没交给 _dispatch 的一批；关闭时要给它们的等待者一个结果
+        self._held: List[Tuple[Hashable, Any, asyncio.Future]] = []
+
+    def _start(self) -> None:
+        self._queue = asyncio.Queue(self.max_queue)
+        self._sem = asyncio.Semaphore(self.max_inflight)
+        self._getter = None
+        self._task = contextvars.Context().run(asyncio.get_running_loop().create_task, self._run())
+
+    async def submit(self, key: Hashable, item: Any) -> Any:
+        """提交一条，等待所在批次完成后返回对应结果；批量调用失败时抛出同一个异常。"""
+        if self._task is None or self._task.done():
+            self._start()
+        fut = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((key, item, fut))
+        except asyncio.QueueFull:
+            metrics.inc("vqa_batcher_rejected_total", batcher=self.name)
+            raise Overloaded(f"{self.name}: 排队已满（{self.max_queue}）")
+        return await fut
+
+    async def _next(self, timeout: Optional[float] = None) -> Optional[Tuple[Hashable, Any, asyncio.Future]]:
+        """
+        取下一条，超时返回 None。超时不取消 get()：wait_for 取消一个已经取到元素的 get() 会把该元素丢掉
+        （对应请求永远等不到结果），所以未完成的 get() 留给下一次调用继续等。
+        """
+        if self._getter is None:
+            self._getter = asyncio.ensure_future(self._queue.get())
+        done, _ = await asyncio.wait((self._getter,), timeout=timeout)
+        if not done:
+            return None
+        getter, self._getter = self._getter, None
+        return getter.result()
+
+    async def _collect(self) -> List[Tuple[Hashable, Any, asyncio.Future]]:
+        # 边攒边记在 _held 上：攒批途中被 aclose 取消时，已取出的条目也不会丢
+        self._held = batch = []
+        batch.append(await self._next())
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            if self._getter is None and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            entry = await self._next(timeout)
+            if entry is None:
+                break
+            batch.append(entry)
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            # 在途批次已满时在这里等，期间新请求在队列里排队（有界）
+            await self._sem.acquire()
+            self._held = []
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: List[Tuple[Hashable, Any, asyncio.Future]]) -> None:
+        try:
+            waiters: Dict[Hashable, List[asyncio.Future]] = {}
+            items = []
+            for key, item, fut in batch:
+                if fut.done():      # 等待者已取消（客户端断开）
+                    continue
+                if key not in waiters:
+                    waiters[key] = []
+                    items.append((key, item))
+                waiters[key].append(fut)
+            if not items:
+                return
+            metrics.observe("vqa_batcher_batch_size", len(items), batcher=self.name)
+            try:
+                results = await self.fn([item for _, item in items])
+            except Exception as e:
+                for futs in waiters.values():
+                    for fut in futs:
+                        if not fut.done():
+                            fut.set_exception(e)
+                return
+            for (key, _), res in zip(items, results):
+                for fut in waiters[key]:
+                    if not fut.done():
+                        fut.set_result(res)
+            if len(results) != len(items):
+                err = ValueError(f"{self.name}: 结果数量不匹配，期望 {len(items)}，实际 {len(results)}")
+                for futs in waiters.values():
+                    for fut in futs:
+                        if not fut.done():
+                            fut.set_exception(err)
+        finally:
+            self._sem.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "inflight": len(self._inflight),
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_queue": self.max_queue,
+            "max_inflight": self.max_inflight,
+        }
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        pending, self._held = self._held, []
+        if self._getter is not None:
+            if self._getter.done() and not self._getter.cancelled():
+                pending.append(self._getter.result())
+            else:
+                self._getter.cancel()
+            self._getter = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, _, fut in pending:
+            if not fut.done():
+                fut.set_exception(Overloaded(f"{self.name}: 已关闭"))
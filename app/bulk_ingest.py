@@ -0,0 +1,513 @@
+"""
+离线批量入库：初次导入大量文件（10 万级）时用，三段流水线，段与段之间是有界队列。
+
+    解析（进程池，按文件并行）→ embedding（攒批，多批并发）→ 写入（攒批 upsert，多个写线程）
+
+- 解析：split_file 支持的全部类型，每个进程处理一个文件并顺带算 sha256；已在文件级并行，关闭 PDF 的页级进程池
+- embedding：不同文件的分块拼成满批（--embed-batch），最多 --embed-concurrency 批同时在途，走 Embedder
+  （多节点、重试、持久化 embedding 存储都生效）
+- 写入：每个写线程攒够 --upsert-batch 个点调用一次 insert_many
+- 背压：下游处理不过来时队列写满，上游阻塞等待，内存占用与文件总数无关
+- 断点：每个文件全部分块写入后在状态库（--state，SQLite WAL）记为 done；重跑时跳过大小、mtime、分块参数都没变的 done 文件，
+  其余文件重新处理。点 id 与 /upload 相同（见 app.ingest），崩溃前已写入的分块按 id 跳过，不会重复 embedding / 写入
+- 吞吐：每 --report-interval 秒输出各段分块速率、利用率（忙碌时间 / (墙钟 × 并发数)）与队列占用，
+  结束时给出汇总和瓶颈段（利用率最高的一段），--json 写出汇总
+
+用法（仓库根目录）：
+    python -m app.bulk_ingest /data/corpus --path tenantA --dirs-as-path --json bulk.json
+"""
+import os
+import sys
+import json
+import time
+import queue
+import sqlite3
+import logging
+import argparse
+import contextlib
+import threading
+import multiprocessing
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.config import (
+    VECTOR_BACKEND, QDRANT_URL, QDRANT_COLLECTION, EMBED_BATCH_SIZE, UPSERT_BATCH_SIZE,
+    BULK_PARSE_WORKERS, BULK_QUEUE_SIZE, BULK_STATE_DB,
+)
+from app.file_loader import iter_chunks
+from app.ingest import chunk_params_key, chunk_point_ids, existing_chunks, file_sha256
+from app.parsers import PARSERS
+from app.sharding import normalize_path, path_scope, qualify
+
+logger = logging.getLogger("bulk-ingest")
+
+_DONE = object()
+
+
+def is_candidate(name: str) -> bool:
+    # 跳过隐藏文件、Office 锁文件和常见的临时文件，只收解析器支持的类型
+    if name.startswith((".", "~$")) or name.endswith((".tmp", ".part", "~")):
+        return False
+    return os.path.splitext(name)[1].lower().lstrip(".") in PARSERS
+
+
+def discover(roots: Sequence[str], prefix: str = "", dirs_as_path: bool = False) -> Iterator[Tuple[str, str, str]]:
+    """产出 (本地路径, 文件名, 逻辑路径)；dirs_as_path 时把相对子目录接在 prefix 后面作为逻辑路径。"""
+    for root in roots:
+        if os.path.isfile(root):
+            if is_candidate(os.path.basename(root)):
+                yield root, os.path.basename(root), normalize_path(prefix)
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            rel = os.path.relpath(dirpath, root)
+            doc_path = normalize_path(f"{prefix}/{rel}" if dirs_as_path else prefix)
+            for name in sorted(filenames):
+                if is_candidate(name):
+                    yield os.path.join(dirpath, name), name, doc_path
+
+
+def _parse(path: str, max_chars: int, overlap_ratio: float) -> Tuple[List[dict], str, float]:
+    """进程池任务：返回 (分块, 文件 sha256, 耗时)。"""
+    t0 = time.perf_counter()
+    chunks = [{"text": ch.get("text", "") or "", "meta": ch.get("meta") or {}}
+              for ch in iter_chunks(path, max_chars=max_chars, overlap_ratio=overlap_ratio)]
+    return chunks, file_sha256(path), time.perf_counter() - t0
+
+
+class Checkpoint:
+    """断点状态：每个本地文件一行，记录入库时的大小、mtime、分块参数与结果。"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, filename TEXT NOT NULL, params TEXT NOT NULL,"
+            " size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, sha256 TEXT, status TEXT NOT NULL,"
+            " chunks INTEGER, error TEXT, updated_at REAL NOT NULL)"
+        )
+
+    def done(self) -> Dict[str, Tuple[str, str, int, int]]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT path, filename, params, size, mtime_ns FROM files WHERE status = 'done'").fetchall()
+        return {r[0]: tuple(r[1:]) for r in rows}
+
+    def put(self, path: str, filename: str, params: str, size: int, mtime_ns: int, status: str,
+            sha256: Optional[str] = None, chunks: Optional[int] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files(path, filename, params, size, mtime_ns, sha256, status, chunks, error,"
+                " updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, filename, params, size, mtime_ns, sha256, status, chunks, error, time.time()),
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self.conn.execute("DELETE FROM files")
+
+
+class Stage:
+    """一段流水线的累计量：处理的文件数 / 分块数、忙碌秒数（各并发单元之和）。"""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self.files = 0
+        self.chunks = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, chunks: int, busy: float, files: int = 0) -> None:
+        with self._lock:
+            self.chunks += chunks
+            self.busy += busy
+            self.files += files
+
+    def summary(self, wall: float) -> Dict[str, Any]:
+        wall = max(wall, 1e-9)
+        return {
+            "workers": self.workers,
+            "files": self.files,
+            "chunks": self.chunks,
+            "busy_s": round(self.busy, 2),
+            "chunks_per_s": round(self.chunks / wall, 1),
+            "utilization": round(min(1.0, self.busy / (wall * self.workers)), 3),
+        }
+
+
+class _File:
+    __slots__ = ("src", "filename", "doc_path", "size", "mtime_ns", "sha256", "content_type",
+                 "existing", "current", "pending", "failed", "chunks", "lock")
+
+    def __init__(self, src: str, filename: str, doc_path: str, size: int, mtime_ns: int):
+        self.src, self.filename, self.doc_path = src, filename, doc_path
+        self.size, self.mtime_ns = size, mtime_ns
+        self.sha256: Optional[str] = None
+        self.content_type: Optional[str] = None
+        self.existing: dict = {}
+        self.current: set = set()
+        self.pending = 0
+        self.failed = 0
+        self.chunks = 0
+        self.lock = threading.Lock()
+
+
+class BulkIngest:
+    def __init__(self, embedder, db, checkpoint: Checkpoint, max_chars: int = 500, overlap_ratio: float = 0.2,
+                 parse_workers: int = BULK_PARSE_WORKERS, embed_batch: int = EMBED_BATCH_SIZE,
+                 embed_concurrency: Optional[int] = None, upsert_batch: int = UPSERT_BATCH_SIZE,
+                 upsert_workers: int = 2, queue_size: int = BULK_QUEUE_SIZE, report_interval: float = 10.0,
+                 serialize_db: bool = False):
+        self.embedder = embedder
+        self.db = db
+        self.checkpoint = checkpoint
+        self.max_chars = max_chars
+        self.overlap_ratio = overlap_ratio
+        self.params_key = chunk_params_key(max_chars, overlap_ratio)
+        self.embed_batch = max(1, embed_batch)
+        self.upsert_batch = max(1, upsert_batch)
+        self.report_interval = report_interval
+        self.stages = {
+            "parse": Stage("parse", parse_workers),
+            "embed": Stage("embed", embed_concurrency or embedder.concurrency),
+            "write": Stage("write", upsert_workers),
+        }
+        # 解析结果按文件排队，embedding 结果按批排队
+        self.parsed: "queue.Queue" = queue.Queue(max(1, 2 * self.stages["parse"].workers))
+        self.embedded: "queue.Queue" = queue.Queue(max(1, queue_size))
+        self.totals: Counter = Counter()
+        self._totals_lock = threading.Lock()
+        self._stop = threading.Event()
+        # Qdrant 本地模式（":memory:" 或目录）的客户端不是线程安全的，所有库操作串行
+        self._db_lock = threading.Lock() if serialize_db else contextlib.nullcontext()
+
+    def _count(self, **kv: int) -> None:
+        with self._totals_lock:
+            self.totals.update(kv)
+
+    # -------------------- 第 1 段：解析 --------------------
+    def _parse_stage(self, files: List[_File]) -> None:
+        stage = self.stages["parse"]
+        # spawn：本进程里已有 embedding / 写入线程，fork 不安全
+        ctx = multiprocessing.get_context("spawn")
+        try:
+            with ProcessPoolExecutor(stage.workers, mp_context=ctx) as ex:
+                todo = iter(files)
+                inflight: Dict[Any, _File] = {}
+                while True:
+                    while len(inflight) < 2 * stage.workers and not self._stop.is_set():
+                        f = next(todo, None)
+                        if f is None:
+                            break
+                        inflight[ex.submit(_parse, f.src, self.max_chars, self.overlap_ratio)] = f
+                    if not inflight:
+                        break
+                    ready, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+                    for fut in ready:
+                        f = inflight.pop(fut)
+                        try:
+                            chunks, f.sha256, busy = fut.result()
+                        except Exception as e:
+                            logger.error("解析失败 %s: %s", f.src, e)
+                            self._finish(f, error=f"parse: {e}")
+                            continue
+                        stage.add(len(chunks), busy, files=1)
+                        self.parsed.put((f, chunks))
+        finally:
+            self.parsed.put(_DONE)
+
+    # -------------------- 第 2 段：embedding --------------------
+    def _embed_stage(self) -> None:
+        stage = self.stages["embed"]
+        sem = threading.BoundedSemaphore(2 * stage.workers)
+        pool = ThreadPoolExecutor(stage.workers, thread_name_prefix="bulk-embed")
+        buf: List[Tuple[_File, str, str, dict]] = []
+
+        def run(batch):
+            try:
+                t0 = time.perf_counter()
+                try:
+                    vecs = self.embedder.embed([text for _, _, text, _ in batch])
+                except Exception as e:
+                    logger.error("embedding 失败（%d 个分块）: %s", len(batch), e)
+                    self._settle(batch, ok=False)
+                    return
+                stage.add(len(batch), time.perf_counter() - t0)
+                self.embedded.put((batch, vecs))
+            finally:
+                sem.release()
+
+        def submit(batch):
+            sem.acquire()
+            pool.submit(run, batch)
+
+        try:
+            while True:
+                item = self.parsed.get()
+                if item is _DONE:
+                    break
+                f, chunks = item
+                for rec in self._plan(f, chunks):
+                    buf.append(rec)
+                    if len(buf) >= self.embed_batch:
+                        submit(buf)
+                        buf = []
+            if buf:
+                submit(buf)
+            pool.shutdown(wait=True)
+        finally:
+            for _ in range(self.stages["write"].workers):
+                self.embedded.put(_DONE)
+
+    def _plan(self, f: _File, chunks: List[dict]) -> List[Tuple[_File, str, str, dict]]:
+        """计算点 id，跳过已写入的分块（元信息变了的只覆盖 payload）；返回待 embedding 的 (文件, id, 文本, meta)。"""
+        texts = [ch["text"] for ch in chunks]
+        ids = chunk_point_ids(f.filename, texts, self.params_key)
+        f.chunks = len(chunks)
+        f.content_type = chunks[0]["meta"].get("content_type") if chunks else None
+        try:
+            with self._db_lock:
+                f.existing = existing_chunks(self.db, f.filename)
+        except Exception as e:
+            logger.error("查询已有分块失败 %s: %s", f.filename, e)
+            self._finish(f, error=f"existing_chunks: {e}")
+            return []
+        f.current = set(ids)
+        scope = path_scope(f.doc_path)
+        todo, refresh = [], []
+        for pid, ch in zip(ids, chunks):
+            meta = dict(ch["meta"])
+            meta["filename"] = f.filename
+            meta["path"] = f.doc_path
+            meta["path_scope"] = scope
+            if pid not in f.existing:
+                todo.append((f, pid, ch["text"], meta))
+            elif f.existing[pid] != meta:
+                refresh.append((f, pid, ch["text"], meta))
+        if refresh:
+            try:
+                with self._db_lock:
+                    self.db.update_payloads([r[1] for r in refresh], [r[2] for r in refresh], [r[3] for r in refresh])
+            except Exception as e:
+                logger.error("刷新分块元信息失败 %s: %s", f.filename, e)
+                f.failed += len(refresh)
+        self._count(chunks=len(chunks), new_chunks=len(todo))
+        if not todo:
+            self._finish(f)
+        else:
+            # 先把待写数量记全，之后写入线程才可能把它减到 0
+            f.pending = len(todo)
+        return todo
+
+    # -------------------- 第 3 段：写入 --------------------
+    def _write_stage(self) -> None:
+        stage = self.stages["write"]
+        recs: List[Tuple[_File, str, str, dict]] = []
+        vecs: List[Any] = []
+        done = False
+        while not done:
+            try:
+                # 攒批：缓冲为空时阻塞等待，已有数据时队列一空就写
+                item = self.embedded.get(timeout=None if not recs else 0.05)
+            except queue.Empty:
+                item = None
+            if item is _DONE:
+                done = True
+            elif item is not None:
+                batch, batch_vecs = item
+                recs.extend(batch)
+                vecs.extend(batch_vecs)
+                if len(recs) < self.upsert_batch:
+                    continue
+            if not recs:
+                continue
+            t0 = time.perf_counter()
+            try:
+                with self._db_lock:
+                    self.db.insert_many(vecs, [r[2] for r in recs], [r[3] for r in recs], ids=[r[1] for r in recs])
+            except Exception as e:
+                logger.error("写入失败（%d 个分块）: %s", len(recs), e)
+                self._settle(recs, ok=False)
+            else:
+                stage.add(len(recs), time.perf_counter() - t0)
+                self._settle(recs, ok=True)
+            recs, vecs = [], []
+
+    def _settle(self, recs: Sequence[Tuple[_File, str, str, dict]], ok: bool) -> None:
+        by_file = Counter(r[0] for r in recs)
+        for f, n in by_file.items():
+            with f.lock:
+                f.pending -= n
+                if not ok:
+                    f.failed += n
+                last = f.pending == 0
+            if last:
+                self._finish(f)
+
+    def _finish(self, f: _File, error: Optional[str] = None) -> None:
+        """文件的全部分块都已处理：删除旧分块、更新清单、记断点。写入失败的文件不删旧分块，状态记为 error，重跑时重试。"""
+        if error is None:
+            try:
+                stale = list(set(f.existing) - f.current)
+                with self._db_lock:
+                    if f.failed:
+                        # 未完整入库：只刷新段数，content_hash / ingested_at 保留上次成功时的值（同 ingest_file）
+                        self.db.update_manifest(f.filename, content_type=f.content_type, path=f.doc_path)
+                    else:
+                        if stale:
+                            self.db.delete_ids(stale)
+                        self.db.update_manifest(f.filename, content_type=f.content_type, path=f.doc_path,
+                                                bytes=f.size, content_hash=f.sha256, ingested_at=time.time())
+            except Exception as e:
+                error = f"finalize: {e}"
+            if f.failed and error is None:
+                error = f"{f.failed} chunks failed"
+        self.checkpoint.put(f.src, f.filename, self.params_key, f.size, f.mtime_ns,
+                            "error" if error else "done", f.sha256, f.chunks, error)
+        if error:
+            self._count(error=1)
+            logger.warning("未完成 %s: %s", f.filename, error)
+        else:
+            self._count(done=1)
+
+    # -------------------- 调度 / 报告 --------------------
+    def plan(self, entries: Iterator[Tuple[str, str, str]]) -> List[_File]:
+        """过滤出需要处理的文件：断点里 done 且大小、mtime、分块参数、文件名都没变的跳过。"""
+        done = self.checkpoint.done()
+        files, seen = [], {}
+        for src, name, doc_path in entries:
+            filename = qualify(name, doc_path)
+            if filename in seen:
+                logger.warning("文件名重复，跳过 %s（与 %s 同为 %s）", src, seen[filename], filename)
+                self._count(duplicate=1)
+                continue
+            seen[filename] = src
+            try:
+                st = os.stat(src)
+            except OSError as e:
+                logger.warning("无法读取 %s: %s", src, e)
+                continue
+            if done.get(src) == (filename, self.params_key, st.st_size, st.st_mtime_ns):
+                self._count(skipped=1)
+                continue
+            files.append(_File(src, filename, doc_path, st.st_size, st.st_mtime_ns))
+        return files
+
+    def run(self, files: List[_File]) -> Dict[str, Any]:
+        self._count(files=len(files))
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=self._parse_stage, args=(files,), name="bulk-parse", daemon=True),
+                   threading.Thread(target=self._embed_stage, name="bulk-embed-feed", daemon=True)]
+        threads += [threading.Thread(target=self._write_stage, name=f"bulk-write-{i}", daemon=True)
+                    for i in range(self.stages["write"].workers)]
+        for t in threads:
+            t.start()
+        try:
+            while True:
+                alive = [t for t in threads if t.is_alive()]
+                if not alive:
+                    break
+                alive[0].join(self.report_interval)
+                if alive[0].is_alive():
+                    logger.info("%s", self.progress_line(time.perf_counter() - t0))
+        except KeyboardInterrupt:
+            # 已完成的文件都在断点里，重跑即可继续；在途的文件下次重新处理
+            self._stop.set()
+            logger.warning("中断：已完成的文件已记录在 %s，重新运行即可继续", self.checkpoint.path)
+            raise
+        return self.summary(time.perf_counter() - t0)
+
+    def progress_line(self, wall: float) -> str:
+        parts = [f"files {self.totals['done'] + self.totals['error']}/{self.totals['files']}"]
+        for s in self.stages.values():
+            d = s.summary(wall)
+            parts.append(f"{s.name} {d['chunks_per_s']:.0f} chunks/s util {d['utilization']:.0%}")
+        parts.append(f"queues parsed {self.parsed.qsize()}/{self.parsed.maxsize} "
+                     f"embedded {self.embedded.qsize()}/{self.embedded.maxsize}")
+        return " | ".join(parts)
+
+    def summary(self, wall: float) -> Dict[str, Any]:
+        stages = {name: s.summary(wall) for name, s in self.stages.items()}
+        return {
+            "wall_s": round(wall, 2),
+            "files": self.totals["files"],
+            "done": self.totals["done"],
+            "errors": self.totals["error"],
+            "skipped": self.totals["skipped"],
+            "duplicates": self.totals["duplicate"],
+            "chunks": self.totals["chunks"],
+            "new_chunks": self.totals["new_chunks"],
+            "chunks_per_s": round(self.totals["chunks"] / max(wall, 1e-9), 1),
+            "stages": stages,
+            "bottleneck": max(stages, key=lambda n: stages[n]["utilization"]) if self.totals["files"] else None,
+        }
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    # 每个 embedding 请求一行的 httpx 日志会淹没进度报告
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    ap = argparse.ArgumentParser(description="离线批量入库：解析 → embedding → 写入三段流水线，可断点续跑")
+    ap.add_argument("inputs", nargs="+", help="文件或目录（递归）")
+    ap.add_argument("--path", default="", help="逻辑路径前缀（见 /upload 的 path）")
+    ap.add_argument("--dirs-as-path", action="store_true", help="把相对子目录接在 --path 后作为逻辑路径")
+    ap.add_argument("--collection", default=QDRANT_COLLECTION)
+    ap.add_argument("--chunk-size", type=int, default=500)
+    ap.add_argument("--overlap", type=float, default=0.2)
+    ap.add_argument("--parse-workers", type=int, default=BULK_PARSE_WORKERS)
+    ap.add_argument("--embed-batch", type=int, default=EMBED_BATCH_SIZE)
+    ap.add_argument("--embed-concurrency", type=int, default=0, help="同时在途的 embedding 批次，0 为 Embedder 的默认并发")
+    ap.add_argument("--upsert-batch", type=int, default=UPSERT_BATCH_SIZE)
+    ap.add_argument("--upsert-workers", type=int, default=2)
+    ap.add_argument("--queue", type=int, default=BULK_QUEUE_SIZE, help="embedding 与写入之间最多排队的批次")
+    ap.add_argument("--state", default=BULK_STATE_DB, help="断点状态库")
+    ap.add_argument("--restart", action="store_true", help="清空断点，全部重新处理（已写入的分块仍按 id 跳过）")
+    ap.add_argument("--report-interval", type=float, default=10.0)
+    ap.add_argument("--json", default="", help="汇总写入该文件")
+    args = ap.parse_args(argv)
+
+    # 已按文件并行：关闭 PDF 的页级进程池，避免进程池嵌套（子进程继承环境变量）
+    os.environ["PDF_WORKERS"] = "1"
+
+    from app.embedder import Embedder
+    from app.vector_db import create_db
+
+    checkpoint = Checkpoint(args.state)
+    if args.restart:
+        checkpoint.clear()
+    embedder = Embedder()
+    db = create_db(args.collection)
+    db.ensure_schema()
+    bulk = BulkIngest(
+        embedder, db, checkpoint, max_chars=args.chunk_size, overlap_ratio=args.overlap,
+        parse_workers=args.parse_workers, embed_batch=args.embed_batch,
+        embed_concurrency=args.embed_concurrency or None, upsert_batch=args.upsert_batch,
+        upsert_workers=args.upsert_workers, queue_size=args.queue, report_interval=args.report_interval,
+        serialize_db=VECTOR_BACKEND == "qdrant" and not QDRANT_URL.startswith(("http://", "https://")),
+    )
+    files = bulk.plan(discover(args.inputs, args.path, args.dirs_as_path))
+    logger.info("待处理 %d 个文件（跳过已完成 %d 个），断点: %s", len(files), bulk.totals["skipped"], args.state)
+    try:
+        result = bulk.run(files)
+    finally:
+        embedder.close()
+
+    logger.info("%s", bulk.progress_line(result["wall_s"]))
+    logger.info("完成 %d / 失败 %d / 跳过 %d，分块 %d（新写入 %d），%.1f chunks/s，瓶颈: %s",
+                result["done"], result["errors"], result["skipped"], result["chunks"], result["new_chunks"],
+                result["chunks_per_s"], result["bottleneck"])
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
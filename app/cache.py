@@ -0,0 +1,244 @@
+# app/cache.py
+"""
+LRU + TTL 缓存。
+
+- TTLCache：进程内，OrderedDict 实现，线程安全
+- SQLiteCache：落在本机文件（默认 /dev/shm，即共享内存）上的 SQLite，多个 gunicorn worker 共用
+  两者接口一致：get / set / clear / stats。
+- Generation：集合代数标记，写操作后 bump，读侧把当前值并入缓存键，旧条目自然失效
+命中 / 未命中同时计入 metrics 的 vqa_cache_requests_total（按缓存名），可跨 worker 汇总命中率。
+"""
+import os
+import time
+import uuid
+import pickle
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from app import metrics
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600, name: str = "cache"):
+        self.name = name
+        self.maxsize = max(0, int(maxsize))
+        self.ttl = float(ttl)
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                metrics.inc("vqa_cache_requests_total", cache=self.name, result="miss")
+                return default
+            expires_at, value = item
+            if self.ttl > 0 and expires_at < now:
+                del self._data[key]
+                self.expired += 1
+                self.misses += 1
+                metrics.inc("vqa_cache_requests_total", cache=self.name, result="miss")
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            metrics.inc("vqa_cache_requests_total", cache=self.name, result="hit")
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "backend": "memory",
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
+
+
+class SQLiteCache:
+    """
+    跨进程共享的 LRU + TTL 缓存。值用 pickle 序列化（文件仅本机服务自己读写）。
+    命中计数为本进程视角；淘汰按 last_used 最旧优先，每 _EVICT_EVERY 次写入检查一次容量。
+    """
+    _EVICT_EVERY = 64
+
+    def __init__(self, path: str, maxsize: int = 1024, ttl: float = 3600, name: str = "cache"):
+        self.name = name
+        self.path = path
+        self.maxsize = max(0, int(maxsize))
+        self.ttl = float(ttl)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def _db(self) -> sqlite3.Connection:
+        # fork 之后不能复用父进程的连接，按 pid 懒加载
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+                " expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_last_used ON cache(last_used)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return key if isinstance(key, str) else repr(key)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        k = self._key(key)
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT value, expires_at FROM cache WHERE key = ?", (k,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.inc("vqa_cache_requests_total", cache=self.name, result="miss")
+                return default
+            if self.ttl > 0 and row[1] < now:
+                db.execute("DELETE FROM cache WHERE key = ?", (k,))
+                self.expired += 1
+                self.misses += 1
+                metrics.inc("vqa_cache_requests_total", cache=self.name, result="miss")
+                return default
+            db.execute("UPDATE cache SET last_used = ? WHERE key = ?", (now, k))
+            self.hits += 1
+            metrics.inc("vqa_cache_requests_total", cache=self.name, result="hit")
+        return pickle.loads(row[0])
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize == 0:
+            return
+        k = self._key(key)
+        now = time.time()
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO cache(key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (k, blob, now + self.ttl, now),
+            )
+            self._writes += 1
+            if self._writes % self._EVICT_EVERY == 0:
+                self._evict(db, now)
+
+    def _evict(self, db: sqlite3.Connection, now: float) -> None:
+        if self.ttl > 0:
+            self.expired += db.execute("DELETE FROM cache WHERE expires_at < ?", (now,)).rowcount
+        size = db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if size > self.maxsize:
+            self.evictions += db.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_used LIMIT ?)",
+                (size - self.maxsize,),
+            ).rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db().execute("DELETE FROM cache")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "backend": "sqlite",
+            "path": self.path,
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
+
+
+class Generation:
+    """
+    集合代数标记，存放在共享目录下的小文件里，所有 worker / 进程可见。
+    bump() 原子替换为新的随机值（无需读-改-写加锁）；current() 每次读文件，tmpfs 上开销可忽略。
+    注意：bump 必须在写入完成之后调用，保证读到新代数的请求一定能看到新数据。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def current(self) -> str:
+        try:
+            with open(self.path, "r") as f:
+                return f.read().strip() or "0"
+        except FileNotFoundError:
+            return "0"
+
+    def bump(self) -> str:
+        token = uuid.uuid4().hex
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(token)
+        os.replace(tmp, self.path)
+        return token
+
+
+def default_cache_dir() -> str:
+    # 优先 /dev/shm（tmpfs，跨 worker 共享且不落盘），否则系统临时目录
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "vector_qa_cache")
+
+
+def make_cache(name: str, maxsize: int, ttl: float, backend: str = "memory", cache_dir: str = ""):
+    """按配置创建缓存：backend = memory | sqlite。"""
+    if backend == "sqlite":
+        path = os.path.join(cache_dir or default_cache_dir(), f"{name}.sqlite3")
+        return SQLiteCache(path, maxsize=maxsize, ttl=ttl, name=name)
+    if backend != "memory":
+        raise ValueError(f"不支持的 CACHE_BACKEND: {backend}")
+    return TTLCache(maxsize=maxsize, ttl=ttl, name=name)
@@ -5,11 +5,153 @@ load_dotenv()
 
 import os
 
+# 本地状态目录（任务状态、embedding 存储等 SQLite 文件）
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
 EMBEDDING_METHOD = os.getenv("EMBEDDING_METHOD", "ollama")
 EMBEDDING_MODEL  = os.getenv("EMBEDDING_MODEL", "bge-m3:latest")
 EMBEDDING_DIM    = int(os.getenv("EMBEDDING_DIM", "1024"))
 
 OLLAMA_HOST      = os.getenv("OLLAMA_HOST", "http://host.docker.internal:11434")
 
+# 批量 embedding：每次 /api/embed 请求携带的文本条数、每个节点的并发请求数、单批超时（秒，含换节点重试）
+EMBED_BATCH_SIZE  = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_TIMEOUT     = float(os.getenv("EMBED_TIMEOUT", "60"))
+
+# 多个 embedding 节点（OLLAMA_BASE_URL 逗号分隔，见 app.embed_pool）：单次尝试超时 EMBED_ATTEMPT_TIMEOUT 秒（0 只受 EMBED_TIMEOUT 限制），
+# 失败后最多换节点重试 EMBED_RETRIES 次；连续失败 EMBED_EJECT_FAILURES 次或延迟超过其他节点中位数 EMBED_SLOW_FACTOR 倍（0 不判慢）
+# 的节点剔除 EMBED_EJECT_SECONDS 秒；每 EMBED_HEALTH_INTERVAL 秒探活一次（0 关闭）
+EMBED_ATTEMPT_TIMEOUT = float(os.getenv("EMBED_ATTEMPT_TIMEOUT", "0"))
+EMBED_RETRIES         = int(os.getenv("EMBED_RETRIES", "2"))
+EMBED_EJECT_FAILURES  = int(os.getenv("EMBED_EJECT_FAILURES", "3"))
+EMBED_EJECT_SECONDS   = float(os.getenv("EMBED_EJECT_SECONDS", "30"))
+EMBED_SLOW_FACTOR     = float(os.getenv("EMBED_SLOW_FACTOR", "3"))
+EMBED_HEALTH_INTERVAL = float(os.getenv("EMBED_HEALTH_INTERVAL", "5"))
+
+# 查询向量微批：并发 /search 的查询向量最多攒 EMBED_COALESCE_WAIT_MS 毫秒或 EMBED_COALESCE_MAX_BATCH 条后合并为一次请求；
+# 在途批次数上限为 EMBED_CONCURRENCY，排队超过 EMBED_COALESCE_QUEUE 条时直接返回 503。EMBED_COALESCE=0 关闭
+EMBED_COALESCE           = os.getenv("EMBED_COALESCE", "1") != "0"
+EMBED_COALESCE_WAIT_MS   = float(os.getenv("EMBED_COALESCE_WAIT_MS", "2"))
+EMBED_COALESCE_MAX_BATCH = int(os.getenv("EMBED_COALESCE_MAX_BATCH", "32"))
+EMBED_COALESCE_QUEUE     = int(os.getenv("EMBED_COALESCE_QUEUE", "1024"))
+
+# 持久化 embedding 存储：按 (model, sha256(text)) 复用已算过的向量；EMBED_STORE=0 关闭
+EMBED_STORE           = os.getenv("EMBED_STORE", "1") != "0"
+EMBED_STORE_PATH      = os.getenv("EMBED_STORE_PATH", os.path.join(DATA_DIR, "embeddings.sqlite3"))
+EMBED_STORE_MAX_ITEMS = int(os.getenv("EMBED_STORE_MAX_ITEMS", "2000000"))   # 0 表示不限
+
+# 缓存：CACHE_BACKEND = memory（进程内）| sqlite（CACHE_DIR 下的文件，多 worker 共享，默认 /dev/shm）
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_DIR     = os.getenv("CACHE_DIR", "")
+
+# 查询向量缓存：按 (model, 规范化 query) 缓存，SIZE=0 关闭
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL  = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+
+# /search 结果缓存：按 (集合代数, query, top_k, min_score, max_return) 缓存，SIZE=0 关闭
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+SEARCH_CACHE_TTL  = float(os.getenv("SEARCH_CACHE_TTL", "600"))
+
+# 向量库后端：qdrant | numpy（进程内 memmap 矩阵 + SQLite payload，适合小租户 / CI，无需 Qdrant 服务）
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "qdrant").strip().lower()
+
+# numpy 后端：数据目录；点数达到 NUMPY_IVF_MIN_POINTS 且 NUMPY_IVF_LISTS > 0 时启用 IVF 粗聚类，
+# 每次查询只扫描最近的 NUMPY_IVF_NPROBE 个簇；NUMPY_SEARCH_CHUNK 为精确检索每次矩阵乘的行数
+NUMPY_DB_DIR          = os.getenv("NUMPY_DB_DIR", os.path.join(DATA_DIR, "numpy_db"))
+NUMPY_IVF_LISTS       = int(os.getenv("NUMPY_IVF_LISTS", "0"))
+NUMPY_IVF_NPROBE      = int(os.getenv("NUMPY_IVF_NPROBE", "8"))
+NUMPY_IVF_MIN_POINTS  = int(os.getenv("NUMPY_IVF_MIN_POINTS", "50000"))
+NUMPY_SEARCH_CHUNK    = int(os.getenv("NUMPY_SEARCH_CHUNK", "65536"))
+
 QDRANT_URL        = os.getenv("QDRANT_URL", "http://host.docker.internal:6333")
 QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "pdf_knowledge_bge_m3")
+
+# 路径分区（见 app.sharding）：入库时可指定 path（如 "tenantA/docs"），/search 的 path 只检索该路径及其子路径。
+# SHARD_MODE = filter（默认，同一集合内按 payload 的 path_scope 过滤）| collection（按 path 第一段拆成独立集合
+# <QDRANT_COLLECTION>__p_<段>，无 path 的留在主集合；不带 path 的检索并发查询全部分片，最多 SHARD_FANOUT 个同时在途）
+SHARD_MODE   = os.getenv("SHARD_MODE", "filter").strip().lower()
+SHARD_FANOUT = int(os.getenv("SHARD_FANOUT", "8"))
+
+# 向量检索相似度阈值（两种后端共用），<=0 表示不设阈值
+SCORE_THRESHOLD   = float(os.getenv("SCORE_THRESHOLD", "0"))
+
+# HNSW 索引：m / ef_construct 用于建集合（留空用 Qdrant 默认值；与已有集合不同时会更新并触发重建索引），
+# HNSW_EF 为查询时的 hnsw_ef（留空用默认值）
+HNSW_M            = int(os.getenv("HNSW_M") or 0) or None
+HNSW_EF_CONSTRUCT = int(os.getenv("HNSW_EF_CONSTRUCT") or 0) or None
+HNSW_EF           = int(os.getenv("HNSW_EF") or 0) or None
+
+# 向量量化：QUANTIZATION = int8（标量）| binary（二值，适合 1024 维以上的模型）| none（关闭已有量化）；
+# 留空表示不改动集合现有设置。启用量化时原始向量默认放磁盘（VECTORS_ON_DISK），量化向量常驻内存
+QUANTIZATION           = os.getenv("QUANTIZATION", "").strip().lower()
+QUANTIZATION_QUANTILE  = float(os.getenv("QUANTIZATION_QUANTILE", "0.99"))
+VECTORS_ON_DISK        = os.getenv("VECTORS_ON_DISK", "1" if QUANTIZATION in ("int8", "binary") else "0") != "0"
+
+# 量化检索：先按 top_k * SEARCH_OVERSAMPLING 取候选，再用原始向量重新打分（SEARCH_RESCORE=0 关闭）
+SEARCH_OVERSAMPLING = float(os.getenv("SEARCH_OVERSAMPLING", "2.0"))
+SEARCH_RESCORE      = os.getenv("SEARCH_RESCORE", "1") != "0"
+
+# 需要建 keyword 索引的 payload 字段
+PAYLOAD_INDEX_FIELDS = [f for f in os.getenv("PAYLOAD_INDEX_FIELDS", "filename,content_type,path_scope").split(",") if f]
+
+# 词法索引（SQLite FTS5 + BM25，中文按二字切分）：LEXICAL_INDEX=0 关闭，关键字兜底退回旧的 scroll 子串扫描；
+# 已有数据的集合在 `python -m app.lexical rebuild` 之前同样走子串扫描，最多扫 FALLBACK_SCAN_LIMIT 个分块
+LEXICAL_INDEX       = os.getenv("LEXICAL_INDEX", "1") != "0"
+LEXICAL_INDEX_PATH  = os.getenv("LEXICAL_INDEX_PATH", os.path.join(DATA_DIR, "lexical.sqlite3"))
+FALLBACK_SCAN_LIMIT = int(os.getenv("FALLBACK_SCAN_LIMIT", "2000"))
+
+# /search 默认模式：vector | hybrid（向量 + 关键字，RRF 融合）| keyword；
+# 混合检索时每路取 top_k * HYBRID_CANDIDATES 条候选，RRF_K 为融合常数
+SEARCH_MODE       = os.getenv("SEARCH_MODE", "vector")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "3"))
+RRF_K             = int(os.getenv("RRF_K", "60"))
+
+# 检索后处理（可被 /search 请求覆盖）：
+# MMR 去冗余：先取 top_k * MMR_FETCH_FACTOR 条（带向量）再按 MMR 选 top_k，MMR_LAMBDA 越小越强调多样性
+# 重叠合并：同文件首尾重叠 >= COLLAPSE_MIN_OVERLAP 字符或行号相邻的结果合并为一段，合并后最长 COLLAPSE_MAX_CHARS（0 不限）
+SEARCH_MMR           = os.getenv("SEARCH_MMR", "0") != "0"
+MMR_LAMBDA           = float(os.getenv("MMR_LAMBDA", "0.5"))
+MMR_FETCH_FACTOR     = int(os.getenv("MMR_FETCH_FACTOR", "4"))
+SEARCH_COLLAPSE      = os.getenv("SEARCH_COLLAPSE", "0") != "0"
+COLLAPSE_MIN_OVERLAP = int(os.getenv("COLLAPSE_MIN_OVERLAP", "20"))
+COLLAPSE_MAX_CHARS   = int(os.getenv("COLLAPSE_MAX_CHARS", "4000"))
+
+# 批量写入：每次 upsert 的点数
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "256"))
+
+# PDF 解析：进程池大小、每个任务的页数、达到多少页才启用进程池（小文件进程启动开销不划算）
+PDF_WORKERS            = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK     = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))
+
+# 表格（CSV/TSV/Excel）：流式读取的块大小（行）、每个分块最多打包的行数（<=1 为旧的一行一块）
+CSV_READ_CHUNKSIZE   = int(os.getenv("CSV_READ_CHUNKSIZE", "10000"))
+TABLE_ROWS_PER_CHUNK = int(os.getenv("TABLE_ROWS_PER_CHUNK", "50"))
+
+# 同步目录：监听路径、状态库、事件去抖（秒）、无 inotify 时的轮询间隔、监听模式下的兜底全量扫描间隔
+SYNC_WATCH_PATH      = os.getenv("SYNC_WATCH_PATH", "/data/sync_folder")
+SYNC_STATE_DB        = os.getenv("SYNC_STATE_DB", "/data/sync_state.sqlite3")
+SYNC_DEBOUNCE        = float(os.getenv("SYNC_DEBOUNCE", "2"))
+SYNC_POLL_INTERVAL   = float(os.getenv("SYNC_POLL_INTERVAL", "10"))
+SYNC_RESCAN_INTERVAL = float(os.getenv("SYNC_RESCAN_INTERVAL", "300"))
+
+# 离线批量入库（python -m app.bulk_ingest）：解析进程数、阶段之间的队列长度（批次）、断点状态库
+BULK_PARSE_WORKERS = int(os.getenv("BULK_PARSE_WORKERS", str(os.cpu_count() or 1)))
+BULK_QUEUE_SIZE    = int(os.getenv("BULK_QUEUE_SIZE", "64"))
+BULK_STATE_DB      = os.getenv("BULK_STATE_DB", os.path.join(DATA_DIR, "bulk_ingest.sqlite3"))
+
+# 后台入库：线程池大小、上传临时目录（空表示系统临时目录）、落盘时的读块大小
+INGEST_WORKERS    = int(os.getenv("INGEST_WORKERS", "2"))
+UPLOAD_TMP_DIR    = os.getenv("UPLOAD_TMP_DIR", "")
+UPLOAD_READ_BLOCK = int(os.getenv("UPLOAD_READ_BLOCK", str(1 << 20)))
+
+# 指标：METRICS=0 关闭采集（Server-Timing 响应头不受影响）；各 worker 的快照写到 METRICS_DIR
+# （空表示 /dev/shm 下的 vector_qa_cache/metrics），最多每 METRICS_FLUSH_INTERVAL 秒落一次盘
+METRICS                = os.getenv("METRICS", "1") != "0"
+METRICS_DIR            = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1"))
+
+# gunicorn 预加载：PRELOAD=1 时主进程先导入应用与全部文件解析器（pandas / PyMuPDF 等）并 gc.freeze()，
+# 再 fork 出 worker，这些只读内存页由各 worker 共享；Qdrant / Ollama 连接、线程池、SQLite 连接都在 worker 里按需创建
+PRELOAD = os.getenv("PRELOAD", "0") != "0"
@@ -0,0 +1,212 @@
+# app/embed_pool.py
+"""
+embedding 节点池：OLLAMA_BASE_URL 可写多个地址（逗号分隔），每个批次交给在途请求最少的健康节点。
+
+- 选择：未被剔除的节点中在途请求最少者，相同时取延迟 EWMA 较小者；全部被剔除时选最早恢复的那个（宁可慢，不全拒）
+- 重试：连接错误 / 超时 / 5xx / 返回条数不对时换一个没试过的节点，最多 EMBED_RETRIES 次，
+  整批（含重试）不超过 EMBED_TIMEOUT 秒；4xx 是请求本身的问题，直接抛出
+- 剔除：连续失败 EMBED_EJECT_FAILURES 次，或延迟 EWMA 超过其余健康节点中位数的 EMBED_SLOW_FACTOR 倍，
+  剔除 EMBED_EJECT_SECONDS 秒；至少保留一个健康节点
+- 探活：后台线程每 EMBED_HEALTH_INTERVAL 秒 GET /api/version，因失败被剔除的节点探活成功即恢复，
+  探活失败的节点直接剔除；只有一个节点时不探活。线程在第一次选节点时启动，fork 后在子进程里重新启动
+- 状态用线程锁保护，同步入库线程池和事件循环共用同一个池
+"""
+import os
+import time
+import logging
+import threading
+import statistics
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+
+from app import metrics
+from app.config import (
+    EMBED_TIMEOUT, EMBED_ATTEMPT_TIMEOUT, EMBED_RETRIES,
+    EMBED_EJECT_FAILURES, EMBED_EJECT_SECONDS, EMBED_SLOW_FACTOR, EMBED_HEALTH_INTERVAL,
+)
+
+logger = logging.getLogger("embed_pool")
+
+# 延迟 EWMA 的平滑系数，以及参与慢节点判断前至少要有的样本数
+_EWMA_ALPHA = 0.2
+_SLOW_MIN_SAMPLES = 5
+
+
+def parse_urls(value: str) -> List[str]:
+    urls = [u.strip().rstrip("/") for u in (value or "").split(",") if u.strip()]
+    return list(dict.fromkeys(urls))
+
+
+def is_host_fault(e: BaseException) -> bool:
+    """换个节点可能成功的错误；4xx 之类请求本身的错误换节点也没用。"""
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code >= 500
+    return isinstance(e, (httpx.TransportError, ValueError))
+
+
+def _brief(e: BaseException) -> str:
+    # httpx 的错误信息带一行 MDN 链接，日志里只留第一行
+    return (str(e).splitlines() or [type(e).__name__])[0]
+
+
+class Endpoint:
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.latency: Optional[float] = None    # 成功请求耗时的 EWMA（秒）
+        self.samples = 0
+        self.failures = 0                       # 连续失败次数
+        self.ejected_until = 0.0
+        self.eject_reason: Optional[str] = None
+        self.requests = 0
+        self.errors = 0
+
+    def ejected(self, now: float) -> bool:
+        return self.ejected_until > now
+
+    def stats(self, now: float) -> Dict:
+        return {
+            "url": self.url,
+            "healthy": not self.ejected(now),
+            "eject_reason": self.eject_reason if self.ejected(now) else None,
+            "ejected_for_s": round(max(0.0, self.ejected_until - now), 1),
+            "outstanding": self.outstanding,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+class EndpointPool:
+    def __init__(self, urls: Sequence[str], timeout: float = EMBED_TIMEOUT,
+                 attempt_timeout: float = EMBED_ATTEMPT_TIMEOUT, retries: int = EMBED_RETRIES,
+                 eject_failures: int = EMBED_EJECT_FAILURES, eject_seconds: float = EMBED_EJECT_SECONDS,
+                 slow_factor: float = EMBED_SLOW_FACTOR, health_interval: float = EMBED_HEALTH_INTERVAL):
+        if not urls:
+            raise ValueError("至少需要一个 embedding 地址")
+        self.endpoints = [Endpoint(u) for u in urls]
+        self.timeout = timeout
+        self.attempt_timeout = attempt_timeout
+        self.retries = max(0, retries)
+        self.eject_failures = max(1, eject_failures)
+        self.eject_seconds = eject_seconds
+        self.slow_factor = slow_factor
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._prober: Optional[threading.Thread] = None
+        self._prober_pid = None
+        self._stop = threading.Event()
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    # -------------------- 选择 / 归还 --------------------
+    def acquire(self, tried: Sequence[Endpoint] = ()) -> Endpoint:
+        """选一个节点并计入在途；tried 里的节点只在没有别的可选时才会再选。"""
+        self._ensure_prober()
+        now = time.monotonic()
+        with self._lock:
+            fresh = [e for e in self.endpoints if e not in tried] or self.endpoints
+            healthy = [e for e in fresh if not e.ejected(now)]
+            if healthy:
+                ep = min(healthy, key=lambda e: (e.outstanding, e.latency or 0.0))
+            else:
+                ep = min(fresh, key=lambda e: e.ejected_until)
+            ep.outstanding += 1
+            ep.requests += 1
+        return ep
+
+    def release(self, ep: Endpoint, seconds: Optional[float] = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            ep.outstanding -= 1
+            if error is not None:
+                if is_host_fault(error):
+                    ep.errors += 1
+                    ep.failures += 1
+                    if ep.failures >= self.eject_failures:
+                        self._eject(ep, "error")
+                return
+            ep.failures = 0
+            if seconds is not None:
+                ep.latency = seconds if ep.latency is None else ep.latency + _EWMA_ALPHA * (seconds - ep.latency)
+                ep.samples += 1
+                self._check_slow(ep)
+
+    def _eject(self, ep: Endpoint, reason: str) -> None:
+        now = time.monotonic()
+        if ep.ejected(now) or not any(not e.ejected(now) for e in self.endpoints if e is not ep):
+            return
+        ep.ejected_until = now + self.eject_seconds
+        ep.eject_reason = reason
+        # 恢复后重新积累延迟样本，避免用剔除前的数据立刻再判一次慢
+        ep.latency, ep.samples = None, 0
+        metrics.inc("vqa_embed_ejections_total", host=ep.url, reason=reason)
+        logger.warning("剔除 embedding 节点 %s（%s），%.0f 秒后恢复", ep.url, reason, self.eject_seconds)
+
+    def _check_slow(self, ep: Endpoint) -> None:
+        if self.slow_factor <= 0 or ep.samples < _SLOW_MIN_SAMPLES:
+            return
+        now = time.monotonic()
+        others = [e.latency for e in self.endpoints
+                  if e is not ep and not e.ejected(now) and e.latency is not None and e.samples >= _SLOW_MIN_SAMPLES]
+        if others and ep.latency > self.slow_factor * statistics.median(others):
+            self._eject(ep, "slow")
+
+    # -------------------- 重试 --------------------
+    def deadline(self) -> float:
+        return time.monotonic() + self.timeout
+
+    def attempt_timeout_for(self, deadline: float) -> float:
+        remaining = max(0.001, deadline - time.monotonic())
+        return min(remaining, self.attempt_timeout) if self.attempt_timeout > 0 else remaining
+
+    def should_retry(self, e: BaseException, tried: Sequence[Endpoint], deadline: float) -> bool:
+        if not is_host_fault(e) or len(tried) > self.retries or time.monotonic() >= deadline:
+            return False
+        metrics.inc("vqa_embed_retries_total", host=tried[-1].url)
+        logger.warning("embedding 请求失败（%s: %s），换节点重试", tried[-1].url, _brief(e))
+        return True
+
+    # -------------------- 探活 --------------------
+    def _ensure_prober(self) -> None:
+        if len(self.endpoints) < 2 or self.health_interval <= 0:
+            return
+        if self._prober is not None and self._prober_pid == os.getpid():
+            return
+        with self._lock:
+            if self._prober is None or self._prober_pid != os.getpid():
+                self._prober_pid = os.getpid()
+                self._prober = threading.Thread(target=self._probe_loop, name="embed-health", daemon=True)
+                self._prober.start()
+
+    def _probe_loop(self) -> None:
+        with httpx.Client(timeout=min(5.0, self.health_interval)) as cli:
+            while not self._stop.wait(self.health_interval):
+                for ep in self.endpoints:
+                    self.probe(ep, cli)
+
+    def probe(self, ep: Endpoint, cli: httpx.Client) -> bool:
+        try:
+            cli.get(f"{ep.url}/api/version").raise_for_status()
+        except httpx.HTTPError as e:
+            with self._lock:
+                if not ep.ejected(time.monotonic()):
+                    logger.warning("embedding 节点探活失败 %s: %s", ep.url, _brief(e))
+                self._eject(ep, "probe")
+            return False
+        with self._lock:
+            # 慢节点探活成功不代表变快了，等剔除期满
+            if ep.ejected(time.monotonic()) and ep.eject_reason != "slow":
+                ep.ejected_until, ep.failures = 0.0, 0
+                logger.info("embedding 节点恢复 %s", ep.url)
+        return True
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        with self._lock:
+            hosts = [e.stats(now) for e in self.endpoints]
+        return {"hosts": hosts, "healthy": sum(h["healthy"] for h in hosts)}
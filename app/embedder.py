@@ -1,5 +1,26 @@
 # app/embedder.py
 import os, httpx
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence
+
+from app.config import (
+    EMBED_BATCH_SIZE, EMBED_CONCURRENCY, EMBED_TIMEOUT,
+    EMBED_COALESCE, EMBED_COALESCE_WAIT_MS, EMBED_COALESCE_MAX_BATCH, EMBED_COALESCE_QUEUE,
+    CACHE_BACKEND, CACHE_DIR, QUERY_CACHE_SIZE, QUERY_CACHE_TTL,
+    EMBED_STORE, EMBED_STORE_PATH, EMBED_STORE_MAX_ITEMS,
+)
+from app import metrics
+from app.cache import make_cache
+from app.batcher import MicroBatcher
+from app.embed_pool import EndpointPool, parse_urls
+from app.embedding_store import EmbeddingStore, text_hash
+
+def normalize_query(text: str) -> str:
+    """查询规范化：去首尾空白、压缩连续空白，作为缓存键的一部分。"""
+    return " ".join((text or "").split())
 
 class Embedder:
     def __init__(self):
@@ -8,19 +29,229 @@ class Embedder:
         if self.method not in {"ollama"}:
             raise ValueError(f"不支持的 EMBEDDING_METHOD: {self.method}")
 
-        # Ollama 运行在宿主机 11434，容器里访问用 host.docker.internal
-        self.ollama_url = os.getenv("OLLAMA_BASE_URL", "http://host.docker.internal:11434")
+        # Ollama 运行在宿主机 11434，容器里访问用 host.docker.internal；多个节点用逗号分隔（见 app.embed_pool）
+        self.hosts = EndpointPool(parse_urls(os.getenv("OLLAMA_BASE_URL", "http://host.docker.internal:11434")))
+        self.ollama_url = self.hosts.endpoints[0].url
+
+        self.batch_size = max(1, EMBED_BATCH_SIZE)
+        # EMBED_CONCURRENCY 按节点计，总并发随节点数线性增加
+        self.concurrency = max(1, EMBED_CONCURRENCY) * len(self.hosts)
+
+        # 同步连接池在首次使用时创建（复用 keep-alive，避免每条文本重新建连）
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._pool = None
+
+        # 异步连接池在首次使用时创建（需要运行中的事件循环）
+        self._aclient = None
+        self._asem = None
+
+        # 并发查询向量合并成批（见 app.batcher），收集循环在第一次查询时启动
+        self.query_batcher = MicroBatcher(
+            self.aembed, max_batch=EMBED_COALESCE_MAX_BATCH, max_wait=EMBED_COALESCE_WAIT_MS / 1000,
+            max_queue=EMBED_COALESCE_QUEUE, max_inflight=self.concurrency, name="query_embedding",
+        ) if EMBED_COALESCE else None
+
+        # 查询向量缓存（key = (model, 规范化 query)）
+        self.query_cache = make_cache(
+            "query_embedding", QUERY_CACHE_SIZE, QUERY_CACHE_TTL,
+            backend=CACHE_BACKEND, cache_dir=CACHE_DIR,
+        )
+
+        # 持久化 embedding 存储（文档分块），按内容 hash 复用
+        self.store = EmbeddingStore(EMBED_STORE_PATH, EMBED_STORE_MAX_ITEMS) if EMBED_STORE else None
+
+    def _get_client(self) -> httpx.Client:
+        # 入库线程池会并发调用，加锁保证只建一个连接池
+        with self._client_lock:
+            if self._client is None:
+                self._client = httpx.Client(
+                    timeout=EMBED_TIMEOUT,
+                    limits=httpx.Limits(
+                        max_connections=self.concurrency * 2,
+                        max_keepalive_connections=self.concurrency,
+                    ),
+                )
+            return self._client
+
+    def _parse(self, r: httpx.Response, texts: List[str]) -> List[List[float]]:
+        r.raise_for_status()
+        embs = r.json().get("embeddings") or []
+        if len(embs) != len(texts):
+            raise ValueError(f"embedding 数量不匹配: 期望 {len(texts)}，实际 {len(embs)}")
+        return embs
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        # /api/embed 支持 input 为列表，一次请求返回多条向量；失败时换节点重试（见 app.embed_pool）
+        cli = self._get_client()
+        metrics.inc("vqa_embed_texts_total", len(texts))
+        deadline, tried = self.hosts.deadline(), []
+        while True:
+            ep = self.hosts.acquire(tried)
+            t0 = time.perf_counter()
+            try:
+                with metrics.timed("vqa_embed_seconds", "embed", mode="sync", host=ep.url):
+                    r = cli.post(
+                        f"{ep.url}/api/embed",
+                        json={"model": self.model, "input": texts},
+                        timeout=self.hosts.attempt_timeout_for(deadline),
+                    )
+                embs = self._parse(r, texts)
+            except BaseException as e:     # 含取消，保证在途计数归还
+                self.hosts.release(ep, error=e)
+                tried.append(ep)
+                if self.hosts.should_retry(e, tried, deadline):
+                    continue
+                raise
+            self.hosts.release(ep, time.perf_counter() - t0)
+            return embs
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        """
+        批量向量化，结果保持输入顺序。
+        启用持久化存储时先按内容 hash 查库，只请求未命中（且去重后）的文本，再回填。
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        if self.store is None:
+            return self._embed_remote(texts)
+
+        hashes = [text_hash(t) for t in texts]
+        found = self.store.get_many(self.model, hashes)
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in found and h not in missing:
+                missing[h] = t
+        if missing:
+            vecs = self._embed_remote(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vecs))
+            self.store.put_many(self.model, fresh.items())
+            found.update(fresh)
+        return [found[h] for h in hashes]
+
+    def _embed_remote(self, texts: List[str]) -> List[List[float]]:
+        """按 batch_size 切批，最多 concurrency 个批次并发请求 Ollama。"""
+        batches = [texts[i : i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1 or self.concurrency == 1:
+            results = [self._embed_batch(b) for b in batches]
+        else:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.concurrency, thread_name_prefix="embed")
+            results = list(self._pool.map(self._embed_batch, batches))
+        return [vec for batch in results for vec in batch]
+
+    # -------------------- 异步接口 --------------------
+    def _get_aclient(self) -> httpx.AsyncClient:
+        if self._aclient is None:
+            self._aclient = httpx.AsyncClient(
+                timeout=EMBED_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=self.concurrency * 2,
+                    max_keepalive_connections=self.concurrency,
+                ),
+            )
+            self._asem = asyncio.Semaphore(self.concurrency)
+        return self._aclient
+
+    async def _aembed_batch(self, texts: List[str]) -> List[List[float]]:
+        cli = self._get_aclient()
+        metrics.inc("vqa_embed_texts_total", len(texts))
+        async with self._asem:
+            deadline, tried = self.hosts.deadline(), []
+            while True:
+                ep = self.hosts.acquire(tried)
+                t0 = time.perf_counter()
+                try:
+                    with metrics.timed("vqa_embed_seconds", "embed", mode="async", host=ep.url):
+                        r = await cli.post(
+                            f"{ep.url}/api/embed",
+                            json={"model": self.model, "input": texts},
+                            timeout=self.hosts.attempt_timeout_for(deadline),
+                        )
+                    embs = self._parse(r, texts)
+                except BaseException as e:
+                    self.hosts.release(ep, error=e)
+                    tried.append(ep)
+                    if self.hosts.should_retry(e, tried, deadline):
+                        continue
+                    raise
+                self.hosts.release(ep, time.perf_counter() - t0)
+                return embs
+
+    async def aembed(self, texts: Sequence[str]) -> List[List[float]]:
+        """embed 的异步版本：共享连接池，最多 concurrency 个批次同时在途。"""
+        texts = list(texts)
+        if not texts:
+            return []
+        batches = [texts[i : i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(*(self._aembed_batch(b) for b in batches))
+        return [vec for batch in results for vec in batch]
+
+    async def aembed_query(self, text: str):
+        """
+        embed_query 的异步版本。缓存未命中时交给 query_batcher 与其他并发查询合并请求；
+        排队已满时抛 batcher.Overloaded。
+        """
+        q = normalize_query(text)
+        key = (self.model, q)
+        vec = self.query_cache.get(key)
+        if vec is None:
+            if self.query_batcher is None:
+                vec = (await self.aembed([q]))[0]
+            else:
+                # 批次在后台任务里发出，embed 阶段（含排队等待）在这里记到本请求的 Server-Timing
+                t0 = time.perf_counter()
+                vec = await self.query_batcher.submit(q, q)
+                dt = time.perf_counter() - t0
+                metrics.observe("vqa_embed_query_seconds", dt)
+                metrics.mark("embed", dt)
+            self.query_cache.set(key, vec)
+        return vec
+
+    async def aembed_queries(self, texts: Sequence[str]) -> List[List[float]]:
+        """批量查询向量化：逐条查缓存，未命中的去重后合并成一次 aembed。"""
+        keys = [(self.model, normalize_query(t)) for t in texts]
+        vecs = [self.query_cache.get(k) for k in keys]
+        missing = list(dict.fromkeys(k[1] for k, v in zip(keys, vecs) if v is None))
+        if missing:
+            got = dict(zip(missing, await self.aembed(missing)))
+            for q, vec in got.items():
+                self.query_cache.set((self.model, q), vec)
+            vecs = [v if v is not None else got[k[1]] for k, v in zip(keys, vecs)]
+        return vecs
+
+    async def aclose(self):
+        self.hosts.close()
+        if self.query_batcher is not None:
+            await self.query_batcher.aclose()
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+            self._asem = None
 
     def __call__(self, text: str):
         if self.method == "ollama":
-            with httpx.Client(timeout=20) as cli:
-                r = cli.post(
-                    f"{self.ollama_url}/api/embeddings",
-                    json={"model": self.model, "prompt": text}
-                )
-            r.raise_for_status()
-            data = r.json()
-            return data["embedding"]
+            return self.embed([text])[0]
+
+    def embed_query(self, text: str):
+        """查询向量化：先查缓存，未命中再请求 Ollama 并回填。"""
+        q = normalize_query(text)
+        key = (self.model, q)
+        vec = self.query_cache.get(key)
+        if vec is None:
+            vec = self(q)
+            self.query_cache.set(key, vec)
+        return vec
+
+    def close(self):
+        self.hosts.close()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        if self._client is not None:
+            self._client.close()
+            self._client = None
 
 def get_embedder():
     return Embedder()
@@ -0,0 +1,177 @@
+# app/embedding_store.py
+"""
+持久化 embedding 存储：(model, sha256(text)) → float32 向量，SQLite 单文件。
+Embedder.embed 先查这里，只把未命中的文本发给 Ollama，再回填；
+重新分块、重建集合、换集合名时，内容相同的分块不必重新向量化。
+容量超过 max_items 时按 last_used 淘汰最久未用的条目；条目数由触发器维护在 counters 表里，
+多个进程（gunicorn worker、同步目录、批量入库）共用一个文件时也是准确的。
+"""
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app import metrics
+
+logger = logging.getLogger("embedding-store")
+
+# SQLite 单条语句参数上限为 999（旧版本），IN 查询按此分段
+_IN_CHUNK = 500
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _pack(vec: Sequence[float]) -> bytes:
+    return array("f", vec).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    a = array("f")
+    a.frombytes(blob)
+    return a.tolist()
+
+
+class EmbeddingStore:
+    def __init__(self, path: str, max_items: int = 0):
+        self.path = path
+        self.max_items = max(0, int(max_items))   # 0 表示不限
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def _db(self) -> sqlite3.Connection:
+        # fork 之后按 pid 重新建连
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, hash TEXT NOT NULL, dim INTEGER NOT NULL,"
+                " vec BLOB NOT NULL, last_used REAL NOT NULL,"
+                " PRIMARY KEY (model, hash)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+            # 计数行与触发器在同一个写事务里建好，旧库首次打开时按 COUNT(*) 初始化
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+                conn.execute(
+                    "INSERT OR IGNORE INTO counters(name, value) VALUES ('embeddings', (SELECT COUNT(*) FROM embeddings))"
+                )
+                conn.execute(
+                    "CREATE TRIGGER IF NOT EXISTS embeddings_count_insert AFTER INSERT ON embeddings BEGIN"
+                    " UPDATE counters SET value = value + 1 WHERE name = 'embeddings'; END"
+                )
+                conn.execute(
+                    "CREATE TRIGGER IF NOT EXISTS embeddings_count_delete AFTER DELETE ON embeddings BEGIN"
+                    " UPDATE counters SET value = value - 1 WHERE name = 'embeddings'; END"
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    @staticmethod
+    def _count(db: sqlite3.Connection) -> int:
+        # 其他进程的写入也计在内，每次决定是否淘汰前重新读
+        return db.execute("SELECT value FROM counters WHERE name = 'embeddings'").fetchone()[0]
+
+    def get_many(self, model: str, hashes: Iterable[str]) -> Dict[str, List[float]]:
+        """返回命中的 {hash: 向量}，并刷新命中条目的 last_used。"""
+        keys = list(dict.fromkeys(hashes))
+        found: Dict[str, List[float]] = {}
+        if not keys:
+            return found
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            for i in range(0, len(keys), _IN_CHUNK):
+                part = keys[i : i + _IN_CHUNK]
+                marks = ",".join("?" * len(part))
+                rows = db.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE model = ? AND hash IN ({marks})",
+                    (model, *part),
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = _unpack(blob)
+                if rows:
+                    hit = [h for h, _ in rows]
+                    db.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE model = ? AND hash IN ({','.join('?' * len(hit))})",
+                        (now, model, *hit),
+                    )
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        metrics.inc("vqa_cache_requests_total", len(found), cache="embedding_store", result="hit")
+        metrics.inc("vqa_cache_requests_total", len(keys) - len(found), cache="embedding_store", result="miss")
+        return found
+
+    def put_many(self, model: str, items: Iterable[Tuple[str, Sequence[float]]]) -> None:
+        now = time.time()
+        rows = [(model, h, len(vec), _pack(vec), now) for h, vec in items]
+        if not rows:
+            return
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN")
+            try:
+                before = db.total_changes
+                db.executemany(
+                    "INSERT OR IGNORE INTO embeddings(model, hash, dim, vec, last_used) VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+                added = db.total_changes - before
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            self.writes += added
+            if self.max_items:
+                count = self._count(db)
+                if count > self.max_items:
+                    self._evict(db, count)
+
+    def _evict(self, db: sqlite3.Connection, count: int) -> None:
+        # 多淘汰约 5%，避免每批写入都触发一次淘汰
+        n = count - self.max_items + max(1, self.max_items // 20)
+        removed = db.execute(
+            "DELETE FROM embeddings WHERE (model, hash) IN "
+            "(SELECT model, hash FROM embeddings ORDER BY last_used LIMIT ?)",
+            (n,),
+        ).rowcount
+        self.evictions += removed
+        logger.info("Embedding store evicted %d rows (now %d)", removed, self._count(db))
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._count(self._db())
+        total = self.hits + self.misses
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        return {
+            "path": self.path,
+            "items": count,
+            "max_items": self.max_items,
+            "bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
@@ -1,13 +1,14 @@
 # File: app/file_loader.py
 
 import os
-import json
 import re
+import time
+import hashlib
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Tuple
 
-import docx
-import pandas as pd
-import fitz  # PyMuPDF
-from PIL import Image  # 预留：如需读取图片尺寸等可用
+from app import metrics
+from app.config import TABLE_ROWS_PER_CHUNK
+from app.parsers import get_parser
 
 # 去掉零宽字符 / BOM
 ZERO_WIDTH_RE = re.compile(r"[\u200B-\u200D\uFEFF]")
@@ -30,139 +31,235 @@ def make_base_meta(file_path: str, content_type: str) -> dict:
     }
 
 
+# 内容定义的断点：一行（表格为一行数据）之后是否断开只取决于这一行自己的内容，
+# 文件中间插入 / 修改内容只影响附近的分块，其后的分块文本与点 id 不变（不像固定步长滑窗那样整体错位）。
+# 断点平均间隔约为 _ANCHOR_SPAN 个分块
+_ANCHOR_SPAN = 2
+
+
+def _is_anchor(text: str, p: float) -> bool:
+    """以概率 p 把这一行选为断点（按内容 hash 决定，同样的行总是同样的结果）。"""
+    if not text.strip():
+        return False
+    h = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+    return h < min(1.0, p) * (1 << 64)
+
+
+def _pack_lines(
+    lines: Iterable[Tuple[str, Any, Any]], max_chars: int, overlap_ratio: float
+) -> Iterator[Tuple[str, Any, Any]]:
+    """
+    把 (行, 起始页, 结束页) 按整行打包成不超过 max_chars 的分块，产出 (文本, 起始页, 结束页)。
+    遇到断点行或装不下时断开，下一块以上一块末尾不超过 overlap 的整行开头；
+    超过 max_chars 的单行从行首起单独滑窗。
+    """
+    overlap = int(max_chars * overlap_ratio)
+    stride = max(1, int(max_chars * (1 - overlap_ratio)))
+    span = _ANCHOR_SPAN * max_chars
+    buf: List[Tuple[str, Any, Any]] = []
+    fresh = 0       # buf 里不是从上一块带过来的行数
+
+    def size(items) -> int:
+        return sum(len(t) for t, _, _ in items) + len(items) - 1
+
+    def tail(items):
+        # 块尾总长不超过 overlap 的整行作为重叠；第一行总是不带，避免下一块重复整块
+        k = len(items)
+        while k > 1 and size(items[k - 1 :]) <= overlap:
+            k -= 1
+        return items[k:]
+
+    def emit():
+        return "\n".join(t for t, _, _ in buf), buf[0][1], buf[-1][2]
+
+    for line, p0, p1 in lines:
+        if len(line) > max_chars:
+            if fresh:
+                yield emit()
+            buf, fresh = [], 0
+            i = 0
+            while True:
+                yield line[i : i + max_chars], p0, p1
+                if i + max_chars >= len(line):
+                    break
+                i += stride
+            continue
+        if buf and size(buf) + 1 + len(line) > max_chars:
+            if fresh:
+                yield emit()
+                buf = tail(buf)
+            while buf and size(buf) + 1 + len(line) > max_chars:
+                buf.pop(0)
+            fresh = 0
+        buf.append((line, p0, p1))
+        fresh += 1
+        if _is_anchor(line, len(line) / span):
+            yield emit()
+            buf, fresh = tail(buf), 0
+    if fresh:
+        yield emit()
+
+
+def _text_lines(segments: Iterable[Tuple[Any, str]]) -> Iterator[Tuple[str, Any, Any]]:
+    """(页码, 文本) 流拆成 (行, 起始页, 结束页)；页末没有换行时该行与下一页开头拼成一行。"""
+    part, first, last = "", None, None
+    for no, text in segments:
+        if not text:
+            continue
+        pieces = text.split("\n")
+        for piece in pieces[:-1]:
+            yield part + piece, (no if first is None else first), no
+            part, first = "", None
+        if pieces[-1]:
+            part += pieces[-1]
+            first = no if first is None else first
+            last = no
+    if part:
+        yield part, first, last
+
+
 def overlap_chunks(text: str, max_chars: int, overlap_ratio: float, base_meta: dict):
-    """按字符数切片，带重叠。"""
+    """按整行打包成不超过 max_chars 的分块，相邻分块重叠约 overlap_ratio；断点由行内容决定（见 _is_anchor）。"""
     if not max_chars or max_chars < 1:
         return [{"text": normalize_text(text), "meta": dict(base_meta)}]
-    stride = max(1, int(max_chars * (1 - overlap_ratio)))
-    res = []
-    i = 0
-    n = len(text)
-    while i < n:
-        chunk = text[i : i + max_chars]
+    return [
+        {"text": normalize_text(chunk), "meta": dict(base_meta)}
+        for chunk, _, _ in _pack_lines(_text_lines([(None, text)]), max_chars, overlap_ratio)
+        if chunk.strip()
+    ]
+
+
+def stream_overlap_chunks(
+    segments: Iterable[Tuple[int, str]], max_chars: int, overlap_ratio: float, base_meta: dict
+) -> Iterator[dict]:
+    """
+    overlap_chunks 的流式版本：segments 为按顺序到达的 (页码, 文本)。
+    切出的分块与对拼接全文调用 overlap_chunks 完全一致，只缓存当前分块的几行；
+    每个分块的 meta 带 page（起始页）与 page_end（结束页）。
+    分块不在页边界强制断开：前面的页增删内容导致后文换页时，分块文本与点 id 不变，只有页码变化。
+    """
+    if not max_chars or max_chars < 1:
+        pages = [(no, text) for no, text in segments]
+        meta = dict(base_meta)
+        if pages:
+            meta.update(page=pages[0][0], page_end=pages[-1][0])
+        yield {"text": normalize_text("".join(t for _, t in pages)), "meta": meta}
+        return
+
+    for chunk, first, last in _pack_lines(_text_lines(segments), max_chars, overlap_ratio):
         if chunk.strip():
-            res.append({"text": normalize_text(chunk), "meta": dict(base_meta)})
-        i += stride
-    return res
+            yield {"text": normalize_text(chunk), "meta": {**base_meta, "page": first, "page_end": last}}
 
 
-def split_file(
-    file_path: str, max_chars: int = 500, overlap_ratio: float = 0.2, by: str = "chars_500"
-):
-    ext = os.path.splitext(file_path)[1].lower().lstrip(".")
+def table_chunks(
+    rows: Iterator[Sequence[str]], sep: str, base_meta: dict,
+    max_chars: int = 500, rows_per_chunk: int = TABLE_ROWS_PER_CHUNK,
+) -> Iterator[dict]:
+    """
+    表格分块。rows 的第一条为表头。
+    rows_per_chunk <= 1：沿用旧格式，表头一个分块（row=0），之后每行一个分块（row=i）。
+    否则把最多 rows_per_chunk 行、且总长不超过 max_chars 的连续行打包成一个分块，
+    每个分块开头重复表头，meta 记录 row_start / row_end（数据行从 1 计）。
+    除了装满，遇到断点行（见 _is_anchor）也断开：中间插入 / 删除行只影响附近的分块，其后分块只有行号变化。
+    """
+    header = next(rows, None)
+    if header is None:
+        return
+    header_line = sep.join(map(str, header))
 
-    # --- PDF ---
-    if ext == "pdf":
-        base_meta = make_base_meta(file_path, "pdf")
-        doc = fitz.open(file_path)
-        text = "".join(page.get_text() for page in doc)
-        return overlap_chunks(text, max_chars, overlap_ratio, base_meta)
-
-    # --- 纯文本 / Markdown ---
-    if ext in ("txt", "md"):
-        base_meta = make_base_meta(file_path, ext)
-        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-            content = f.read()
-        return overlap_chunks(content, max_chars, overlap_ratio, base_meta)
-
-    # --- Word ---
-    if ext == "docx":
-        base_meta = make_base_meta(file_path, "docx")
-        doc = docx.Document(file_path)
-        text = "\n".join(p.text for p in doc.paragraphs)
-        return overlap_chunks(text, max_chars, overlap_ratio, base_meta)
-
-    # --- Excel ---
-    if ext in ("xlsx", "xls"):
-        base_meta = make_base_meta(file_path, "excel")
-        df = pd.read_excel(file_path)
-        outs = []
-        header = ",".join(map(str, df.columns))
-        outs.append({"text": normalize_text(header), "meta": {**base_meta, "row": 0}})
-        for i, row in enumerate(df.values, start=1):
-            line = ",".join(map(str, row))
-            outs.append({"text": normalize_text(line), "meta": {**base_meta, "row": i}})
-        return outs
-
-    # --- CSV / TSV ---
-    if ext in ("csv", "tsv"):
-        sep = "\t" if ext == "tsv" else ","
-        base_meta = make_base_meta(file_path, "tsv" if ext == "tsv" else "csv")
-        df = pd.read_csv(file_path, sep=sep, encoding="utf-8-sig")
-        outs = []
-        header = sep.join(map(str, df.columns))
-        outs.append({"text": normalize_text(header), "meta": {**base_meta, "row": 0}})
-        for i, row in enumerate(df.values, start=1):
+    if rows_per_chunk <= 1:
+        yield {"text": normalize_text(header_line), "meta": {**base_meta, "row": 0}}
+        for i, row in enumerate(rows, start=1):
             line = sep.join(map(str, row))
-            outs.append({"text": normalize_text(line), "meta": {**base_meta, "row": i}})
-        return outs
-
-    # --- JSON Lines ---
-    if ext == "jsonl":
-        base_meta = make_base_meta(file_path, "jsonl")
-        outs = []
-        with open(file_path, "r", encoding="utf-8") as f:
-            for idx, line in enumerate(f, start=1):
-                line = line.strip()
-                if not line:
-                    continue
-                outs.append(
-                    {
-                        "text": normalize_text(line),
-                        "meta": {**base_meta, "json_path": f"line:{idx}"},
-                    }
-                )
-        return outs
-
-    # --- JSON ---
-    if ext == "json":
-        base_meta = make_base_meta(file_path, "json")
-        with open(file_path, "r", encoding="utf-8") as f:
+            yield {"text": normalize_text(line), "meta": {**base_meta, "row": i}}
+        return
+
+    buf, size, first = [], len(header_line), 1
+
+    def flush(last: int) -> dict:
+        text = normalize_text(header_line + "\n" + "\n".join(buf))
+        return {"text": text, "meta": {**base_meta, "row_start": first, "row_end": last}}
+
+    i = 0
+    for i, row in enumerate(rows, start=1):
+        line = sep.join(map(str, row)).replace("\n", " ")
+        if not line.strip(sep + " "):
+            continue
+        if buf and (len(buf) >= rows_per_chunk or (max_chars and max_chars > 0 and size + 1 + len(line) > max_chars)):
+            yield flush(i - 1)
+            buf, size = [], len(header_line)
+        if not buf:
+            first = i
+        buf.append(line)
+        size += 1 + len(line)
+        p = 1 / rows_per_chunk
+        if max_chars and max_chars > 0:
+            p = max(p, len(line) / max_chars)
+        if _is_anchor(line, p / _ANCHOR_SPAN):
+            yield flush(i)
+            buf, size = [], len(header_line)
+    if buf:
+        yield flush(i)
+
+
+def iter_chunks(
+    file_path: str, max_chars: int = 500, overlap_ratio: float = 0.2, by: str = "chars_500",
+    rows_per_chunk: Optional[int] = None,
+) -> Iterator[dict]:
+    """
+    流式分块：边解析边产出分块，调用方可按批消费（embedding / 写入）。
+    PDF 按页并行提取并流式切片；CSV/TSV/Excel 流式读取并按行打包；其余类型按整文件解析后逐条产出。
+    各类型的解析器在 app.parsers 注册，第一次遇到该扩展名时才导入（连同 pandas / PyMuPDF 等依赖）。
+    解析耗时（不含调用方消费分块的时间）按 content_type 计入 vqa_split_seconds。
+    """
+    ext = os.path.splitext(file_path)[1].lower().lstrip(".")
+    rows_per_chunk = TABLE_ROWS_PER_CHUNK if rows_per_chunk is None else rows_per_chunk
+    chunks = _iter_chunks(file_path, ext, max_chars, overlap_ratio, rows_per_chunk)
+    elapsed, content_type = 0.0, None
+    try:
+        while True:
+            t0 = time.perf_counter()
             try:
-                content = json.load(f)
-            except Exception:
-                # 解析失败：按行拼回文本分块
-                f.seek(0)
-                raw = f.read()
-                lines = raw.splitlines()
-                text = "\n".join(line for line in lines if line.strip())
-                return overlap_chunks(text, max_chars, overlap_ratio, base_meta)
-
-        if isinstance(content, list):
-            outs = []
-            for i, item in enumerate(content):
-                s = json.dumps(item, ensure_ascii=False)
-                for ch in overlap_chunks(s, max_chars, overlap_ratio, base_meta):
-                    ch["meta"]["json_path"] = f"[{i}]"
-                    outs.append(ch)
-            return outs
-
-        elif isinstance(content, dict):
-            outs = []
-            for k, v in content.items():
-                s = f"{k}: {json.dumps(v, ensure_ascii=False)}"
-                for ch in overlap_chunks(s, max_chars, overlap_ratio, base_meta):
-                    ch["meta"]["json_path"] = f".{k}"
-                    outs.append(ch)
-            return outs
-
-        else:
-            txt = json.dumps(content, ensure_ascii=False)
-            return overlap_chunks(txt, max_chars, overlap_ratio, base_meta)
-
-    # --- 图片 ---
-    if ext in ("jpg", "jpeg", "png", "bmp", "gif", "webp"):
-        base_meta = make_base_meta(file_path, "image")
-        return [
-            {
-                "text": normalize_text(f"图片文件: {os.path.basename(file_path)}"),
-                "meta": dict(base_meta),
-            }
-        ]
-
-    # --- 其他不支持 ---
-    raise ValueError(f"不支持的文件类型: {ext}")
+                ch = next(chunks)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - t0
+            if content_type is None:
+                content_type = (ch.get("meta") or {}).get("content_type")
+            yield ch
+    finally:
+        chunks.close()
+        metrics.observe("vqa_split_seconds", elapsed, content_type=content_type or ext or "unknown")
+
+
+def _iter_chunks(file_path: str, ext: str, max_chars: int, overlap_ratio: float, rows_per_chunk: int):
+    # 解析器按扩展名从注册表懒加载（见 app.parsers），不支持的类型抛 ValueError
+    yield from get_parser(ext)(file_path, ext, max_chars, overlap_ratio, rows_per_chunk)
+
+
+def split_file(
+    file_path: str, max_chars: int = 500, overlap_ratio: float = 0.2, by: str = "chars_500",
+    rows_per_chunk: Optional[int] = None,
+):
+    return list(iter_chunks(file_path, max_chars=max_chars, overlap_ratio=overlap_ratio, by=by,
+                            rows_per_chunk=rows_per_chunk))
 
 
 def process_file(file_path: str, chunk_size: int = 500, overlap: float = 0.2):
     return split_file(file_path, max_chars=chunk_size, overlap_ratio=overlap)
+
+
+# 已移到 app.parsers 的函数，保留旧的导入路径（访问时才导入对应模块）
+_MOVED = {
+    "iter_pdf_pages": "app.parsers.pdf",
+    "iter_csv_rows": "app.parsers.table",
+    "iter_excel_rows": "app.parsers.table",
+}
+
+
+def __getattr__(name: str):
+    if name in _MOVED:
+        import importlib
+        return getattr(importlib.import_module(_MOVED[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,184 @@
+# app/ingest.py
+"""
+文件入库流水线：split_file → 批量 embedding → 批量写入 Qdrant。
+/upload 的后台任务与同步目录都复用这里，调用方只负责准备本地文件。
+
+点 id 由 (文件名, 分块参数, 分块内容 hash, 同内容序号) 确定性生成：
+重新入库同一文件时只 embedding / 写入新增或变化的分块，并删除已不存在的分块；
+原文没变但页码 / 行号等元信息变了的分块只覆盖 payload，不重新 embedding。
+带 doc_path 入库时文件名限定为 "<path>/<文件名>"（见 app.sharding），不同路径下的同名文件各自独立。
+"""
+import os
+import time
+import uuid
+import hashlib
+import logging
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+from itertools import islice
+
+from app import metrics
+from app.config import UPSERT_BATCH_SIZE
+from app.file_loader import iter_chunks
+from app.embedding_store import text_hash
+from app.sharding import normalize_path, path_scope, qualify
+
+logger = logging.getLogger("ingest")
+
+# 进度回调：stage 为 parsed / embedded / written / skipped / deleted / failed，n 为本次新增的分块数
+ProgressFn = Callable[[str, int], None]
+
+# 点 id 的 uuid5 命名空间（固定值，改动会导致全部 id 变化）
+POINT_ID_NAMESPACE = uuid.UUID("6f1c9a52-3d7e-4b1a-9c2e-8a4d5b6e7f10")
+
+
+class IngestIncomplete(RuntimeError):
+    """部分分块 embedding / 写入失败：已写入的分块保留，旧分块不删，清单不记新的 content_hash，调用方应稍后重试。"""
+
+    def __init__(self, filename: str, total: int, failed: int):
+        super().__init__(f"{failed} of {total} chunks failed")
+        self.filename = filename
+        self.total = total
+        self.failed = failed
+
+
+def _noop(stage: str, n: int) -> None:
+    pass
+
+
+def file_sha256(path: str, block: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for buf in iter(lambda: f.read(block), b""):
+            h.update(buf)
+    return h.hexdigest()
+
+
+def chunk_params_key(max_chars: int, overlap_ratio: float) -> str:
+    return f"chars={max_chars};overlap={overlap_ratio:g}"
+
+
+def chunk_point_id(filename: str, params_key: str, content_hash: str, occurrence: int = 0) -> str:
+    """同一文件内完全相同的分块按出现序号区分，避免 id 冲突。"""
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{filename}\x1f{params_key}\x1f{content_hash}\x1f{occurrence}"))
+
+
+def chunk_point_ids(filename: str, texts: List[str], params_key: str,
+                    seen: Optional[Counter] = None) -> List[str]:
+    """seen 记录已出现过的内容 hash 次数；分批调用时传入同一个 Counter。"""
+    seen = Counter() if seen is None else seen
+    ids = []
+    for text in texts:
+        h = text_hash(text)
+        ids.append(chunk_point_id(filename, params_key, h, seen[h]))
+        seen[h] += 1
+    return ids
+
+
+def existing_chunks(db, filename: str, page_size: int = 1000) -> Dict[str, Dict[str, Any]]:
+    """文件已有分块的 id → 元信息（不含原文）。"""
+    out: Dict[str, Dict[str, Any]] = {}
+    cursor = None
+    while True:
+        rows, cursor = db.scroll(filename, limit=page_size, cursor=cursor, fields=["meta"])
+        out.update((r["id"], r.get("meta") or {}) for r in rows)
+        if cursor is None:
+            return out
+
+
+def ingest_file(path: str, filename: str, embedder, db,
+                max_chars: int = 500, overlap_ratio: float = 0.2,
+                progress: Optional[ProgressFn] = None, doc_path: str = "") -> int:
+    """
+    解析并增量入库单个文件，返回分块数。
+    path 为本地（临时）文件路径，filename 为写入 payload 的原始文件名，doc_path 为检索用的逻辑路径（可空）。
+    分块流式产出，每攒够 UPSERT_BATCH_SIZE 个就 embedding + 写入，不必等整个文件解析完。
+    单批 embedding / 写入失败只记日志并计入 failed，不影响其他批次；
+    出现失败时不删除旧分块，保证旧内容仍可检索，清单只刷新段数，最后抛出 IngestIncomplete。
+    """
+    progress = progress or _noop
+    doc_path = normalize_path(doc_path)
+    filename = qualify(filename, doc_path)
+    scope = path_scope(doc_path)
+    params_key = chunk_params_key(max_chars, overlap_ratio)
+    existing = existing_chunks(db, filename)
+    seen: Counter = Counter()
+    current = set()
+    total = new = updated = failed = 0
+    content_type = None
+
+    chunks = iter_chunks(path, max_chars=max_chars, overlap_ratio=overlap_ratio)
+    while True:
+        batch = list(islice(chunks, UPSERT_BATCH_SIZE))
+        if not batch:
+            break
+        total += len(batch)
+        progress("parsed", len(batch))
+        if content_type is None:
+            content_type = (batch[0].get("meta") or {}).get("content_type")
+
+        texts = [chunk.get("text", "") or "" for chunk in batch]
+        ids = chunk_point_ids(filename, texts, params_key, seen)
+        current.update(ids)
+        metas = []
+        for chunk in batch:
+            meta = (chunk.get("meta") or {}).copy()
+            meta["filename"] = filename
+            meta["path"] = doc_path
+            meta["path_scope"] = scope
+            metas.append(meta)
+        todo = [i for i, pid in enumerate(ids) if pid not in existing]
+        stale_meta = [i for i, pid in enumerate(ids) if pid in existing and existing[pid] != metas[i]]
+        if len(todo) < len(batch):
+            progress("skipped", len(batch) - len(todo))
+        if stale_meta:
+            # 原文没变、位置变了（前面插入了内容）：只刷新 page / row_start 等元信息
+            try:
+                db.update_payloads([ids[i] for i in stale_meta], [texts[i] for i in stale_meta],
+                                   [metas[i] for i in stale_meta])
+                updated += len(stale_meta)
+            except Exception:
+                logger.exception("Payload update failed: %s (%d chunks)", filename, len(stale_meta))
+                failed += len(stale_meta)
+                progress("failed", len(stale_meta))
+        if not todo:
+            continue
+        new += len(todo)
+
+        batch_texts = [texts[i] for i in todo]
+        try:
+            vecs = embedder.embed(batch_texts)
+            progress("embedded", len(todo))
+            db.insert_many(vecs, batch_texts, [metas[i] for i in todo], ids=[ids[i] for i in todo])
+            progress("written", len(todo))
+        except Exception:
+            logger.exception("Insert batch failed: %s [%d:%d]", filename, total - len(batch), total)
+            failed += len(todo)
+            progress("failed", len(todo))
+
+    stale = list(set(existing) - current)
+    if stale and not failed:
+        db.delete_ids(stale)
+        progress("deleted", len(stale))
+    elif stale:
+        logger.warning("Skip deleting %d stale chunks of %s: %d chunks failed", len(stale), filename, failed)
+
+    if failed:
+        # 文件并未完整入库：content_hash / ingested_at 保留上次成功时的值
+        db.update_manifest(filename, content_type=content_type, path=doc_path)
+    else:
+        db.update_manifest(
+            filename,
+            content_type=content_type,
+            path=doc_path,
+            bytes=os.path.getsize(path),
+            content_hash=file_sha256(path),
+            ingested_at=time.time(),
+        )
+
+    metrics.observe("vqa_ingest_chunks", total, content_type=content_type or "unknown")
+    logger.info("Ingested %s: chunks=%d new=%d unchanged=%d meta_updated=%d stale=%d failed=%d",
+                filename, total, new, total - new, updated, len(stale), failed)
+    if failed:
+        raise IngestIncomplete(filename, total, failed)
+    return total
@@ -0,0 +1,191 @@
+# app/jobs.py
+"""
+后台入库任务：/upload 落盘后入队立即返回 job_id，由线程池在事件循环之外执行 ingest_file。
+任务状态存放在 DATA_DIR 下的 SQLite（WAL），多个 gunicorn worker 都能查询到同一任务的进度。
+任务只存在于入队进程的线程池里：每条记录带上所属进程 pid 和临时文件路径，worker 启动时把所属进程已不在的
+queued/running 任务标为 error 并删除临时文件（worker 超时被杀、服务重启后不会一直停在 running）。
+"""
+import os
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from app.ingest import IngestIncomplete, ingest_file
+from app.sharding import qualify
+
+logger = logging.getLogger("jobs")
+
+_COUNTERS = ("parsed", "embedded", "written", "skipped", "deleted", "failed")
+# 旧库补列：列名 → 类型
+_EXTRA_COLUMNS = {**{c: "INTEGER NOT NULL DEFAULT 0" for c in _COUNTERS}, "owner": "INTEGER", "tmp_path": "TEXT"}
+
+ORPHANED_ERROR = "任务所在进程已退出（服务重启或 worker 超时），请重新上传"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        # fork 之后按 pid 重新建连
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, filename TEXT NOT NULL, status TEXT NOT NULL,"
+                " parsed INTEGER NOT NULL DEFAULT 0, embedded INTEGER NOT NULL DEFAULT 0,"
+                " written INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0,"
+                " segments INTEGER, error TEXT, owner INTEGER, tmp_path TEXT,"
+                " created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            # 旧库补列
+            cols = {r[1] for r in conn.execute("PRAGMA table_info(jobs)")}
+            for col, decl in _EXTRA_COLUMNS.items():
+                if col not in cols:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {col} {decl}")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def create(self, filename: str, tmp_path: Optional[str] = None) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db().execute(
+                "INSERT INTO jobs(id, filename, status, owner, tmp_path, created_at, updated_at)"
+                " VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, filename, os.getpid(), tmp_path, now, now),
+            )
+        return job_id
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        if not fields:
+            return
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            self._db().execute(
+                f"UPDATE jobs SET {cols}, updated_at = ? WHERE id = ?",
+                (*fields.values(), time.time(), job_id),
+            )
+
+    def incr(self, job_id: str, counter: str, n: int) -> None:
+        if counter not in _COUNTERS:
+            raise ValueError(f"未知的进度字段: {counter}")
+        with self._lock:
+            self._db().execute(
+                f"UPDATE jobs SET {counter} = {counter} + ?, updated_at = ? WHERE id = ?",
+                (n, time.time(), job_id),
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            cur = self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cur.fetchone()
+            if row is None:
+                return None
+            return dict(zip([c[0] for c in cur.description], row))
+
+    def fail_orphans(self, owner: Optional[int] = None) -> int:
+        """
+        把所属进程已退出的 queued/running 任务标为 error 并删除临时文件，返回处理的条数。
+        worker 启动时（还没接任务）调用：与本进程同 pid 的任务只可能来自重启前 pid 被复用的旧进程，同样算孤儿。
+        传 owner 时只处理该进程还在排队的任务（关闭时被取消的那些；正在跑的会在进程退出前跑完）。
+        """
+        statuses = ("queued",) if owner is not None else ("queued", "running")
+        marks = ", ".join("?" * len(statuses))
+        with self._lock:
+            rows = self._db().execute(
+                f"SELECT id, owner, tmp_path FROM jobs WHERE status IN ({marks})", statuses
+            ).fetchall()
+        n = 0
+        for job_id, pid, tmp_path in rows:
+            if owner is not None:
+                if pid != owner:
+                    continue
+            elif pid is not None and pid != os.getpid() and _pid_alive(pid):
+                continue
+            with self._lock:
+                cur = self._db().execute(
+                    f"UPDATE jobs SET status = 'error', error = ?, updated_at = ? WHERE id = ? AND status IN ({marks})",
+                    (ORPHANED_ERROR, time.time(), job_id, *statuses),
+                )
+            if cur.rowcount and tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    logger.warning("删除孤儿任务的临时文件失败: %s", tmp_path)
+            n += cur.rowcount
+        if n:
+            logger.warning("%d 个入库任务所在进程已退出，已标为失败", n)
+        return n
+
+
+class IngestQueue:
+    def __init__(self, store: JobStore, embedder, db, workers: int = 2):
+        self.store = store
+        self.embedder = embedder
+        self.db = db
+        self.workers = max(1, workers)
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def submit(self, path: str, filename: str, max_chars: int = 500, overlap_ratio: float = 0.2,
+               doc_path: str = "") -> str:
+        """入队一个已落盘的文件，返回 job_id；任务结束后删除该临时文件。任务记录的是带路径的限定文件名。"""
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="ingest")
+        job_id = self.store.create(qualify(filename, doc_path), tmp_path=path)
+        self._pool.submit(self._run, job_id, path, filename, max_chars, overlap_ratio, doc_path)
+        return job_id
+
+    def _run(self, job_id: str, path: str, filename: str, max_chars: int, overlap_ratio: float,
+             doc_path: str = "") -> None:
+        self.store.update(job_id, status="running")
+        try:
+            segments = ingest_file(
+                path, filename, self.embedder, self.db,
+                max_chars=max_chars, overlap_ratio=overlap_ratio,
+                progress=lambda stage, n: self.store.incr(job_id, stage, n),
+                doc_path=doc_path,
+            )
+            self.store.update(job_id, status="done", segments=segments)
+            logger.info("Job %s done: %s segments=%d", job_id, filename, segments)
+        except IngestIncomplete as e:
+            # 部分分块 embedding / 写入失败：文件未完整入库，重新上传即可补齐（已写入的分块按 id 跳过）
+            logger.warning("Job %s incomplete: %s %s", job_id, filename, e)
+            self.store.update(job_id, status="error", segments=e.total, error=f"{e.failed} chunks failed")
+        except Exception as e:
+            logger.exception("Job %s failed: %s", job_id, filename)
+            self.store.update(job_id, status="error", error=str(e))
+        finally:
+            try:
+                os.remove(path)
+            except Exception:
+                pass
+
+    def shutdown(self, wait: bool = False) -> None:
+        """不等待时取消还在排队的任务并标为失败。"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=not wait)
+            self._pool = None
+            if not wait:
+                self.store.fail_orphans(owner=os.getpid())
@@ -0,0 +1,203 @@
+# app/lexical.py
+"""
+词法索引：SQLite FTS5 + BM25，按分块 id 检索，补足向量检索对精确关键字的召回。
+
+- 中文（CJK）按相邻二字切分（bigram，单字成词时保留单字），英文/数字按词、转小写
+- 写入 / 删除随向量库同步维护（见 qdrant_client.add_texts / delete_points / delete_by_filename，numpy_db 同理）
+- 已有数据用 `python -m app.lexical rebuild` 从集合全量重建
+- 只存分词结果和 id，原文与 payload 仍以 Qdrant 为准
+- 另存分块的 path（见 app.sharding），search 传 path 时只在该路径及其子路径内检索
+"""
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("lexical")
+
+_CJK = "㐀-䶿一-鿿豈-﫿"
+_TOKEN_RE = re.compile(rf"[{_CJK}]+|[^\W_{_CJK}]+")
+_CJK_RE = re.compile(rf"[{_CJK}]")
+
+# 查询最多取多少个不同的词，避免超长 query 生成巨大的 MATCH 表达式
+MAX_QUERY_TOKENS = 64
+_IN_CHUNK = 500
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for m in _TOKEN_RE.finditer(text or ""):
+        s = m.group().lower()
+        if _CJK_RE.match(s):
+            if len(s) == 1:
+                tokens.append(s)
+            else:
+                tokens.extend(s[i : i + 2] for i in range(len(s) - 1))
+        else:
+            tokens.append(s)
+    return tokens
+
+
+def match_expression(query: str) -> str:
+    """把 query 转成 FTS5 MATCH 表达式：各词 OR 连接，由 BM25 决定排序。"""
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TOKENS]
+    return " OR ".join(f'"{t}"' for t in terms)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Dict]], k: int = 60, key: str = "id") -> List[Dict]:
+    """
+    RRF 融合多路排序结果：score = Σ 1 / (k + rank)。
+    同一条目取第一次出现的那份 row，score 改为融合分，另记各路的名次。
+    """
+    fused: Dict[str, Dict] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            rid = row.get(key)
+            if rid is None:
+                continue
+            item = fused.get(rid)
+            if item is None:
+                item = fused[rid] = {**row, "score": 0.0}
+            item["score"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda r: r["score"], reverse=True)
+
+
+class LexicalIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        # fork 之后按 pid 重新建连
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS docs ("
+                " rowid INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, filename TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS docs_filename ON docs(filename)")
+            # 旧库没有 path 列：补上，已有分块视为根路径
+            if "path" not in {r[1] for r in conn.execute("PRAGMA table_info(docs)")}:
+                conn.execute("ALTER TABLE docs ADD COLUMN path TEXT NOT NULL DEFAULT ''")
+            conn.execute("CREATE INDEX IF NOT EXISTS docs_path ON docs(path)")
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS terms USING fts5(tokens, tokenize='unicode61')")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _delete_rowids(self, db: sqlite3.Connection, rowids: List[int]) -> None:
+        for i in range(0, len(rowids), _IN_CHUNK):
+            part = rowids[i : i + _IN_CHUNK]
+            marks = ",".join("?" * len(part))
+            db.execute(f"DELETE FROM terms WHERE rowid IN ({marks})", part)
+            db.execute(f"DELETE FROM docs WHERE rowid IN ({marks})", part)
+
+    def _rowids(self, db: sqlite3.Connection, ids: List[str]) -> List[int]:
+        out = []
+        for i in range(0, len(ids), _IN_CHUNK):
+            part = ids[i : i + _IN_CHUNK]
+            marks = ",".join("?" * len(part))
+            out.extend(r[0] for r in db.execute(f"SELECT rowid FROM docs WHERE id IN ({marks})", part))
+        return out
+
+    def add_many(self, items: Iterable[Tuple[str, str, Optional[str], Optional[str]]]) -> None:
+        """items 为 (id, text, filename, path)；id 已存在时覆盖。"""
+        rows = [(str(pid), " ".join(tokenize(text)), filename, path or "") for pid, text, filename, path in items]
+        if not rows:
+            return
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN")
+            try:
+                self._delete_rowids(db, self._rowids(db, [r[0] for r in rows]))
+                for pid, tokens, filename, path in rows:
+                    cur = db.execute("INSERT INTO docs(id, filename, path) VALUES (?, ?, ?)", (pid, filename, path))
+                    db.execute("INSERT INTO terms(rowid, tokens) VALUES (?, ?)", (cur.lastrowid, tokens))
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    def delete_ids(self, ids: Iterable[str]) -> None:
+        keys = [str(i) for i in ids]
+        if not keys:
+            return
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN")
+            try:
+                self._delete_rowids(db, self._rowids(db, keys))
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    def delete_filename(self, filename: str) -> None:
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN")
+            try:
+                rowids = [r[0] for r in db.execute("SELECT rowid FROM docs WHERE filename = ?", (filename,))]
+                self._delete_rowids(db, rowids)
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    def search(self, query: str, limit: int = 10, path: Optional[str] = None) -> List[Tuple[str, float]]:
+        """返回 [(id, bm25 分)]，分数越大越相关；path 非空时只检索该路径及其子路径下的分块。"""
+        expr = match_expression(query)
+        if not expr or limit <= 0:
+            return []
+        sql = "SELECT docs.id, bm25(terms) FROM terms JOIN docs ON docs.rowid = terms.rowid WHERE terms MATCH ?"
+        args: list = [expr]
+        if path:
+            # 子路径用范围条件匹配（'/' 的下一个字符是 '0'），可走 docs_path 索引
+            sql += " AND (docs.path = ? OR (docs.path >= ? AND docs.path < ?))"
+            args += [path, path + "/", path + "0"]
+        with self._lock:
+            rows = self._db().execute(sql + " ORDER BY bm25(terms) LIMIT ?", (*args, limit)).fetchall()
+        # FTS5 的 bm25() 越小越相关，取反作为分数
+        return [(pid, -score) for pid, score in rows]
+
+    def clear(self) -> None:
+        with self._lock:
+            db = self._db()
+            db.execute("DELETE FROM terms")
+            db.execute("DELETE FROM docs")
+            db.execute("DELETE FROM meta WHERE key = 'built_at'")
+
+    def mark_built(self) -> None:
+        with self._lock:
+            self._db().execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('built_at', ?)", (str(time.time()),))
+
+    def is_built(self) -> bool:
+        with self._lock:
+            return self._db().execute("SELECT 1 FROM meta WHERE key = 'built_at'").fetchone() is not None
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._db().execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        return {"path": self.path, "chunks": count, "bytes": size, "built": self.is_built()}
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    if sys.argv[1:] != ["rebuild"]:
+        print("Usage: python -m app.lexical rebuild")
+        sys.exit(1)
+    from app.vector_db import create_db
+    print(f"indexed {create_db().rebuild_lexical()} chunks")
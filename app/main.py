@@ -1,12 +1,20 @@
 # app/main.py
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request, Response
+from fastapi.responses import HTMLResponse, FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
+from contextlib import asynccontextmanager
 
 import os
+import time
+import shutil
+import asyncio
 import logging
+import tempfile
+from urllib.parse import quote
+
+import orjson
 
 # -------------------- 日志 --------------------
 logging.basicConfig(
@@ -16,34 +24,92 @@ logging.basicConfig(
 logger = logging.getLogger("pdf-vector-qa")
 
 # -------------------- 依赖 --------------------
-from app.config import QDRANT_COLLECTION
-from app.file_loader import split_file
-from app.embedder import get_embedder
-from app.qdrant_client import QdrantDB
+from app.config import (
+    QDRANT_COLLECTION, DATA_DIR,
+    CACHE_BACKEND, CACHE_DIR, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_MODE,
+    SEARCH_MMR, MMR_LAMBDA, MMR_FETCH_FACTOR, SEARCH_COLLAPSE, COLLAPSE_MIN_OVERLAP, COLLAPSE_MAX_CHARS,
+    RRF_K,
+    INGEST_WORKERS, UPLOAD_TMP_DIR, UPLOAD_READ_BLOCK,
+)
+from app import metrics
+from app.cache import make_cache
+from app.embedder import get_embedder, normalize_query
+from app.batcher import Overloaded
+from app.jobs import JobStore, IngestQueue
+from app.rerank import mmr_select, collapse_overlaps, scaled_scores
+from app.lexical import reciprocal_rank_fusion
+from app.sharding import normalize_path
+from app.vector_db import create_db, create_async_db, InvalidCursor, SEARCH_MODES
 from app.models import (
     FileChunk,
     SearchRequest,
     SearchResult,
+    BatchSearchRequest,
+    BatchSearchResult,
     UploadResult,
+    JobStatus,
     FileListResult,
     SegmentsResult,
     DeleteResult,
     # 新增：只选不写需要
     IdsRequest,
-    Chunk,
 )
 
 # -------------------- App --------------------
+embedder = get_embedder()
+db = create_db(QDRANT_COLLECTION)
+# 读路径（/search、/points_by_ids）走异步客户端，不阻塞事件循环
+adb = create_async_db(QDRANT_COLLECTION, db)
+
+# 后台入库队列：/upload 只负责落盘和入队
+jobs = JobStore(os.path.join(DATA_DIR, "jobs.sqlite3"))
+ingest_queue = IngestQueue(jobs, embedder, db, workers=INGEST_WORKERS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时检查一次集合 schema；失败只记录，/healthz 会报告原因
+    try:
+        await asyncio.to_thread(db.ensure_schema)
+    except Exception:
+        logger.exception("Collection schema check failed")
+    # 上一个进程（超时被杀 / 重启前）没跑完的任务标为失败，前端不会一直轮询
+    try:
+        await asyncio.to_thread(jobs.fail_orphans)
+    except Exception:
+        logger.exception("Orphaned job cleanup failed")
+    yield
+    ingest_queue.shutdown(wait=False)
+    await embedder.aclose()
+    await adb.close()
+    metrics.flush()
+
 app = FastAPI(
     title="PDF Vector QA",
     description="支持多类型文件上传、分块、embedding 入库与向量检索，兼容 OpenWebUI MCP 工具。",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
-embedder = get_embedder()
-db = QdrantDB(QDRANT_COLLECTION)
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    # 各阶段（embed / qdrant_<op> / postprocess ...）耗时汇总到 Server-Timing 响应头，同时按路由记总延迟
+    timings = metrics.start_request()
+    t0 = time.perf_counter()
+    response = await call_next(request)
+    total = time.perf_counter() - t0
+    route = getattr(request.scope.get("route"), "path", None) or "unmatched"
+    metrics.observe("vqa_http_request_seconds", total,
+                    method=request.method, route=route, status=response.status_code)
+    response.headers["Server-Timing"] = metrics.server_timing(timings, total)
+    return response
+
+# /search 结果缓存；键里带集合代数，上传/删除后旧条目自动失效
+search_cache = make_cache(
+    "search_result", SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL,
+    backend=CACHE_BACKEND, cache_dir=CACHE_DIR,
+)
 
 # -------------------- Pages --------------------
 @app.get("/", response_class=HTMLResponse, summary="上传页面")
@@ -60,50 +126,44 @@ class UploadParams(BaseModel):
     overlap_ratio: float = 0.2
 
 # -------------------- Upload --------------------
-@app.post("/upload", response_model=UploadResult, summary="上传并分块文件")
+def _spool_to_disk(src, suffix: str) -> str:
+    """把上传流按块拷贝到唯一命名的临时文件，保留扩展名供 split_file 识别类型。"""
+    fd, path = tempfile.mkstemp(prefix="upload_", suffix=suffix, dir=UPLOAD_TMP_DIR or None)
+    with os.fdopen(fd, "wb") as f:
+        shutil.copyfileobj(src, f, UPLOAD_READ_BLOCK)
+    return path
+
+@app.post("/upload", response_model=UploadResult, summary="上传文件并排队入库")
 async def upload(
     files: List[UploadFile] = File(..., description="支持多类型批量上传"),
     custom_chars: int = 500,
-    overlap_ratio: float = 0.2
+    overlap_ratio: float = 0.2,
+    path: str = Query("", description="逻辑路径（如 tenantA/docs），检索时可按路径前缀过滤"),
 ):
+    doc_path = normalize_path(path)
     results: List[Dict[str, Any]] = []
     for file in files:
-        contents = await file.read()
-        path = f"tmp_{file.filename}"
-        with open(path, "wb") as f:
-            f.write(contents)
-
-        try:
-            chunks = split_file(path, max_chars=custom_chars, overlap_ratio=overlap_ratio)
-        finally:
-            try:
-                os.remove(path)
-            except Exception:
-                pass
-
-        # 入库
-        for chunk in chunks:
-            text = chunk.get("text", "") or ""
-            meta = (chunk.get("meta") or {}).copy()
-            meta["filename"] = file.filename
-            try:
-                vec = embedder(text)
-                db.insert(vec, text, meta)
-            except Exception:
-                logger.exception("Insert chunk failed: %s", meta)
-
-        results.append({"filename": file.filename, "segments": len(chunks)})
+        # 文件名里的 "/" 会与路径限定名混淆，只取最后一段
+        filename = os.path.basename((file.filename or "").replace("\\", "/"))
+        suffix = os.path.splitext(filename)[1].lower()
+        tmp = await asyncio.to_thread(_spool_to_disk, file.file, suffix)
+        job_id = ingest_queue.submit(tmp, filename, max_chars=custom_chars, overlap_ratio=overlap_ratio,
+                                     doc_path=doc_path)
+        results.append({"filename": filename, "path": doc_path, "job_id": job_id, "status": "queued"})
 
     return UploadResult(detail=results)
 
+@app.get("/jobs/{job_id}", response_model=JobStatus, summary="查询入库任务进度")
+def job_status(job_id: str):
+    row = jobs.get(job_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"job not found: {job_id}")
+    return JobStatus(**row)
+
 # --- /search 路由 ---
-@app.post("/search", response_model=List[SearchResult], summary="向量检索")
-async def search(req: SearchRequest):
-    # 1) 读取入参（兼容旧的 max_results）
+def _resolve_search(req: SearchRequest) -> Dict[str, Any]:
+    """把 SearchRequest 解析成检索参数（兼容旧字段，未指定的取配置默认值）。"""
     query = (getattr(req, "query", "") or "").strip()
-    if not query:
-        logger.warning("[SEARCH] empty query")
-        return []
 
     # top_k：优先用 req.top_k；没有则回退到旧字段 max_results；再没有用 15
     top_k_val = getattr(req, "top_k", None)
@@ -119,32 +179,46 @@ async def search(req: SearchRequest):
     min_score_val = getattr(req, "min_score", None)
     min_score = float(min_score_val if min_score_val is not None else 0.0)
 
-    # 2) 向量化
-    try:
-        qvec = embedder(query)
-        qdim = len(qvec) if hasattr(qvec, "__len__") else None
-        logger.info("[SEARCH] query=%r dim=%s top_k=%d max_return=%d min_score=%.3f",
-                    query[:80], qdim, top_k, max_return, min_score)
-    except Exception:
-        logger.exception("Embedder failed to encode query")
-        return []
+    # mode：vector（默认）/ hybrid / keyword
+    mode = (getattr(req, "mode", None) or SEARCH_MODE).lower()
+    if mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"unsupported mode: {mode}")
 
-    # 3) Qdrant 检索（把 min_score 作为 score_threshold 传入）
-    try:
-        hits = db.search(qvec, top_k=top_k, query_text=query, score_threshold=min_score) or []
-    except Exception:
-        logger.exception("Qdrant search failed")
-        return []
+    # 后处理：MMR 去冗余（多取候选并带向量）、同文件重叠分块合并
+    use_mmr = SEARCH_MMR if req.mmr is None else req.mmr
+    mmr_lambda = MMR_LAMBDA if req.mmr_lambda is None else req.mmr_lambda
+    collapse = SEARCH_COLLAPSE if req.collapse is None else req.collapse
+    return {
+        "query": query, "top_k": top_k, "max_return": max_return, "min_score": min_score, "mode": mode,
+        "oversampling": req.oversampling, "rescore": req.rescore, "path": normalize_path(req.path),
+        "mmr": use_mmr, "mmr_lambda": mmr_lambda, "collapse": collapse,
+        "fetch_k": top_k * max(1, MMR_FETCH_FACTOR) if use_mmr else top_k,
+    }
+
+def _cache_key(gen: str, p: Dict[str, Any]) -> tuple:
+    return (gen, normalize_query(p["query"]), p["top_k"], p["min_score"], p["max_return"],
+            p["oversampling"], p["rescore"], p["mode"], p["path"],
+            p["mmr"], p["mmr_lambda"] if p["mmr"] else None, p["collapse"])
+
+def _finalize(hits: List[Dict[str, Any]], p: Dict[str, Any]) -> List[SearchResult]:
+    """后处理（MMR / 重叠合并）+ 过滤与截断。"""
+    mode = p["mode"]
+    if p["mmr"]:
+        relevance = None if mode == "vector" else scaled_scores(hits)
+        hits = mmr_select(hits, p["top_k"], p["mmr_lambda"], relevance)
+    if p["collapse"]:
+        hits = collapse_overlaps(hits, COLLAPSE_MIN_OVERLAP, COLLAPSE_MAX_CHARS)
 
-    # 4) 过滤与截断
     out = []
     for h in hits:
         try:
             score = float(h.get("score", 0.0))
-            if score < min_score:
+            # hybrid / keyword 的分数是 RRF / BM25 分，与相似度不可比，min_score 只作用于向量一路
+            if mode == "vector" and score < p["min_score"]:
                 continue
             out.append(
                 SearchResult(
+                    id=h.get("id"),
                     text=str(h.get("text") or ""),
                     meta=dict(h.get("meta") or {}),
                     score=score,
@@ -153,36 +227,200 @@ async def search(req: SearchRequest):
         except Exception:
             logger.exception("Bad hit row encountered")
             continue
+    return out[:p["max_return"]]
 
-    out = out[:max_return]
+@app.post("/search", response_model=List[SearchResult], summary="向量检索")
+async def search(req: SearchRequest):
+    # 1) 读取入参（兼容旧的 max_results）
+    p = _resolve_search(req)
+    query, mode = p["query"], p["mode"]
+    if not query:
+        logger.warning("[SEARCH] empty query")
+        return []
+
+    # 命中结果缓存则直接返回（跳过 Ollama 与 Qdrant）
+    cache_key = _cache_key(adb.generation(), p)
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        metrics.mark("search_cache", desc="hit")
+        logger.info("[SEARCH] cache hit query=%r hits_return=%d", query[:80], len(cached))
+        return cached
+
+    # 2) 向量化（keyword 模式不需要）
+    qvec = None
+    try:
+        if mode != "keyword":
+            qvec = await embedder.aembed_query(query)
+        qdim = len(qvec) if hasattr(qvec, "__len__") else None
+        logger.info("[SEARCH] query=%r mode=%s dim=%s top_k=%d max_return=%d min_score=%.3f",
+                    query[:80], mode, qdim, p["top_k"], p["max_return"], p["min_score"])
+    except Overloaded:
+        # Ollama 处理不过来、排队已满：快速失败，让调用方稍后重试，而不是越排越久
+        logger.warning("[SEARCH] embedding queue full, rejecting query=%r", query[:80])
+        raise HTTPException(status_code=503, detail="embedding queue full", headers={"Retry-After": "1"})
+    except Exception:
+        logger.exception("Embedder failed to encode query")
+        return []
+
+    # 3) Qdrant 检索（把 min_score 作为 score_threshold 传入）
+    try:
+        hits = await adb.search(qvec, top_k=p["fetch_k"], query_text=query, score_threshold=p["min_score"],
+                                oversampling=p["oversampling"], rescore=p["rescore"], mode=mode,
+                                with_vectors=p["mmr"], path=p["path"]) or []
+    except Exception:
+        logger.exception("Qdrant search failed")
+        return []
+
+    # 4) 后处理、过滤与截断
+    with metrics.timed("vqa_postprocess_seconds", "postprocess"):
+        out = _finalize(hits, p)
+    search_cache.set(cache_key, out)
     logger.info("[SEARCH] hits_total=%d, hits_return=%d", len(hits), len(out))
     return out
 
+@app.post("/search_batch", response_model=BatchSearchResult, summary="批量检索")
+async def search_batch(req: BatchSearchRequest):
+    """
+    多条查询一次完成：未命中缓存的查询合并为一次 embedding 请求和一次 Qdrant 批量检索。
+    fuse=true 时另返回各查询结果的 RRF 融合并集（fuse_top_k 条，默认取各查询 top_k 的最大值）。
+    """
+    params = [_resolve_search(q) for q in req.queries]
+    results: List[List[SearchResult]] = [[] for _ in params]
+    gen = adb.generation()
+
+    todo = []
+    for i, p in enumerate(params):
+        if not p["query"]:
+            continue
+        cached = search_cache.get(_cache_key(gen, p))
+        if cached is not None:
+            results[i] = cached
+        else:
+            todo.append(i)
+    logger.info("[SEARCH_BATCH] queries=%d cached=%d", len(params), len(params) - len(todo))
+
+    if todo:
+        # 一次 embedding：keyword 模式不需要向量
+        need_vec = [i for i in todo if params[i]["mode"] != "keyword"]
+        qvecs: Dict[int, Any] = {}
+        try:
+            if need_vec:
+                qvecs = dict(zip(need_vec, await embedder.aembed_queries([params[i]["query"] for i in need_vec])))
+        except Exception:
+            logger.exception("Embedder failed to encode batch queries")
+            todo = [i for i in todo if params[i]["mode"] == "keyword"]
+
+        requests = [{
+            "query_emb": qvecs.get(i),
+            "query_text": params[i]["query"],
+            "top_k": params[i]["fetch_k"],
+            "score_threshold": params[i]["min_score"],
+            "oversampling": params[i]["oversampling"],
+            "rescore": params[i]["rescore"],
+            "mode": params[i]["mode"],
+            "path": params[i]["path"],
+        } for i in todo]
+        try:
+            batch_hits = await adb.search_batch(requests, with_vectors=any(params[i]["mmr"] for i in todo))
+        except Exception:
+            logger.exception("Qdrant batch search failed")
+            batch_hits = [[] for _ in todo]
+        else:
+            with metrics.timed("vqa_postprocess_seconds", "postprocess"):
+                for i, hits in zip(todo, batch_hits):
+                    results[i] = _finalize(hits, params[i])
+                    search_cache.set(_cache_key(gen, params[i]), results[i])
+
+    fused = None
+    if req.fuse:
+        limit = req.fuse_top_k or max([p["top_k"] for p in params] or [0])
+        rankings = [
+            [{"key": r.id or r.text, "id": r.id, "text": r.text, "meta": r.meta, "score": r.score} for r in res]
+            for res in results
+        ]
+        fused = [
+            SearchResult(id=row["id"], text=row["text"], meta=row["meta"], score=row["score"])
+            for row in reciprocal_rank_fusion(rankings, k=RRF_K, key="key")[:limit]
+        ]
+    return BatchSearchResult(results=results, fused=fused)
+
 # -------------------- Files / Segments --------------------
+def _json(content, headers: Optional[Dict[str, str]] = None) -> Response:
+    # 行数据已是 dict，直接 orjson 序列化，跳过逐行 pydantic 校验和默认 JSON 编码器
+    return Response(orjson.dumps(content), media_type="application/json", headers=headers)
+
+def _parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    # fields=text,meta / fields=meta / fields=page,filename；为空返回全部
+    return [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+
 @app.get("/list_files", summary="列出已入库的文件")
 def list_files():
-    return db.list_files()
+    return _json(db.list_files())
 
 @app.delete("/delete_by_filename", response_model=DeleteResult, summary="删除指定文件及分块")
 def delete_by_filename(filename: str):
     db.delete_by_filename(filename)
     return DeleteResult(detail=f"Deleted {filename}")
 
-@app.get("/file_segments", summary="查看某个文件的所有分片")
-def file_segments(filename: str):
-    # 直接返回列表，前端可直接渲染
-    return db.file_segments(filename)
+@app.get("/file_segments", summary="查看某个文件的分片（分页）")
+async def file_segments(
+    filename: str,
+    limit: int = Query(200, ge=1, le=5000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    # 仍直接返回列表，前端可直接渲染；还有下一页时通过响应头 X-Next-Cursor 给出游标
+    try:
+        rows, next_cursor = await adb.scroll(filename, limit=limit, cursor=cursor, fields=_parse_fields(fields))
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _json(rows, headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
+
+@app.get("/export", summary="NDJSON 流式导出分片（单个文件或整个集合）")
+async def export(filename: Optional[str] = None, fields: Optional[str] = None, page_size: int = Query(1000, ge=1, le=10000)):
+    async def lines():
+        async for rows in adb.iter_pages(filename, fields=_parse_fields(fields), page_size=page_size):
+            yield b"".join(orjson.dumps(r) + b"\n" for r in rows)
+
+    name = f"{filename or QDRANT_COLLECTION}.ndjson"
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(name)}"},
+    )
 
 # -------------------- Get by IDs（只选不写） --------------------
-@app.post("/points_by_ids", response_model=List[Chunk], summary="按ID批量取原文")
+@app.post("/points_by_ids", summary="按ID批量取原文")
 async def points_by_ids(req: IdsRequest):
+    """
+    返回 `[{"id", "text", "meta"}]`，顺序与 ids 一致，不存在的 id 省略。
+    传 fields 时只返回对应字段：如 `fields=["meta"]` 的行没有 text，`fields=["page"]` 的 meta 只含 page。
+    """
     ids = getattr(req, "ids", []) or []
     if not ids:
-        return []
-    rows = db.get_by_ids(ids)
-    return [Chunk(id=r["id"], text=r["text"], meta=r["meta"]) for r in rows]
+        return _json([])
+    rows = await adb.get_by_ids(ids, fields=req.fields)
+    return _json(rows)
+
+# -------------------- Cache --------------------
+@app.get("/cache_stats", summary="缓存命中统计")
+def cache_stats():
+    return {
+        "query_embedding": embedder.query_cache.stats(),
+        "query_batcher": embedder.query_batcher.stats() if embedder.query_batcher else None,
+        "search_result": search_cache.stats(),
+        "embedding_store": embedder.store.stats() if embedder.store else None,
+        "lexical_index": db.lexical_stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse, summary="Prometheus 指标（汇总所有 worker）")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # -------------------- Health --------------------
 @app.get("/healthz")
 def health():
-    return {"status": "ok"}
+    schema = db.schema_status()
+    embedding = embedder.hosts.stats()
+    ok = schema.get("ready") and embedding["healthy"] > 0
+    return {"status": "ok" if ok else "degraded", "schema": schema, "embedding": embedding}
@@ -0,0 +1,343 @@
+# app/metrics.py
+"""
+指标：计数器 / 直方图，Prometheus 文本格式导出，并给每个请求生成 Server-Timing 分阶段耗时。
+
+- 每个进程在内存里累加，最多每 METRICS_FLUSH_INTERVAL 秒把快照原子写到 METRICS_DIR/<pid>.<token>.pickle
+  （默认在 /dev/shm 下，与缓存同目录），/metrics 合并目录下全部快照，多个 gunicorn worker 的数据因此能正确求和
+- 已退出 worker 的快照在下次 /metrics 时并入 dead.pickle（计数器单调不减，文件数不随 worker 重启增长），
+  目录随容器重启清空
+- timed() 计时一段代码写入直方图；传 stage 时同时记到当前请求的 Server-Timing
+  （contextvars 实现，asyncio.to_thread / gather 里同样可见；线程池 map 里不可见，只记直方图）
+- METRICS=0 时不累加、不落盘，Server-Timing 仍然输出
+"""
+import os
+import time
+import fcntl
+import atexit
+import uuid
+import pickle
+import inspect
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.config import METRICS, METRICS_DIR, METRICS_FLUSH_INTERVAL
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+# 名称 → (类型, 说明, 直方图桶)；只有在这里声明过的指标才能记录
+DEFINITIONS: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {
+    "vqa_http_request_seconds": ("histogram", "HTTP request latency by route", LATENCY_BUCKETS),
+    "vqa_embed_seconds": ("histogram", "Ollama embedding request latency by host (one sample per attempt)", LATENCY_BUCKETS),
+    "vqa_embed_retries_total": ("counter", "Embedding batches retried on another host, by the host that failed", ()),
+    "vqa_embed_ejections_total": ("counter", "Embedding hosts ejected from the pool, by reason (error / slow / probe)", ()),
+    "vqa_embed_texts_total": ("counter", "Texts sent to Ollama for embedding", ()),
+    "vqa_embed_query_seconds": ("histogram", "Query embedding latency seen by the request, including coalescing wait", LATENCY_BUCKETS),
+    "vqa_batcher_batch_size": ("histogram", "Distinct items per coalesced batch", COUNT_BUCKETS),
+    "vqa_batcher_rejected_total": ("counter", "Submissions rejected because the coalescing queue was full", ()),
+    "vqa_vector_db_seconds": ("histogram", "Vector store call latency by backend and operation", LATENCY_BUCKETS),
+    "vqa_postprocess_seconds": ("histogram", "Search post-processing (MMR / collapse / filter) latency", LATENCY_BUCKETS),
+    "vqa_fallback_total": ("counter", "Keyword fallbacks after empty vector search, by kind (lexical / scan)", ()),
+    "vqa_ingest_chunks": ("histogram", "Chunks per ingested file", COUNT_BUCKETS),
+    "vqa_split_seconds": ("histogram", "Time spent parsing and chunking a file, by content type", LATENCY_BUCKETS),
+    "vqa_cache_requests_total": ("counter", "Cache lookups by cache and result (hit / miss)", ()),
+}
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+# 已退出 worker 的汇总快照：(counters, histograms, 已并入的快照文件名)
+DEAD_FILE = "dead.pickle"
+
+# 当前请求的 [(stage, 秒数或 None, desc)]；不在请求内时为 None
+_timings: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("server_timing", default=None)
+
+
+def _labels(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Registry:
+    def __init__(self, directory: str = METRICS_DIR, flush_interval: float = METRICS_FLUSH_INTERVAL,
+                 enabled: bool = METRICS):
+        self._dir = directory
+        self.flush_interval = float(flush_interval)
+        self.enabled = enabled
+        self.counters: Dict[_Key, float] = {}
+        # 每个直方图：[各桶计数（非累计）..., +Inf 桶, sum]
+        self.histograms: Dict[_Key, List[float]] = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._token = None
+        self._last_flush = 0.0
+
+    @property
+    def directory(self) -> str:
+        if not self._dir:
+            from app.cache import default_cache_dir
+            self._dir = os.path.join(default_cache_dir(), "metrics")
+        return self._dir
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        if not self.enabled:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            self._check_pid()
+            self.counters[key] = self.counters.get(key, 0.0) + value
+        self._maybe_flush()
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        if not self.enabled:
+            return
+        buckets = DEFINITIONS[name][2]
+        key = (name, _labels(labels))
+        i = 0
+        while i < len(buckets) and value > buckets[i]:
+            i += 1
+        with self._lock:
+            self._check_pid()
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [0.0] * (len(buckets) + 2)
+            h[i] += 1
+            h[-1] += value
+        self._maybe_flush()
+
+    # -------------------- 跨进程聚合 --------------------
+    def _check_pid(self) -> None:
+        # fork 出的子进程丢弃继承来的计数并换文件名；token 防止 pid 复用时覆盖已退出 worker 的快照
+        if self._pid != os.getpid():
+            self._pid, self._token = os.getpid(), uuid.uuid4().hex[:8]
+            self.counters.clear()
+            self.histograms.clear()
+
+    def _path(self) -> str:
+        self._check_pid()
+        return os.path.join(self.directory, f"{self._pid}.{self._token}.pickle")
+
+    def _maybe_flush(self) -> None:
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            path = self._path()
+            self._last_flush = time.monotonic()
+            blob = pickle.dumps((self.counters, self.histograms), protocol=pickle.HIGHEST_PROTOCOL)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+
+    def _load(self, name: str):
+        try:
+            with open(os.path.join(self.directory, name), "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            return None
+
+    def _fold_dead(self, names: List[str]) -> List[str]:
+        """
+        把已退出进程的快照并入 DEAD_FILE 后删除，返回仍需逐个读取的文件名。
+        先写汇总（连同已并入的文件名）再删文件：中途崩溃时下次按文件名跳过，不会重复计数。
+        """
+        dead = self._load(DEAD_FILE) or ({}, {}, set())
+        counters, histograms, folded = dead
+        gone = [n for n in names if n != DEAD_FILE and n not in folded and not _alive(n)]
+        for n in gone:
+            snap = self._load(n)
+            if snap is not None:
+                _merge(counters, histograms, *snap)
+        stale = [n for n in names if n in folded]
+        if gone:
+            folded = (folded & set(names)) | set(gone)
+            blob = pickle.dumps((counters, histograms, folded), protocol=pickle.HIGHEST_PROTOCOL)
+            tmp = os.path.join(self.directory, f"{DEAD_FILE}.{os.getpid()}.tmp")
+            with open(tmp, "wb") as f:
+                f.write(blob)
+            os.replace(tmp, os.path.join(self.directory, DEAD_FILE))
+        for n in gone + stale:
+            try:
+                os.remove(os.path.join(self.directory, n))
+            except FileNotFoundError:
+                pass
+        rest = [n for n in names if n not in gone and n not in stale]
+        return rest if DEAD_FILE in rest or not gone else rest + [DEAD_FILE]
+
+    def collect(self) -> Tuple[Dict[_Key, float], Dict[_Key, List[float]]]:
+        """刷新本进程快照后合并目录下所有进程的快照（含已退出进程的汇总）。"""
+        self.flush()
+        counters: Dict[_Key, float] = {}
+        histograms: Dict[_Key, List[float]] = {}
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith(".pickle")]
+        except FileNotFoundError:
+            return counters, histograms
+        # 多个 worker 同时抓取时串行：并入与读取之间不能被另一个 worker 的并入打断
+        with open(os.path.join(self.directory, "dead.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            for n in self._fold_dead(names):
+                snap = self._load(n)
+                if snap is not None:
+                    _merge(counters, histograms, *snap[:2])
+        return counters, histograms
+
+    def render(self) -> str:
+        counters, histograms = self.collect()
+        lines: List[str] = []
+        for name, (kind, help_, buckets) in DEFINITIONS.items():
+            lines.append(f"# HELP {name} {help_}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (n, labels), v in sorted(counters.items()):
+                    if n == name:
+                        lines.append(f"{name}{_fmt_labels(labels)} {_fmt(v)}")
+                continue
+            for (n, labels), h in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cum = 0.0
+                for le, c in zip([*buckets, "+Inf"], h[:-1]):
+                    cum += c
+                    lines.append(f"{name}_bucket{_fmt_labels(labels, le=le)} {_fmt(cum)}")
+                lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt(h[-1])}")
+                lines.append(f"{name}_count{_fmt_labels(labels)} {_fmt(cum)}")
+        return "\n".join(lines) + "\n"
+
+
+def _alive(name: str) -> bool:
+    """快照文件名 <pid>.<token>.pickle 对应的进程是否还在（pid 被复用时当作还在，只是晚些并入）。"""
+    try:
+        pid = int(name.split(".", 1)[0])
+    except ValueError:
+        return True
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(counters: Dict[_Key, float], histograms: Dict[_Key, List[float]],
+           cs: Dict[_Key, float], hs: Dict[_Key, List[float]]) -> None:
+    for k, v in cs.items():
+        counters[k] = counters.get(k, 0.0) + v
+    for k, v in hs.items():
+        if k[0] not in DEFINITIONS or len(v) != len(DEFINITIONS[k[0]][2]) + 2:
+            continue    # 桶定义已变化的旧快照
+        acc = histograms.setdefault(k, [0.0] * len(v))
+        for i, x in enumerate(v):
+            acc[i] += x
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(labels: Iterable[Tuple[str, str]], le=None) -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels]
+    if le is not None:
+        parts.append(f'le="{le if isinstance(le, str) else _fmt(le)}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+registry = Registry()
+# 进程退出前写一次快照，最后不满一个刷新间隔的数据不丢
+atexit.register(registry.flush)
+inc = registry.inc
+observe = registry.observe
+flush = registry.flush
+render = registry.render
+
+
+# -------------------- Server-Timing --------------------
+def start_request() -> list:
+    """在请求入口调用，返回本请求的耗时列表（交给 server_timing 生成响应头）。"""
+    timings: list = []
+    _timings.set(timings)
+    return timings
+
+
+def mark(stage: str, seconds: Optional[float] = None, desc: Optional[str] = None) -> None:
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((stage, seconds, desc))
+
+
+@contextmanager
+def timed(metric: str, stage: Optional[str] = None, **labels: Any):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        observe(metric, dt, **labels)
+        if stage:
+            mark(stage, dt)
+
+
+def server_timing(timings: list, total: Optional[float] = None) -> str:
+    """同名阶段的耗时累加（例如一次请求里的多次 Qdrant 调用），按首次出现的顺序输出。"""
+    durs: Dict[str, float] = {}
+    descs: Dict[str, str] = {}
+    for stage, seconds, desc in timings:
+        durs.setdefault(stage, 0.0)
+        if seconds is not None:
+            durs[stage] += seconds
+        if desc:
+            descs[stage] = desc
+    if total is not None:
+        durs["total"] = total
+    parts = []
+    for stage, seconds in durs.items():
+        item = f"{stage};dur={seconds * 1000:.2f}"
+        if stage in descs:
+            item += f';desc="{descs[stage]}"'
+        parts.append(item)
+    return ", ".join(parts)
+
+
+class Instrumented:
+    """
+    包装客户端对象：每次公开方法调用计入 metric 直方图（op = 方法名），并记为 Server-Timing 的 {stage}_{op}。
+    协程方法返回协程，耗时按 await 完成计。
+    """
+
+    def __init__(self, target, metric: str, stage: str, **labels: Any):
+        self._target = target
+        self._metric = metric
+        self._stage = stage
+        self._labels = labels
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._target, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        metric, stage, labels = self._metric, f"{self._stage}_{name}", {**self._labels, "op": name}
+        if inspect.iscoroutinefunction(attr):
+            async def acall(*args, **kwargs):
+                with timed(metric, stage, **labels):
+                    return await attr(*args, **kwargs)
+            return acall
+
+        def call(*args, **kwargs):
+            with timed(metric, stage, **labels):
+                return attr(*args, **kwargs)
+        return call
+
+
+def instrument(target, metric: str = "vqa_vector_db_seconds", stage: str = "qdrant", **labels: Any):
+    return Instrumented(target, metric, stage, **labels)
@@ -14,6 +14,12 @@ class SearchRequest(BaseModel):
     max_results: Optional[int] = None   # None 表示不额外截断（由 top_k 决定）
     max_return: Optional[int] = None    # 兼容旧字段名
     path: Optional[str] = ""
+    oversampling: Optional[float] = Field(None, ge=1.0)   # 量化集合：候选放大倍数，None 用配置默认值
+    rescore: Optional[bool] = None                        # 量化集合：是否用原始向量重新打分
+    mode: Optional[str] = None          # vector / hybrid / keyword，None 用配置 SEARCH_MODE
+    mmr: Optional[bool] = None          # MMR 去冗余，None 用配置 SEARCH_MMR
+    mmr_lambda: Optional[float] = Field(None, ge=0.0, le=1.0)
+    collapse: Optional[bool] = None     # 合并同文件重叠分块，None 用配置 SEARCH_COLLAPSE
 
 class SearchResult(BaseModel):
     id: Optional[str] = None
@@ -21,9 +27,33 @@ class SearchResult(BaseModel):
     meta: Dict[str, Any]
     score: float
 
+class BatchSearchRequest(BaseModel):
+    queries: List[SearchRequest] = Field(..., max_length=64)
+    fuse: bool = False                  # 是否另返回各查询结果的 RRF 融合并集
+    fuse_top_k: Optional[int] = None    # 融合结果条数，None 取各查询 top_k 的最大值
+
+class BatchSearchResult(BaseModel):
+    results: List[List[SearchResult]]   # 与 queries 一一对应
+    fused: Optional[List[SearchResult]] = None
+
 class UploadResult(BaseModel):
     detail: List[Dict[str, Any]]
 
+class JobStatus(BaseModel):
+    id: str
+    filename: str
+    status: str                         # queued / running / done / error（部分分块失败也记为 error，见 failed）
+    parsed: int = 0
+    embedded: int = 0
+    written: int = 0
+    skipped: int = 0                    # 内容未变、无需重新 embedding 的分块
+    deleted: int = 0                    # 已不存在而被删除的旧分块
+    failed: int = 0
+    segments: Optional[int] = None
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+
 class FileListResult(BaseModel):
     files: List[Dict[str, Any]]
 
@@ -36,6 +66,7 @@ class DeleteResult(BaseModel):
 # 只选不写：按 id 批量取原文
 class IdsRequest(BaseModel):
     ids: List[str]
+    fields: Optional[List[str]] = None  # 只返回这些字段（text / meta / 具体元信息键），None 为全部
 
 class Chunk(BaseModel):
     id: Optional[str] = None
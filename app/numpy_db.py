@@ -0,0 +1,715 @@
+# app/numpy_db.py
+"""
+进程内向量库：不依赖 Qdrant 服务，接口与 QdrantDB / AsyncQdrantDB 一致，适合小租户与 CI。
+
+存储（NUMPY_DB_DIR/<集合名>/）：
+- vectors.f32：按槽位存放的 float32 矩阵（写入时已归一化），np.memmap 映射，容量按倍数扩展
+- points.sqlite3：payload 旁路表（槽位 ↔ 点 id、filename、payload）、空闲槽位、文件清单
+- lexical.sqlite3：词法索引（与 Qdrant 后端相同的 FTS5 / BM25）
+
+检索：余弦相似度 = 归一化向量点积，分块 BLAS 矩阵乘 + argpartition 取 top-k，批量查询一次矩阵乘；
+点数达到 NUMPY_IVF_MIN_POINTS 且 NUMPY_IVF_LISTS > 0 时用球面 k-means 粗聚类（IVF），只扫描最近的 nprobe 个簇。
+带 path 的检索先从 points.path 索引取出该路径下的槽位（按代数缓存），只对这些槽位精确打分。
+
+多进程：写入在 SQLite 事务（BEGIN IMMEDIATE）内分配槽位，先写向量再提交，提交后 bump 代数；
+读侧发现代数变化时重新加载槽位表（只对新增 / 变化的槽位重新分簇）。
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import (
+    EMBEDDING_DIM, CACHE_DIR, LEXICAL_INDEX, FALLBACK_SCAN_LIMIT, HYBRID_CANDIDATES, RRF_K, SCORE_THRESHOLD,
+    NUMPY_DB_DIR, NUMPY_IVF_LISTS, NUMPY_IVF_NPROBE, NUMPY_IVF_MIN_POINTS, NUMPY_SEARCH_CHUNK,
+)
+from . import metrics
+from .cache import Generation, default_cache_dir
+from .lexical import LexicalIndex, reciprocal_rank_fusion
+from .sharding import normalize_path
+from .vector_db import SEARCH_MODES, InvalidCursor, SchemaError
+
+logger = logging.getLogger("numpy-db")
+
+_IN_CHUNK = 500
+_MIN_CAPACITY = 1024
+_IVF_ITERS = 10
+_IVF_SAMPLE = 50000
+# 每个集合缓存多少个 path 的候选槽位
+_SCOPE_CACHE = 64
+
+
+def _unit_rows(m: np.ndarray) -> np.ndarray:
+    return m / np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+
+
+def _dumps(payload: Dict[str, Any]) -> str:
+    return json.dumps(payload, ensure_ascii=False)
+
+
+def _project(pid: str, payload: Dict[str, Any], fields: Optional[Sequence[str]]) -> Dict[str, Any]:
+    # 与 qdrant_client._project_rows 的规则一致：id 总是返回，fields 为空返回全部
+    meta = {k: v for k, v in payload.items() if k != "text"}
+    if not fields:
+        return {"id": pid, "text": payload.get("text", "") or "", "meta": meta}
+    row: Dict[str, Any] = {"id": pid}
+    if "text" in fields:
+        row["text"] = payload.get("text", "") or ""
+    keys = [f for f in fields if f not in ("id", "text", "meta")]
+    if "meta" in fields:
+        row["meta"] = meta
+    elif keys:
+        row["meta"] = {k: meta[k] for k in keys if k in meta}
+    return row
+
+
+class _IVF:
+    """球面 k-means 粗聚类：centroids 为单位向量，assign[slot] 为槽位所属簇（-1 表示未分配）。"""
+
+    def __init__(self, centroids: np.ndarray, trained_on: int):
+        self.centroids = centroids
+        self.trained_on = trained_on
+        self.assign = np.full(0, -1, dtype=np.int32)
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, nlist: int) -> "_IVF":
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), _IVF_SAMPLE), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(_IVF_ITERS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=nlist) == 0
+            # 空簇用随机样本重新播种
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = _unit_rows(sums)
+        return cls(centroids.astype(np.float32), len(vectors))
+
+    def assign_slots(self, matrix: np.ndarray, slots: np.ndarray, capacity: int) -> "_IVF":
+        """返回给 slots 分好簇的新实例；本实例可能正被其他线程的检索读取，assign 不原地修改。"""
+        out = _IVF(self.centroids, self.trained_on)
+        out.assign = np.full(max(capacity, len(self.assign)), -1, dtype=np.int32)
+        out.assign[: len(self.assign)] = self.assign
+        for i in range(0, len(slots), NUMPY_SEARCH_CHUNK):
+            part = slots[i : i + NUMPY_SEARCH_CHUNK]
+            out.assign[part] = np.argmax(matrix[part] @ self.centroids.T, axis=1)
+        return out
+
+
+class _Snapshot:
+    """
+    某一代数下的读侧视图。整体替换、不原地修改（scopes 缓存除外），
+    检索开始时取一次引用，之后全程只用它，不会读到一半被另一个线程换掉。
+    """
+    __slots__ = ("gen", "matrix", "slots", "slot_ids", "alive", "ivf", "scopes")
+
+    def __init__(self, gen: Optional[str] = None, matrix: Optional[np.ndarray] = None,
+                 slots: Optional[np.ndarray] = None, slot_ids: Optional[Dict[int, str]] = None,
+                 alive: Optional[np.ndarray] = None, ivf: Optional[_IVF] = None):
+        self.gen = gen
+        self.matrix = matrix
+        self.slots = slots if slots is not None else np.empty(0, dtype=np.int64)    # 存活槽位
+        self.slot_ids = slot_ids or {}
+        self.alive = alive if alive is not None else np.zeros(0, dtype=bool)      # 按槽位的存活标记（长度 = 最大槽位 + 1）
+        self.ivf = ivf
+        self.scopes: Dict[str, np.ndarray] = {}          # path → 候选槽位
+
+
+def _merge_topk(nq: int, k: int, chunks) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """chunks 逐块给出 (分数 [查询 × 块内点], 块内点的槽位)，argpartition 合并出每个查询的 (槽位, 分数)（降序）。"""
+    best_s = np.full((nq, 0), -np.inf, dtype=np.float32)
+    best_i = np.zeros((nq, 0), dtype=np.int64)
+    for scores, slots in chunks:
+        kk = min(k, len(slots))
+        part = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+        best_s = np.concatenate([best_s, np.take_along_axis(scores, part, axis=1)], axis=1)
+        best_i = np.concatenate([best_i, slots[part]], axis=1)
+        if best_s.shape[1] > k:
+            keep = np.argpartition(-best_s, k - 1, axis=1)[:, :k]
+            best_s = np.take_along_axis(best_s, keep, axis=1)
+            best_i = np.take_along_axis(best_i, keep, axis=1)
+    out = []
+    for s, i in zip(best_s, best_i):
+        order = np.argsort(-s, kind="stable")
+        out.append((i[order], s[order]))
+    return out
+
+
+class NumpyDB:
+    def __init__(self, collection_name: str, root: str = NUMPY_DB_DIR, dim: int = EMBEDDING_DIM):
+        self.collection_name = collection_name
+        self.dim = dim
+        self.dir = os.path.join(root, collection_name)
+        self._vec_path = os.path.join(self.dir, "vectors.f32")
+        self._db_path = os.path.join(self.dir, "points.sqlite3")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = None
+        self._lock = threading.RLock()
+        self._gen = Generation(os.path.join(CACHE_DIR or default_cache_dir(), f"generation.numpy.{collection_name}"))
+        self.lexical: Optional[LexicalIndex] = (
+            LexicalIndex(os.path.join(self.dir, "lexical.sqlite3")) if LEXICAL_INDEX else None
+        )
+        self._schema_error: Optional[SchemaError] = None
+        # 读侧快照：代数不变时复用，变化时整体替换
+        self._snap = _Snapshot()
+
+    @staticmethod
+    def list_collections(root: str = NUMPY_DB_DIR) -> List[str]:
+        try:
+            return sorted(n for n in os.listdir(root) if os.path.isfile(os.path.join(root, n, "points.sqlite3")))
+        except FileNotFoundError:
+            return []
+
+    # -------------------- 存储 --------------------
+    def _db(self) -> sqlite3.Connection:
+        # fork 之后按 pid 重新建连
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(self.dir, exist_ok=True)
+            conn = sqlite3.connect(self._db_path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS points ("
+                " slot INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, filename TEXT, payload TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS points_filename ON points(filename)")
+            # 旧库没有 path 列：补上，已有分块视为根路径
+            if "path" not in {r[1] for r in conn.execute("PRAGMA table_info(points)")}:
+                conn.execute("ALTER TABLE points ADD COLUMN path TEXT NOT NULL DEFAULT ''")
+            conn.execute("CREATE INDEX IF NOT EXISTS points_path ON points(path)")
+            conn.execute("CREATE TABLE IF NOT EXISTS free (slot INTEGER PRIMARY KEY)")
+            conn.execute("CREATE TABLE IF NOT EXISTS files (filename TEXT PRIMARY KEY, payload TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("INSERT OR IGNORE INTO meta(key, value) VALUES ('dim', ?)", (str(self.dim),))
+            conn.execute("INSERT OR IGNORE INTO meta(key, value) VALUES ('next_slot', '0')")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _capacity(self) -> int:
+        try:
+            return os.path.getsize(self._vec_path) // (self.dim * 4)
+        except OSError:
+            return 0
+
+    def _write_vectors(self, slots: List[int], vecs: np.ndarray):
+        need = max(slots) + 1
+        cap = self._capacity()
+        if need > cap:
+            cap = max(need, cap * 2, _MIN_CAPACITY)
+            with open(self._vec_path, "ab") as f:
+                f.truncate(cap * self.dim * 4)
+        mm = np.memmap(self._vec_path, dtype=np.float32, mode="r+", shape=(cap, self.dim))
+        mm[slots] = vecs
+        mm.flush()
+        del mm
+
+    def _rows_by(self, sql: str, keys: List[Any]) -> List[Tuple]:
+        db = self._db()
+        out = []
+        for i in range(0, len(keys), _IN_CHUNK):
+            part = keys[i : i + _IN_CHUNK]
+            out.extend(db.execute(sql.format(marks=",".join("?" * len(part))), part).fetchall())
+        return out
+
+    # -------------------- schema --------------------
+    def ensure_schema(self):
+        if self._schema_error is not None:
+            raise self._schema_error
+        with self._lock:
+            row = self._db().execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        if int(row[0]) != self.dim:
+            self._schema_error = SchemaError(
+                f"{self.dir} 的向量维度为 {row[0]}，与 EMBEDDING_DIM={self.dim} 不一致；"
+                f"请修改 EMBEDDING_DIM / EMBEDDING_MODEL，或换一个 QDRANT_COLLECTION"
+            )
+            logger.error("%s", self._schema_error)
+            raise self._schema_error
+        if self.lexical is not None and not self.lexical.is_built() and not self._count():
+            self.lexical.mark_built()
+
+    def schema_status(self) -> Dict[str, Any]:
+        return {
+            "ready": self._schema_error is None,
+            "backend": "numpy",
+            "collection": self.collection_name,
+            "path": self.dir,
+            "vector_size": self.dim,
+            "points": self._count(),
+            "ivf_lists": len(self._snap.ivf.centroids) if self._snap.ivf is not None else 0,
+            "error": str(self._schema_error) if self._schema_error else None,
+        }
+
+    def _count(self) -> int:
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM points").fetchone()[0]
+
+    def generation(self) -> str:
+        return self._gen.current()
+
+    # -------------------- 写入 / 删除 --------------------
+    def insert(self, vector, text, meta):
+        self.insert_many([vector], [text], [meta])
+
+    def insert_many(self, vectors, texts, metas, ids=None):
+        """写入（id 已存在则覆盖原槽位）；向量在写入时归一化。"""
+        self.ensure_schema()
+        vecs = _unit_rows(np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1))
+        if vecs.shape[1] != self.dim:
+            raise ValueError(f"向量维度 {vecs.shape[1]} 与 EMBEDDING_DIM={self.dim} 不一致")
+        ids = [str(i) for i in ids] if ids else [str(uuid.uuid4()) for _ in texts]
+        # 同一批内重复的 id 以最后一次为准
+        latest = {pid: i for i, pid in enumerate(ids)}
+        order = sorted(latest.values())
+        rows = []
+        for i in order:
+            payload = dict((metas[i] if metas else None) or {})
+            payload["text"] = texts[i]
+            rows.append((ids[i], payload.get("filename"), payload))
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                existing = dict(self._rows_by("SELECT id, slot FROM points WHERE id IN ({marks})", [r[0] for r in rows]))
+                need = sum(1 for r in rows if r[0] not in existing)
+                reuse = [s for (s,) in db.execute("SELECT slot FROM free ORDER BY slot LIMIT ?", (need,))]
+                next_slot = int(db.execute("SELECT value FROM meta WHERE key = 'next_slot'").fetchone()[0])
+                slots = []
+                for pid, _, _ in rows:
+                    if pid in existing:
+                        slots.append(existing[pid])
+                    elif reuse:
+                        slots.append(reuse.pop(0))
+                    else:
+                        slots.append(next_slot)
+                        next_slot += 1
+                self._write_vectors(slots, vecs[order])
+                db.executemany("DELETE FROM free WHERE slot = ?", [(s,) for s in slots])
+                db.executemany(
+                    "INSERT OR REPLACE INTO points(slot, id, filename, path, payload) VALUES (?, ?, ?, ?, ?)",
+                    [(s, pid, fname, payload.get("path") or "", _dumps(payload))
+                     for s, (pid, fname, payload) in zip(slots, rows)],
+                )
+                db.execute("UPDATE meta SET value = ? WHERE key = 'next_slot'", (str(next_slot),))
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        if self.lexical is not None:
+            try:
+                self.lexical.add_many((pid, payload["text"], fname, payload.get("path")) for pid, fname, payload in rows)
+            except Exception:
+                logger.exception("Lexical index update failed (%d points)", len(rows))
+        self._gen.bump()
+
+    def update_payloads(self, ids, texts, metas):
+        """覆盖已有点的 payload，向量与槽位不动（只有元信息变化的分块）；不存在的 id 忽略。"""
+        if not ids:
+            return
+        rows = []
+        for pid, text, meta in zip(ids, texts, metas):
+            payload = {**(meta or {}), "text": text}
+            rows.append((payload.get("filename"), payload.get("path") or "", _dumps(payload), str(pid)))
+        try:
+            with self._lock:
+                db = self._db()
+                db.execute("BEGIN IMMEDIATE")
+                try:
+                    db.executemany("UPDATE points SET filename = ?, path = ?, payload = ? WHERE id = ?", rows)
+                    db.execute("COMMIT")
+                except Exception:
+                    db.execute("ROLLBACK")
+                    raise
+        finally:
+            self._gen.bump()
+
+    def _free_slots(self, where: str, keys: List[Any]) -> int:
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                slots = [s for (s,) in self._rows_by(f"SELECT slot FROM points WHERE {where}", keys)]
+                for i in range(0, len(slots), _IN_CHUNK):
+                    part = slots[i : i + _IN_CHUNK]
+                    db.execute(f"DELETE FROM points WHERE slot IN ({','.join('?' * len(part))})", part)
+                db.executemany("INSERT OR IGNORE INTO free(slot) VALUES (?)", [(s,) for s in slots])
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return len(slots)
+
+    def delete_ids(self, ids: List[str]):
+        if not ids:
+            return
+        try:
+            self._free_slots("id IN ({marks})", [str(i) for i in ids])
+            if self.lexical is not None:
+                self.lexical.delete_ids(ids)
+        finally:
+            self._gen.bump()
+
+    def delete_by_filename(self, filename):
+        try:
+            self._free_slots("filename IN ({marks})", [filename])
+            with self._lock:
+                self._db().execute("DELETE FROM files WHERE filename = ?", (filename,))
+            if self.lexical is not None:
+                self.lexical.delete_filename(filename)
+        finally:
+            self._gen.bump()
+
+    def point_ids(self, filename) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._db().execute("SELECT id FROM points WHERE filename = ?", (filename,))]
+
+    # -------------------- 文件清单 --------------------
+    def update_manifest(self, filename, **fields):
+        with self._lock:
+            db = self._db()
+            old = db.execute("SELECT payload FROM files WHERE filename = ?", (filename,)).fetchone()
+            payload = json.loads(old[0]) if old else {}
+            payload.update({k: v for k, v in fields.items() if v is not None})
+            payload["filename"] = filename
+            payload["segments"] = db.execute("SELECT COUNT(*) FROM points WHERE filename = ?", (filename,)).fetchone()[0]
+            if not payload["segments"]:
+                db.execute("DELETE FROM files WHERE filename = ?", (filename,))
+                return
+            payload.setdefault("ingested_at", time.time())
+            db.execute("INSERT OR REPLACE INTO files(filename, payload) VALUES (?, ?)", (filename, _dumps(payload)))
+
+    def list_files(self):
+        with self._lock:
+            return [json.loads(p) for (p,) in self._db().execute("SELECT payload FROM files ORDER BY filename")]
+
+    # -------------------- 读取 --------------------
+    def get_by_ids(self, ids: List[str], fields=None, with_vectors: bool = False):
+        if not ids:
+            return []
+        with self._lock:
+            found = {pid: (slot, json.loads(p)) for slot, pid, p in
+                     self._rows_by("SELECT slot, id, payload FROM points WHERE id IN ({marks})", [str(i) for i in ids])}
+        rows = []
+        for pid in dict.fromkeys(str(i) for i in ids):
+            if pid not in found:
+                continue
+            slot, payload = found[pid]
+            row = _project(pid, payload, fields)
+            if with_vectors:
+                snap = self._snapshot()
+                row["vector"] = snap.matrix[slot].tolist() if snap.matrix is not None and slot < len(snap.matrix) else None
+            rows.append(row)
+        return rows
+
+    def scroll(self, filename=None, limit: int = 200, cursor=None, fields=None):
+        """按槽位顺序分页，游标为下一页第一个槽位。"""
+        try:
+            start = int(cursor) if cursor else 0
+        except ValueError:
+            start = -1
+        if start < 0:
+            raise InvalidCursor(f"无效的游标: {cursor}")
+        sql = "SELECT slot, id, payload FROM points WHERE slot >= ?"
+        args: List[Any] = [start]
+        if filename:
+            sql += " AND filename = ?"
+            args.append(filename)
+        sql += " ORDER BY slot LIMIT ?"
+        args.append(limit + 1)
+        with self._lock:
+            got = self._db().execute(sql, args).fetchall()
+        rows = [_project(pid, json.loads(p), fields) for _, pid, p in got[:limit]]
+        return rows, (str(got[limit][0]) if len(got) > limit else None)
+
+    def file_segments(self, filename, limit=200):
+        rows, _ = self.scroll(filename, limit=limit)
+        return rows
+
+    # -------------------- 检索 --------------------
+    def _snapshot(self) -> _Snapshot:
+        """代数变化时重新加载存活槽位与 memmap；IVF 只对新增 / 变化的槽位重新分簇。"""
+        gen = self._gen.current()
+        snap = self._snap
+        if gen == snap.gen:
+            return snap
+        with self._lock:
+            snap = self._snap
+            if gen == snap.gen:
+                return snap
+            rows = self._db().execute("SELECT slot, id FROM points ORDER BY slot").fetchall()
+            cap = self._capacity()
+            matrix = np.memmap(self._vec_path, dtype=np.float32, mode="r", shape=(cap, self.dim)) if cap else None
+            slots = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+            slot_ids = {s: pid for s, pid in rows}
+            alive = np.zeros(int(slots.max()) + 1 if len(slots) else 0, dtype=bool)
+            alive[slots] = True
+
+            ivf = snap.ivf
+            if NUMPY_IVF_LISTS > 0 and len(slots) >= max(NUMPY_IVF_MIN_POINTS, NUMPY_IVF_LISTS) and matrix is not None:
+                if ivf is None or len(slots) > 2 * ivf.trained_on:
+                    t0 = time.perf_counter()
+                    ivf = _IVF.train(np.asarray(matrix[slots]), NUMPY_IVF_LISTS).assign_slots(matrix, slots, cap)
+                    logger.info("Trained IVF: lists=%d points=%d in %.1fs",
+                                NUMPY_IVF_LISTS, len(slots), time.perf_counter() - t0)
+                else:
+                    changed = np.asarray([s for s, pid in rows if snap.slot_ids.get(s) != pid], dtype=np.int64)
+                    ivf = ivf.assign_slots(matrix, changed, cap)
+            else:
+                ivf = None
+
+            self._snap = snap = _Snapshot(gen, matrix, slots, slot_ids, alive, ivf)
+            return snap
+
+    def _scope_slots(self, snap: _Snapshot, path: str) -> np.ndarray:
+        """path 及其子路径下、在快照里存活的槽位。"""
+        slots = snap.scopes.get(path)
+        if slots is not None:
+            return slots
+        with self._lock:
+            # 子路径用范围条件匹配（'/' 的下一个字符是 '0'），走 points_path 索引
+            got = self._db().execute(
+                "SELECT slot FROM points WHERE path = ? OR (path >= ? AND path < ?) ORDER BY slot",
+                (path, path + "/", path + "0"),
+            ).fetchall()
+            slots = np.fromiter((r[0] for r in got), dtype=np.int64, count=len(got))
+            slots = slots[slots < len(snap.alive)]
+            slots = slots[snap.alive[slots]]
+            if len(snap.scopes) >= _SCOPE_CACHE:
+                snap.scopes.pop(next(iter(snap.scopes)))
+            snap.scopes[path] = slots
+        return slots
+
+    @staticmethod
+    def _exact_topk(snap: _Snapshot, queries: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """全量：按槽位区间分块矩阵乘（连续切片，不复制），已删除槽位记 -inf。"""
+        def chunks():
+            n = len(snap.alive)
+            for start in range(0, n, NUMPY_SEARCH_CHUNK):
+                end = min(n, start + NUMPY_SEARCH_CHUNK)
+                scores = queries @ snap.matrix[start:end].T
+                scores[:, ~snap.alive[start:end]] = -np.inf
+                yield scores, np.arange(start, end)
+        return _merge_topk(len(queries), k, chunks())
+
+    @staticmethod
+    def _subset_topk(snap: _Snapshot, queries: np.ndarray, k: int,
+                     cand: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """只在候选槽位里精确打分（path 过滤后的检索）。"""
+        def chunks():
+            for start in range(0, len(cand), NUMPY_SEARCH_CHUNK):
+                part = cand[start : start + NUMPY_SEARCH_CHUNK]
+                yield queries @ snap.matrix[part].T, part
+        return _merge_topk(len(queries), k, chunks())
+
+    @staticmethod
+    def _ivf_topk(snap: _Snapshot, queries: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        ivf = snap.ivf
+        nprobe = min(NUMPY_IVF_NPROBE, len(ivf.centroids))
+        probes = np.argpartition(-(queries @ ivf.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        assign = ivf.assign[snap.slots]
+        out = []
+        for q, probe in zip(queries, probes):
+            cand = snap.slots[np.isin(assign, probe)]
+            if not len(cand):
+                out.append((cand, np.empty(0, dtype=np.float32)))
+                continue
+            scores = snap.matrix[cand] @ q
+            kk = min(k, len(cand))
+            part = np.argpartition(-scores, kk - 1)[:kk]
+            part = part[np.argsort(-scores[part], kind="stable")]
+            out.append((cand[part], scores[part]))
+        return out
+
+    def _vector_batch(self, query_embs: List[List[float]], limits: List[int], thresholds: List[Optional[float]],
+                      with_vectors: bool, paths: Optional[List[str]] = None) -> List[List[Dict[str, Any]]]:
+        snap = self._snapshot()
+        if not query_embs or snap.matrix is None or not len(snap.slots):
+            return [[] for _ in query_embs]
+        queries = _unit_rows(np.asarray(query_embs, dtype=np.float32))
+        paths = paths or [""] * len(query_embs)
+        top: List[Any] = [None] * len(query_embs)
+        # 同一 path 的查询一起算：无 path 的走全量（或 IVF），有 path 的只扫描该路径下的槽位
+        groups: Dict[str, List[int]] = {}
+        for i, p in enumerate(paths):
+            groups.setdefault(p, []).append(i)
+        for p, idx in groups.items():
+            k = min(max(limits[i] for i in idx), len(snap.slots))
+            if p:
+                got = self._subset_topk(snap, queries[idx], k, self._scope_slots(snap, p))
+            elif snap.ivf is not None:
+                got = self._ivf_topk(snap, queries[idx], k)
+            else:
+                got = self._exact_topk(snap, queries[idx], k)
+            for i, t in zip(idx, got):
+                top[i] = t
+
+        wanted = {int(s) for slots, _ in top for s in slots}
+        with self._lock:
+            payloads = {slot: (pid, json.loads(p)) for slot, pid, p in
+                        self._rows_by("SELECT slot, id, payload FROM points WHERE slot IN ({marks})", list(wanted))}
+        results = []
+        for (slots, scores), limit, th in zip(top, limits, thresholds):
+            hits = []
+            for slot, score in zip(slots[:limit], scores[:limit]):
+                if not np.isfinite(score) or (th is not None and score < th):
+                    continue
+                got = payloads.get(int(slot))
+                if got is None:   # 快照之后已被删除
+                    continue
+                pid, payload = got
+                hit = {**_project(pid, payload, None), "score": float(score)}
+                if with_vectors:
+                    hit["vector"] = snap.matrix[int(slot)].tolist()
+                hits.append(hit)
+            results.append(hits)
+        return results
+
+    def _keyword_hits(self, query_text: Optional[str], limit: int, with_vectors: bool,
+                      path: str = "") -> List[Dict[str, Any]]:
+        if not query_text:
+            return []
+        if self.lexical is None or not self.lexical.is_built():
+            # 索引不全时查它只会漏结果：退回子串扫描（同 Qdrant 后端）
+            return self._substring_hits(query_text, limit, with_vectors, path)
+        ranked = self.lexical.search(query_text, limit, path)
+        by_id = {r["id"]: r for r in self.get_by_ids([pid for pid, _ in ranked], with_vectors=with_vectors)}
+        return [{**by_id[pid], "score": score} for pid, score in ranked if pid in by_id]
+
+    def _substring_hits(self, query_text: str, limit: int, with_vectors: bool,
+                        path: str = "") -> List[Dict[str, Any]]:
+        sql, args = "SELECT id, payload FROM points", []
+        if path:
+            sql += " WHERE path = ? OR (path >= ? AND path < ?)"
+            args += [path, path + "/", path + "0"]
+        with self._lock:
+            rows = self._db().execute(sql + " ORDER BY slot LIMIT ?", (*args, FALLBACK_SCAN_LIMIT)).fetchall()
+        ids = [pid for pid, p in rows if query_text in (json.loads(p).get("text") or "")][:limit]
+        return [{**r, "score": 0.0} for r in self.get_by_ids(ids, with_vectors=with_vectors)]
+
+    @staticmethod
+    def _keyword_first(hits: List[Dict[str, Any]], query_text: Optional[str]) -> List[Dict[str, Any]]:
+        if query_text:
+            contain, others = [], []
+            for h in hits:
+                (contain if query_text in (h["text"] or "") else others).append(h)
+            hits = contain + others
+        return hits
+
+    @staticmethod
+    def _threshold(score_threshold: Optional[float]) -> Optional[float]:
+        th = SCORE_THRESHOLD if score_threshold is None else score_threshold
+        return None if (th is None or th <= 0) else th
+
+    def search_batch(self, requests: List[Dict[str, Any]], with_vectors: bool = False):
+        """与 qdrant_client.search_batch 相同的请求格式；向量部分一次矩阵乘完成。"""
+        if not requests:
+            return []
+        self.ensure_schema()
+        vec_idx, limits, ths, embs, paths = [], [], [], [], []
+        for i, r in enumerate(requests):
+            mode = r.get("mode") or "vector"
+            if mode not in SEARCH_MODES:
+                raise ValueError(f"不支持的检索模式: {mode}（可选 {' / '.join(SEARCH_MODES)}）")
+            if mode != "keyword":
+                vec_idx.append(i)
+                limits.append(r["top_k"] * max(1, HYBRID_CANDIDATES) if mode == "hybrid" else r["top_k"])
+                ths.append(self._threshold(r.get("score_threshold")))
+                embs.append(r["query_emb"])
+                paths.append(normalize_path(r.get("path")))
+        with metrics.timed("vqa_vector_db_seconds", "numpy_search", backend="numpy", op="search_batch"):
+            vec_hits = dict(zip(vec_idx, self._vector_batch(embs, limits, ths, with_vectors, paths)))
+
+        out = []
+        for i, r in enumerate(requests):
+            mode, text, top_k = r.get("mode") or "vector", r.get("query_text"), r["top_k"]
+            path = normalize_path(r.get("path"))
+            if mode == "keyword":
+                out.append(self._keyword_hits(text, top_k, with_vectors, path))
+            elif mode == "hybrid":
+                n = top_k * max(1, HYBRID_CANDIDATES)
+                kw = self._keyword_hits(text, n, with_vectors, path)
+                out.append(reciprocal_rank_fusion([vec_hits[i], kw], k=RRF_K)[:top_k])
+            else:
+                hits = self._keyword_first(vec_hits[i], text)
+                if not hits and text:
+                    ready = self.lexical is not None and self.lexical.is_built()
+                    metrics.inc("vqa_fallback_total", kind="lexical" if ready else "scan")
+                    hits = self._keyword_hits(text, top_k, with_vectors, path)
+                out.append(hits)
+        return out
+
+    def search(self, query_emb, top_k: int = 15, query_text: Optional[str] = None,
+               score_threshold: Optional[float] = None,
+               oversampling: Optional[float] = None, rescore: Optional[bool] = None,
+               mode: str = "vector", with_vectors: bool = False, path: Optional[str] = None):
+        # oversampling / rescore 只对 Qdrant 量化集合有意义，这里是精确检索（或 IVF），忽略
+        return self.search_batch([{
+            "query_emb": query_emb, "query_text": query_text, "top_k": top_k,
+            "score_threshold": score_threshold, "mode": mode, "path": path,
+        }], with_vectors=with_vectors)[0]
+
+    # -------------------- 词法索引 --------------------
+    def rebuild_lexical(self) -> int:
+        if self.lexical is None:
+            raise ValueError("词法索引未启用（LEXICAL_INDEX=0）")
+        self.lexical.clear()
+        total, cursor = 0, None
+        while True:
+            rows, cursor = self.scroll(limit=1000, cursor=cursor, fields=["text", "filename", "path"])
+            self.lexical.add_many((r["id"], r.get("text", ""), (r.get("meta") or {}).get("filename"),
+                                   (r.get("meta") or {}).get("path")) for r in rows)
+            total += len(rows)
+            if cursor is None:
+                break
+        self.lexical.mark_built()
+        self._gen.bump()
+        return total
+
+    def lexical_stats(self):
+        return self.lexical.stats() if self.lexical is not None else None
+
+
+class AsyncNumpyDB:
+    """NumpyDB 的异步包装：计算在线程池里做，不阻塞事件循环。"""
+
+    def __init__(self, db: NumpyDB):
+        self.db = db
+
+    async def search(self, query_emb, top_k: int = 15, query_text: Optional[str] = None,
+                     score_threshold: Optional[float] = None,
+                     oversampling: Optional[float] = None, rescore: Optional[bool] = None,
+                     mode: str = "vector", with_vectors: bool = False, path: Optional[str] = None):
+        return await asyncio.to_thread(
+            self.db.search, query_emb, top_k, query_text, score_threshold, oversampling, rescore, mode, with_vectors,
+            path,
+        )
+
+    async def search_batch(self, requests: List[Dict[str, Any]], with_vectors: bool = False):
+        return await asyncio.to_thread(self.db.search_batch, requests, with_vectors)
+
+    async def get_by_ids(self, ids: List[str], fields=None):
+        return await asyncio.to_thread(self.db.get_by_ids, ids, fields)
+
+    async def scroll(self, filename=None, limit: int = 200, cursor=None, fields=None):
+        return await asyncio.to_thread(self.db.scroll, filename, limit, cursor, fields)
+
+    async def iter_pages(self, filename=None, fields=None, page_size: int = 1000):
+        cursor = None
+        while True:
+            rows, cursor = await self.scroll(filename, page_size, cursor, fields)
+            yield rows
+            if cursor is None:
+                break
+
+    def generation(self) -> str:
+        return self.db.generation()
+
+    async def close(self):
+        pass
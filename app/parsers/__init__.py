@@ -0,0 +1,48 @@
+# app/parsers/__init__.py
+"""
+文件解析器注册表：扩展名 → "模块:函数"，模块在第一次处理该扩展名时才导入。
+只做检索的 API worker 因此不会加载 pandas / PyMuPDF / python-docx / openpyxl；
+PRELOAD 模式下由 preload() 在 gunicorn 主进程里提前全部导入，fork 出的 worker 共享这些只读页面。
+
+解析函数签名统一为 (file_path, ext, max_chars, overlap_ratio, rows_per_chunk) -> Iterable[dict]，
+分块格式与 app.file_loader.iter_chunks 相同。
+"""
+import importlib
+from typing import Callable, Dict, Iterable, List
+
+Parser = Callable[[str, str, int, float, int], Iterable[dict]]
+
+PARSERS: Dict[str, str] = {
+    "pdf": "app.parsers.pdf:pdf_chunks",
+    "xlsx": "app.parsers.table:excel_chunks",
+    "xls": "app.parsers.table:excel_chunks",
+    "csv": "app.parsers.table:csv_chunks",
+    "tsv": "app.parsers.table:csv_chunks",
+    "docx": "app.parsers.word:docx_chunks",
+    "txt": "app.parsers.text:plain_chunks",
+    "md": "app.parsers.text:plain_chunks",
+    "jsonl": "app.parsers.text:jsonl_chunks",
+    "json": "app.parsers.text:json_chunks",
+    **{ext: "app.parsers.text:image_chunks" for ext in ("jpg", "jpeg", "png", "bmp", "gif", "webp")},
+}
+
+_loaded: Dict[str, Parser] = {}
+
+
+def get_parser(ext: str) -> Parser:
+    fn = _loaded.get(ext)
+    if fn is None:
+        target = PARSERS.get(ext)
+        if target is None:
+            raise ValueError(f"不支持的文件类型: {ext}")
+        module, name = target.split(":")
+        fn = _loaded[ext] = getattr(importlib.import_module(module), name)
+    return fn
+
+
+def preload() -> List[str]:
+    """导入全部解析器模块（连同 pandas / fitz 等依赖），返回已导入的模块名。"""
+    modules = sorted({t.split(":")[0] for t in PARSERS.values()})
+    for ext in PARSERS:
+        get_parser(ext)
+    return modules
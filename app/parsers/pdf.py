@@ -0,0 +1,63 @@
+# app/parsers/pdf.py
+"""PDF：按页提取（页数多时进程池并行），流式切片。"""
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Tuple
+
+import fitz  # PyMuPDF
+
+from app.config import PDF_WORKERS, PDF_PAGES_PER_TASK, PDF_PARALLEL_MIN_PAGES
+from app.file_loader import make_base_meta, stream_overlap_chunks
+
+
+def _extract_pdf_pages(file_path: str, start: int, end: int):
+    """进程池任务：每个 worker 自己打开文档，返回 [start, end) 页的 (页码, 文本)。"""
+    doc = fitz.open(file_path)
+    try:
+        return [(i + 1, doc[i].get_text()) for i in range(start, end)]
+    finally:
+        doc.close()
+
+
+def iter_pdf_pages(
+    file_path: str,
+    workers: int = PDF_WORKERS,
+    pages_per_task: int = PDF_PAGES_PER_TASK,
+    parallel_min_pages: int = PDF_PARALLEL_MIN_PAGES,
+) -> Iterator[Tuple[int, str]]:
+    """
+    按页序产出 (页码, 文本)。页数较多时按页段分给进程池并行提取，
+    最多 2×workers 个页段在途，按完成顺序依次产出，内存占用与总页数无关。
+    """
+    doc = fitz.open(file_path)
+    n = doc.page_count
+    if workers <= 1 or n < max(parallel_min_pages, 2 * pages_per_task):
+        try:
+            for i in range(n):
+                yield i + 1, doc[i].get_text()
+        finally:
+            doc.close()
+        return
+    doc.close()
+
+    ranges = iter([(s, min(s + pages_per_task, n)) for s in range(0, n, pages_per_task)])
+    # spawn：调用方可能在多线程环境（后台入库线程池），fork 不安全
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+        inflight = deque()
+        for r in ranges:
+            inflight.append(ex.submit(_extract_pdf_pages, file_path, *r))
+            if len(inflight) >= 2 * workers:
+                break
+        while inflight:
+            pages = inflight.popleft().result()
+            nxt = next(ranges, None)
+            if nxt is not None:
+                inflight.append(ex.submit(_extract_pdf_pages, file_path, *nxt))
+            yield from pages
+
+
+def pdf_chunks(file_path: str, ext: str, max_chars: int, overlap_ratio: float, rows_per_chunk: int):
+    base_meta = make_base_meta(file_path, "pdf")
+    return stream_overlap_chunks(iter_pdf_pages(file_path), max_chars, overlap_ratio, base_meta)
@@ -0,0 +1,59 @@
+# app/parsers/table.py
+"""CSV / TSV / Excel：流式读取行，交给 table_chunks 打包。"""
+from typing import Iterator, Sequence
+
+import openpyxl
+import pandas as pd
+
+from app.config import CSV_READ_CHUNKSIZE
+from app.file_loader import make_base_meta, table_chunks
+
+
+def _cell(v) -> str:
+    return "" if v is None else str(v)
+
+
+def iter_csv_rows(file_path: str, sep: str, chunksize: int = CSV_READ_CHUNKSIZE) -> Iterator[Sequence[str]]:
+    """按块流式读取 CSV/TSV：第一条产出表头，其后逐行产出；全部按字符串读取，空值为 ""。"""
+    header_sent = False
+    with pd.read_csv(
+        file_path, sep=sep, encoding="utf-8-sig", dtype=str,
+        keep_default_na=False, chunksize=max(1, chunksize),
+    ) as reader:
+        for df in reader:
+            if not header_sent:
+                yield [str(c) for c in df.columns]
+                header_sent = True
+            yield from df.itertuples(index=False, name=None)
+
+
+def iter_excel_rows(file_path: str) -> Iterator[Sequence[str]]:
+    """读取第一个工作表：第一条产出表头，其后逐行产出。xlsx 用 openpyxl 只读模式流式读取。"""
+    if file_path.lower().endswith(".xls"):
+        # 旧格式 openpyxl 不支持，退回 pandas 整表读取（xls 本身最多 65536 行）
+        df = pd.read_excel(file_path, dtype=str, keep_default_na=False)
+        yield [str(c) for c in df.columns]
+        yield from df.itertuples(index=False, name=None)
+        return
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        yield [_cell(v) for v in header]
+        for row in rows:
+            yield tuple(_cell(v) for v in row)
+    finally:
+        wb.close()
+
+
+def excel_chunks(file_path: str, ext: str, max_chars: int, overlap_ratio: float, rows_per_chunk: int):
+    base_meta = make_base_meta(file_path, "excel")
+    return table_chunks(iter_excel_rows(file_path), ",", base_meta, max_chars, rows_per_chunk)
+
+
+def csv_chunks(file_path: str, ext: str, max_chars: int, overlap_ratio: float, rows_per_chunk: int):
+    sep = "\t" if ext == "tsv" else ","
+    base_meta = make_base_meta(file_path, ext)
+    return table_chunks(iter_csv_rows(file_path, sep), sep, base_meta, max_chars, rows_per_chunk)
@@ -0,0 +1,76 @@
+# app/parsers/text.py
+"""纯文本 / Markdown / JSON / JSON Lines / 图片占位：只依赖标准库。"""
+import os
+import json
+
+from app.file_loader import make_base_meta, normalize_text, overlap_chunks
+
+
+def plain_chunks(file_path: str, ext: str, max_chars: int, overlap_ratio: float, rows_per_chunk: int):
+    base_meta = make_base_meta(file_path, ext)
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+        content = f.read()
+    return overlap_chunks(content, max_chars, overlap_ratio, base_meta)
+
+
+def jsonl_chunks(file_path: str, ext: str, max_chars: int, overlap_ratio: float, rows_per_chunk: int):
+    base_meta = make_base_meta(file_path, "jsonl")
+    outs = []
+    with open(file_path, "r", encoding="utf-8") as f:
+        for idx, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            outs.append(
+                {
+                    "text": normalize_text(line),
+                    "meta": {**base_meta, "json_path": f"line:{idx}"},
+                }
+            )
+    return outs
+
+
+def json_chunks(file_path: str, ext: str, max_chars: int, overlap_ratio: float, rows_per_chunk: int):
+    base_meta = make_base_meta(file_path, "json")
+    with open(file_path, "r", encoding="utf-8") as f:
+        try:
+            content = json.load(f)
+        except Exception:
+            # 解析失败：按行拼回文本分块
+            f.seek(0)
+            raw = f.read()
+            lines = raw.splitlines()
+            text = "\n".join(line for line in lines if line.strip())
+            return overlap_chunks(text, max_chars, overlap_ratio, base_meta)
+
+    if isinstance(content, list):
+        outs = []
+        for i, item in enumerate(content):
+            s = json.dumps(item, ensure_ascii=False)
+            for ch in overlap_chunks(s, max_chars, overlap_ratio, base_meta):
+                ch["meta"]["json_path"] = f"[{i}]"
+                outs.append(ch)
+        return outs
+
+    elif isinstance(content, dict):
+        outs = []
+        for k, v in content.items():
+            s = f"{k}: {json.dumps(v, ensure_ascii=False)}"
+            for ch in overlap_chunks(s, max_chars, overlap_ratio, base_meta):
+                ch["meta"]["json_path"] = f".{k}"
+                outs.append(ch)
+        return outs
+
+    else:
+        txt = json.dumps(content, ensure_ascii=False)
+        return overlap_chunks(txt, max_chars, overlap_ratio, base_meta)
+
+
+def image_chunks(file_path: str, ext: str, max_chars: int, overlap_ratio: float, rows_per_chunk: int):
+    base_meta = make_base_meta(file_path, "image")
+    return [
+        {
+            "text": normalize_text(f"图片文件: {os.path.basename(file_path)}"),
+            "meta": dict(base_meta),
+        }
+    ]
@@ -0,0 +1,12 @@
+# app/parsers/word.py
+"""Word（.docx）：段落按行拼接全文后按整行打包切片。"""
+import docx
+
+from app.file_loader import make_base_meta, overlap_chunks
+
+
+def docx_chunks(file_path: str, ext: str, max_chars: int, overlap_ratio: float, rows_per_chunk: int):
+    base_meta = make_base_meta(file_path, "docx")
+    doc = docx.Document(file_path)
+    text = "\n".join(p.text for p in doc.paragraphs)
+    return overlap_chunks(text, max_chars, overlap_ratio, base_meta)
@@ -1,40 +1,311 @@
 # app/qdrant_client.py
 import os
+import json
+import time
 import uuid
+import asyncio
 import logging
-from typing import Optional, List, Dict, Any
+import threading
+from typing import Optional, List, Dict, Any, Iterator, AsyncIterator, Sequence, Tuple
 
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import VectorParams, Distance, PointStruct
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.http.models import (
+    VectorParams, Distance, PointStruct, PayloadSchemaType, Filter, FieldCondition, MatchValue,
+    HnswConfigDiff, SearchParams, QueryRequest, PayloadSelectorExclude, VectorParamsDiff, QuantizationSearchParams, Disabled,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    BinaryQuantization, BinaryQuantizationConfig, IsEmptyCondition, PayloadField,
+    OverwritePayloadOperation, SetPayload,
+)
 
-from .config import QDRANT_URL, QDRANT_COLLECTION, EMBEDDING_DIM
+from .config import (
+    QDRANT_URL, QDRANT_COLLECTION, EMBEDDING_DIM, UPSERT_BATCH_SIZE, CACHE_DIR,
+    HNSW_M, HNSW_EF_CONSTRUCT, HNSW_EF, PAYLOAD_INDEX_FIELDS,
+    QUANTIZATION, QUANTIZATION_QUANTILE, VECTORS_ON_DISK, SEARCH_OVERSAMPLING, SEARCH_RESCORE,
+    LEXICAL_INDEX, LEXICAL_INDEX_PATH, FALLBACK_SCAN_LIMIT, HYBRID_CANDIDATES, RRF_K, SCORE_THRESHOLD,
+)
+from . import metrics
+from .cache import Generation, default_cache_dir
+from .lexical import LexicalIndex, reciprocal_rank_fusion
+from .sharding import normalize_path
+from .vector_db import SEARCH_MODES, InvalidCursor, SchemaError
 
 logger = logging.getLogger("qdrant-db")
 
 # 可通过环境变量控制阈值与回退行为
-SCORE_THRESHOLD = float(os.getenv("SCORE_THRESHOLD", "0"))          # <=0 表示不设阈值
 ENABLE_TEXT_FALLBACK = os.getenv("ENABLE_TEXT_FALLBACK", "1") != "0"
-FALLBACK_SCAN_LIMIT = int(os.getenv("FALLBACK_SCAN_LIMIT", "2000"))  # 回退时最多扫描这么多点
 
-client = QdrantClient(QDRANT_URL)
+class _LazyClient:
+    """
+    第一次调用时才创建 QdrantClient（建连），worker 启动 / PRELOAD 主进程里不连 Qdrant；
+    fork 出的子进程按 pid 重新创建，不复用父进程的连接。
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._pid = None
+
+    def __getattr__(self, name: str):
+        if self._client is None or self._pid != os.getpid():
+            self._client, self._pid = self._factory(), os.getpid()
+        return getattr(self._client, name)
+
+# 每次调用按操作名计入 vqa_vector_db_seconds，并记为 Server-Timing 的 qdrant_<op>
+client = metrics.instrument(_LazyClient(lambda: QdrantClient(QDRANT_URL)), backend="qdrant")
+
+# 异步客户端按需创建（需在事件循环内使用）；
+# QDRANT_URL 为本地模式（":memory:" 或目录）时无法与同步客户端共享数据，改为线程池包装同步客户端
+_aclient: Optional[AsyncQdrantClient] = None
+QDRANT_IS_REMOTE = QDRANT_URL.startswith(("http://", "https://"))
+
+# 集合代数：每次写入/删除后 bump，用于让 /search 结果缓存失效（跨 worker / 跨进程共享）；
+# 同一个 QDRANT_COLLECTION 下的分片集合（SHARD_MODE=collection）共用这一个代数
+generation = Generation(os.path.join(CACHE_DIR or default_cache_dir(), f"generation.{QDRANT_COLLECTION}"))
+
+# 下面的函数都带 collection 参数（默认 QDRANT_COLLECTION），分片集合与主集合走同一套逻辑
+
+# 词法索引：随写入 / 删除同步维护，供关键字检索与混合检索使用；每个集合一个文件，主集合用 LEXICAL_INDEX_PATH
+_lexical_indexes: Dict[str, LexicalIndex] = {}
+_lexical_lock = threading.Lock()
+
+def _lexical(collection: str) -> Optional[LexicalIndex]:
+    if not LEXICAL_INDEX:
+        return None
+    with _lexical_lock:
+        idx = _lexical_indexes.get(collection)
+        if idx is None:
+            path = LEXICAL_INDEX_PATH if collection == QDRANT_COLLECTION else os.path.join(
+                os.path.dirname(LEXICAL_INDEX_PATH) or ".", f"lexical.{collection}.sqlite3")
+            idx = _lexical_indexes[collection] = LexicalIndex(path)
+        return idx
+
+lexical: Optional[LexicalIndex] = _lexical(QDRANT_COLLECTION)
+
+# 文件清单：每个文件一个点（无向量），存段数、类型、大小、入库时间、内容 hash
+MANIFEST_SUFFIX = "__files"
+MANIFEST_COLLECTION = f"{QDRANT_COLLECTION}{MANIFEST_SUFFIX}"
+MANIFEST_NAMESPACE = uuid.UUID("0b7c4f3e-5a61-4e29-b8d2-3c9e1f6a7d45")
+
+def _manifest(collection: str) -> str:
+    return f"{collection}{MANIFEST_SUFFIX}"
+
+def _filename_filter(filename: str) -> Filter:
+    return Filter(must=[FieldCondition(key="filename", match=MatchValue(value=filename))])
 
-def init_collection():
-    collections = [c.name for c in client.get_collections().collections]
-    if QDRANT_COLLECTION not in collections:
-        client.create_collection(
-            collection_name=QDRANT_COLLECTION,
-            vectors_config=VectorParams(size=EMBEDDING_DIM, distance=Distance.COSINE)
+def _path_filter(path: Optional[str]) -> Optional[Filter]:
+    # path_scope 为分块路径的各级前缀（见 app.sharding.path_scope），命中任一即在该路径下
+    path = normalize_path(path)
+    return Filter(must=[FieldCondition(key="path_scope", match=MatchValue(value=path))]) if path else None
+
+def list_collections() -> List[str]:
+    """全部数据集合名（不含文件清单集合）。"""
+    names = [c.name for c in client.get_collections().collections]
+    return [n for n in names if not n.endswith(MANIFEST_SUFFIX)]
+
+# -------------------- 集合 schema --------------------
+# 按集合记录：已就绪的集合、维度不一致的错误、schema 信息
+_schema_lock = threading.Lock()
+_schema_ready: set = set()
+_schema_error: Dict[str, SchemaError] = {}
+_schema_info: Dict[str, Dict[str, Any]] = {}
+
+def _hnsw_diff() -> Optional[HnswConfigDiff]:
+    if HNSW_M is None and HNSW_EF_CONSTRUCT is None:
+        return None
+    return HnswConfigDiff(m=HNSW_M, ef_construct=HNSW_EF_CONSTRUCT)
+
+def _quantization_config():
+    """按 QUANTIZATION 生成量化配置；留空返回 None（不改动），none 返回 Disabled（关闭）。"""
+    if QUANTIZATION == "int8":
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(
+            type=ScalarType.INT8, quantile=QUANTIZATION_QUANTILE, always_ram=True))
+    if QUANTIZATION == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    if QUANTIZATION == "none":
+        return Disabled.DISABLED
+    if QUANTIZATION:
+        raise ValueError(f"不支持的 QUANTIZATION: {QUANTIZATION}")
+    return None
+
+def _quantization_kind(config) -> str:
+    if isinstance(config, ScalarQuantization):
+        return "int8"
+    if isinstance(config, BinaryQuantization):
+        return "binary"
+    return "none"
+
+def _search_params(oversampling: Optional[float] = None, rescore: Optional[bool] = None,
+                   collection: str = QDRANT_COLLECTION) -> Optional[SearchParams]:
+    """
+    查询参数：hnsw_ef 来自配置；集合启用了量化（或请求显式指定）时带上 oversampling / rescore。
+    """
+    quantized = _schema_info.get(collection, {}).get("quantization", "none") != "none"
+    quant = None
+    if quantized or oversampling is not None or rescore is not None:
+        quant = QuantizationSearchParams(
+            rescore=SEARCH_RESCORE if rescore is None else rescore,
+            oversampling=SEARCH_OVERSAMPLING if oversampling is None else oversampling,
         )
-        logger.info("Created collection %s (dim=%d)", QDRANT_COLLECTION, EMBEDDING_DIM)
+    if not HNSW_EF and quant is None:
+        return None
+    return SearchParams(hnsw_ef=HNSW_EF, quantization=quant)
+
+def ensure_schema(force: bool = False, collection: str = QDRANT_COLLECTION):
+    """
+    确保集合存在且与配置一致：维度校验、payload 索引、HNSW 参数、文件清单集合。
+    每个进程每个集合只检查一次并缓存结果；维度不一致时缓存 SchemaError，之后直接抛出，不再请求 Qdrant。
+    连接失败等其他异常不缓存，下次调用会重试。
+    """
+    if not force:
+        if collection in _schema_ready:
+            return
+        if collection in _schema_error:
+            raise _schema_error[collection]
+    with _schema_lock:
+        if collection in _schema_ready and not force:
+            return
+        if not client.collection_exists(collection):
+            quant = _quantization_config()
+            client.create_collection(
+                collection_name=collection,
+                vectors_config=VectorParams(size=EMBEDDING_DIM, distance=Distance.COSINE, on_disk=VECTORS_ON_DISK),
+                hnsw_config=_hnsw_diff(),
+                quantization_config=None if quant is Disabled.DISABLED else quant,
+            )
+            logger.info("Created collection %s (dim=%d)", collection, EMBEDDING_DIM)
+        info = client.get_collection(collection)
+        status = _schema_info.setdefault(collection, {})
+
+        vectors = info.config.params.vectors
+        size = getattr(vectors, "size", None)
+        if size != EMBEDDING_DIM:
+            _schema_ready.discard(collection)
+            err = _schema_error[collection] = SchemaError(
+                f"集合 {collection} 的向量维度为 {size}，与 EMBEDDING_DIM={EMBEDDING_DIM} 不一致；"
+                f"请修改 EMBEDDING_DIM / EMBEDDING_MODEL，或换一个 QDRANT_COLLECTION"
+            )
+            status.update(collection=collection, vector_size=size, error=str(err))
+            logger.error("%s", err)
+            raise err
+
+        # payload keyword 索引：按文件删除 / 计数 / 按路径过滤走索引
+        existing = set((info.payload_schema or {}).keys())
+        for field in PAYLOAD_INDEX_FIELDS:
+            if field not in existing:
+                client.create_payload_index(collection, field, PayloadSchemaType.KEYWORD)
+                logger.info("Created payload index %s.%s", collection, field)
 
-def add_texts(texts: List[str], embeddings: List[List[float]], payloads: Optional[List[Dict[str, Any]]] = None):
-    init_collection()
+        # HNSW 参数与配置不一致时更新（Qdrant 会在后台重建索引）
+        diff = _hnsw_diff()
+        hnsw = info.config.hnsw_config
+        if diff is not None and (
+            (HNSW_M is not None and hnsw.m != HNSW_M)
+            or (HNSW_EF_CONSTRUCT is not None and hnsw.ef_construct != HNSW_EF_CONSTRUCT)
+        ):
+            client.update_collection(collection, hnsw_config=diff)
+            logger.info("Updated HNSW config of %s: m=%s ef_construct=%s", collection, HNSW_M, HNSW_EF_CONSTRUCT)
+
+        # 量化 / 原始向量是否放磁盘：与配置不一致时更新（Qdrant 后台重建量化数据，期间检索不受影响）
+        quant = _quantization_config()
+        current = _quantization_kind(info.config.quantization_config)
+        on_disk = bool(getattr(vectors, "on_disk", False))
+        if quant is not None and current != _quantization_kind(quant):
+            client.update_collection(collection, quantization_config=quant)
+            logger.info("Updated quantization of %s: %s -> %s", collection, current, QUANTIZATION)
+            current = _quantization_kind(quant)
+        if on_disk != VECTORS_ON_DISK and (QUANTIZATION or "VECTORS_ON_DISK" in os.environ):
+            client.update_collection(collection, vectors_config={"": VectorParamsDiff(on_disk=VECTORS_ON_DISK)})
+            logger.info("Updated on_disk of %s: %s -> %s", collection, on_disk, VECTORS_ON_DISK)
+            on_disk = VECTORS_ON_DISK
+
+        migrated = migrate_nested_meta(collection=collection)
+        if not client.collection_exists(_manifest(collection)):
+            client.create_collection(collection_name=_manifest(collection), vectors_config={})
+            logger.info("Created manifest collection %s", _manifest(collection))
+            rebuild_manifest(collection=collection)
+        elif migrated:
+            rebuild_manifest(collection=collection)
+
+        # 词法索引：空集合直接视为已建好；已有数据需要 `python -m app.lexical rebuild` 迁移
+        lex = _lexical(collection)
+        if lex is not None and not lex.is_built():
+            if client.count(collection, exact=False).count == 0:
+                lex.mark_built()
+            else:
+                logger.warning("Lexical index not built for %s; run `python -m app.lexical rebuild`", collection)
+
+        status.update(
+            collection=collection, vector_size=size, error=None,
+            payload_indexes=sorted(existing | set(PAYLOAD_INDEX_FIELDS)),
+            hnsw_m=HNSW_M or hnsw.m, hnsw_ef_construct=HNSW_EF_CONSTRUCT or hnsw.ef_construct, hnsw_ef=HNSW_EF,
+            quantization=current, vectors_on_disk=on_disk,
+            oversampling=SEARCH_OVERSAMPLING, rescore=SEARCH_RESCORE,
+        )
+        _schema_error.pop(collection, None)
+        _schema_ready.add(collection)
+
+def init_collection(collection: str = QDRANT_COLLECTION):
+    # 兼容旧调用：等价于 ensure_schema()，就绪后不再有额外往返
+    ensure_schema(collection=collection)
+
+def schema_status(collection: str = QDRANT_COLLECTION) -> Dict[str, Any]:
+    return {"ready": collection in _schema_ready, "backend": "qdrant", **_schema_info.get(collection, {})}
+
+def add_texts(texts: List[str], embeddings: List[List[float]], payloads: Optional[List[Dict[str, Any]]] = None,
+              batch_size: int = UPSERT_BATCH_SIZE, ids: Optional[List[str]] = None,
+              collection: str = QDRANT_COLLECTION):
+    """
+    批量写入：每 batch_size 个点一次 upsert，避免逐点往返。
+    ids 不传时随机生成；传入确定性 id 时重复写入同一分块是覆盖而不是追加。
+    """
+    init_collection(collection)
+    batch_size = max(1, batch_size)
     points = []
-    for i, (text, emb) in enumerate(zip(texts, embeddings)):
-        payload = (payloads[i] if payloads else {}) or {}
-        payload["text"] = text
-        points.append(PointStruct(id=str(uuid.uuid4()), vector=emb, payload=payload))
-    client.upsert(collection_name=QDRANT_COLLECTION, points=points)
+    # 中途某批失败时前面的批次已经写入，同样要让结果缓存失效
+    try:
+        for i, (text, emb) in enumerate(zip(texts, embeddings)):
+            payload = (payloads[i] if payloads else {}) or {}
+            payload["text"] = text
+            pid = ids[i] if ids else str(uuid.uuid4())
+            points.append(PointStruct(id=pid, vector=emb, payload=payload))
+            if len(points) >= batch_size:
+                _upsert(points, collection)
+                points = []
+        if points:
+            _upsert(points, collection)
+    finally:
+        generation.bump()
+
+def update_payloads(ids: List[str], texts: List[str], payloads: List[Dict[str, Any]],
+                    batch_size: int = UPSERT_BATCH_SIZE, collection: str = QDRANT_COLLECTION):
+    """
+    覆盖已有点的 payload，向量不动：分块原文没变（id 相同）、只有页码 / 行号等元信息变化时用。
+    原文、filename、path 都不变，词法索引无需更新。
+    """
+    if not ids:
+        return
+    init_collection(collection)
+    batch_size = max(1, batch_size)
+    try:
+        for i in range(0, len(ids), batch_size):
+            client.batch_update_points(collection, update_operations=[
+                OverwritePayloadOperation(overwrite_payload=SetPayload(payload={**(payloads[j] or {}), "text": texts[j]},
+                                                                       points=[ids[j]]))
+                for j in range(i, min(len(ids), i + batch_size))
+            ])
+    finally:
+        generation.bump()
+
+def _upsert(points: List[PointStruct], collection: str = QDRANT_COLLECTION):
+    client.upsert(collection_name=collection, points=points)
+    lex = _lexical(collection)
+    if lex is not None:
+        # 词法索引写失败不影响向量入库，可用 rebuild 补齐
+        try:
+            lex.add_many((p.id, p.payload.get("text", ""), p.payload.get("filename"), p.payload.get("path"))
+                         for p in points)
+        except Exception:
+            logger.exception("Lexical index update failed (%d points)", len(points))
 
 def _normalize_hits(scored_points):
     out = []
@@ -46,25 +317,18 @@ def _normalize_hits(scored_points):
             "score": r.score,
             "meta": {k: v for k, v in payload.items() if k != "text"},
         })
+        if getattr(r, "vector", None) is not None:
+            out[-1]["vector"] = r.vector
     return out
 
-def text_fallback(query_text: str, top_k: int = 10) -> List[Dict[str, Any]]:
-    """
-    纯文本兜底：scroll 扫描部分点，返回包含关键字的前 top_k 条。
-    """
-    if not query_text:
-        return []
-    pts, _ = client.scroll(
-        collection_name=QDRANT_COLLECTION,
-        with_payload=True,
-        limit=FALLBACK_SCAN_LIMIT
-    )
+def _substring_rows(points, query_text: str, top_k: int) -> List[Dict[str, Any]]:
     rows: List[Dict[str, Any]] = []
-    for p in pts:
+    for p in points:
         payload = p.payload or {}
         t = (payload.get("text") or "")
         if t and (query_text in t):
             rows.append({
+                "id": str(getattr(p, "id", "")),
                 "text": t,
                 "meta": {k: v for k, v in payload.items() if k != "text"},
                 "score": 0.0
@@ -73,86 +337,453 @@ def text_fallback(query_text: str, top_k: int = 10) -> List[Dict[str, Any]]:
                 break
     return rows
 
-def search(query_emb: List[float], top_k: int = 15, query_text: Optional[str] = None,
-           score_threshold: Optional[float] = None) -> List[Dict[str, Any]]:
+def _lexical_ready(collection: str = QDRANT_COLLECTION) -> bool:
+    lex = _lexical(collection)
+    return lex is not None and lex.is_built()
+
+def _rank_rows(ranked, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # 按词法索引的名次排回原顺序，带上 BM25 分；Qdrant 中已不存在的 id 丢弃
+    by_id = {r["id"]: r for r in rows}
+    return [{**by_id[pid], "score": score} for pid, score in ranked if pid in by_id]
+
+def keyword_search(query_text: str, top_k: int = 10, with_vectors: bool = False,
+                   path: Optional[str] = None, collection: str = QDRANT_COLLECTION) -> List[Dict[str, Any]]:
     """
-    向量检索 + 关键字优先排序 + 纯文本兜底
+    关键字检索：词法索引 BM25 取 id，再从 Qdrant 取原文；
+    未启用词法索引、或已有数据的集合还没 rebuild 时退回子串扫描（索引不全，查它只会漏结果）。
     """
-    init_collection()
-    th = SCORE_THRESHOLD if score_threshold is None else score_threshold
-    th = None if (th is None or th <= 0) else th
+    if not query_text:
+        return []
+    if not _lexical_ready(collection):
+        return _substring_scan(query_text, top_k, path, collection)
+    lex = _lexical(collection)
+    ranked = lex.search(query_text, top_k, normalize_path(path))
+    return _rank_rows(ranked, get_by_ids([pid for pid, _ in ranked], with_vectors, collection=collection))
 
-    logger.info("Qdrant.search top_k=%d, threshold=%s, query_text=%r", top_k, th, (query_text or "")[:50])
+def text_fallback(query_text: str, top_k: int = 10, path: Optional[str] = None,
+                  collection: str = QDRANT_COLLECTION) -> List[Dict[str, Any]]:
+    """
+    纯文本兜底：词法索引已建好时走 BM25，否则 scroll 扫描部分点，返回包含关键字的前 top_k 条。
+    """
+    if not query_text:
+        return []
+    if _lexical_ready(collection):
+        metrics.inc("vqa_fallback_total", kind="lexical")
+        return keyword_search(query_text, top_k, path=path, collection=collection)
+    metrics.inc("vqa_fallback_total", kind="scan")
+    return _substring_scan(query_text, top_k, path, collection)
 
-    result = client.search(
-        collection_name=QDRANT_COLLECTION,
-        query_vector=query_emb,
-        limit=top_k,
+def _substring_scan(query_text: str, top_k: int, path: Optional[str] = None,
+                    collection: str = QDRANT_COLLECTION) -> List[Dict[str, Any]]:
+    pts, _ = client.scroll(
+        collection_name=collection,
+        scroll_filter=_path_filter(path),
         with_payload=True,
-        score_threshold=th  # None => 不设阈值
+        limit=FALLBACK_SCAN_LIMIT
     )
-    hits = _normalize_hits(result)
+    return _substring_rows(pts, query_text, top_k)
+
+def _resolve_threshold(score_threshold: Optional[float]) -> Optional[float]:
+    th = SCORE_THRESHOLD if score_threshold is None else score_threshold
+    return None if (th is None or th <= 0) else th
 
-    # 关键字优先（包含 query_text 的先排前）
+def _keyword_first(hits: List[Dict[str, Any]], query_text: Optional[str]) -> List[Dict[str, Any]]:
+    # 关键字优先（包含 query_text 的先排前），一次遍历稳定分区
     if query_text:
-        contain = [h for h in hits if query_text in (h["text"] or "")]
-        others = [h for h in hits if h not in contain]
+        contain, others = [], []
+        for h in hits:
+            (contain if query_text in (h["text"] or "") else others).append(h)
         hits = contain + others
+    return hits
+
+def _check_mode(mode: str) -> str:
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"不支持的检索模式: {mode}（可选 {' / '.join(SEARCH_MODES)}）")
+    return mode
+
+def _vector_hits(query_emb: List[float], limit: int, th: Optional[float],
+                 oversampling: Optional[float], rescore: Optional[bool],
+                 with_vectors: bool = False, path: Optional[str] = None,
+                 collection: str = QDRANT_COLLECTION) -> List[Dict[str, Any]]:
+    result = client.query_points(
+        collection_name=collection,
+        query=query_emb,
+        query_filter=_path_filter(path),   # 路径预过滤（path_scope 有 keyword 索引）
+        limit=limit,
+        with_payload=True,
+        with_vectors=with_vectors,
+        score_threshold=th,  # None => 不设阈值
+        search_params=_search_params(oversampling, rescore, collection),
+    ).points
+    return _normalize_hits(result)
+
+def search(query_emb: List[float], top_k: int = 15, query_text: Optional[str] = None,
+           score_threshold: Optional[float] = None,
+           oversampling: Optional[float] = None, rescore: Optional[bool] = None,
+           mode: str = "vector", with_vectors: bool = False, path: Optional[str] = None,
+           collection: str = QDRANT_COLLECTION) -> List[Dict[str, Any]]:
+    """
+    向量检索 + 关键字优先排序 + 纯文本兜底
+    oversampling / rescore 仅在量化集合上生效，None 表示用配置默认值。
+    mode = hybrid 时向量与关键字各取 top_k * HYBRID_CANDIDATES 条候选，按 RRF 融合（score 为融合分）；
+    mode = keyword 时只走词法索引（score 为 BM25 分）。
+    with_vectors=True 时结果带 "vector"，供 MMR 等后处理使用。
+    path 非空时只检索该路径及其子路径下的分块（向量、关键字、兜底三路都生效）。
+    """
+    _check_mode(mode)
+    init_collection(collection)
+    th = _resolve_threshold(score_threshold)
+
+    logger.info("Qdrant.search collection=%s mode=%s top_k=%d, threshold=%s, path=%r, query_text=%r",
+                collection, mode, top_k, th, path or "", (query_text or "")[:50])
+
+    if mode == "keyword":
+        return keyword_search(query_text, top_k, with_vectors, path, collection)
+    if mode == "hybrid":
+        n = top_k * max(1, HYBRID_CANDIDATES)
+        vec = _vector_hits(query_emb, n, th, oversampling, rescore, with_vectors, path, collection)
+        kw = keyword_search(query_text, n, with_vectors, path, collection)
+        return reciprocal_rank_fusion([vec, kw], k=RRF_K)[:top_k]
+
+    hits = _keyword_first(_vector_hits(query_emb, top_k, th, oversampling, rescore, with_vectors, path, collection),
+                          query_text)
 
     # 纯文本回退，避免返回 []
     if not hits and ENABLE_TEXT_FALLBACK and query_text:
-        logger.info("Qdrant.search got 0 hits; fallback to substring scan...")
-        hits = text_fallback(query_text, top_k=top_k)
+        logger.info("Qdrant.search got 0 hits; fallback to keyword search...")
+        hits = text_fallback(query_text, top_k=top_k, path=path, collection=collection)
 
     return hits
 
-def delete_by_filename(filename: str):
-    init_collection()
-    from qdrant_client.http.models import Filter, FieldCondition, MatchValue
-    client.delete(
-        collection_name=QDRANT_COLLECTION,
-        points_selector=Filter(
-            must=[FieldCondition(key="filename", match=MatchValue(value=filename))]
+# -------------------- 批量检索 --------------------
+# 每个请求为 dict：query_emb / query_text / top_k / score_threshold / oversampling / rescore / mode / path
+def _batch_plan(requests: List[Dict[str, Any]], with_vectors: bool, collection: str = QDRANT_COLLECTION):
+    vec_reqs, kw_reqs = [], []
+    for i, r in enumerate(requests):
+        mode = _check_mode(r.get("mode") or "vector")
+        n = r["top_k"] * max(1, HYBRID_CANDIDATES) if mode == "hybrid" else r["top_k"]
+        if mode != "keyword":
+            vec_reqs.append((i, QueryRequest(
+                query=r["query_emb"],
+                filter=_path_filter(r.get("path")),
+                limit=n,
+                with_payload=True,
+                with_vector=with_vectors,
+                score_threshold=_resolve_threshold(r.get("score_threshold")),
+                params=_search_params(r.get("oversampling"), r.get("rescore"), collection),
+            )))
+        if mode != "vector" and r.get("query_text"):
+            kw_reqs.append((i, r["query_text"], n, normalize_path(r.get("path"))))
+    return vec_reqs, kw_reqs
+
+def _batch_combine(requests, vec_hits: Dict[int, list], kw_hits: Dict[int, list]) -> List[List[Dict[str, Any]]]:
+    out = []
+    for i, r in enumerate(requests):
+        mode = r.get("mode") or "vector"
+        if mode == "keyword":
+            out.append(kw_hits.get(i, [])[: r["top_k"]])
+        elif mode == "hybrid":
+            out.append(reciprocal_rank_fusion([vec_hits.get(i, []), kw_hits.get(i, [])], k=RRF_K)[: r["top_k"]])
+        else:
+            out.append(_keyword_first(vec_hits.get(i, []), r.get("query_text")))
+    return out
+
+def search_batch(requests: List[Dict[str, Any]], with_vectors: bool = False,
+                 collection: str = QDRANT_COLLECTION) -> List[List[Dict[str, Any]]]:
+    """
+    批量检索，返回与 requests 一一对应的结果列表。
+    向量部分合并为一次 query_batch_points；关键字部分先查本地词法索引，再一次 retrieve 取回全部原文。
+    向量模式无命中时按单条 search 的规则做关键字兜底。
+    """
+    if not requests:
+        return []
+    init_collection(collection)
+    vec_reqs, kw_reqs = _batch_plan(requests, with_vectors, collection)
+    logger.info("Qdrant.search_batch collection=%s n=%d vector=%d keyword=%d",
+                collection, len(requests), len(vec_reqs), len(kw_reqs))
+
+    vec_hits: Dict[int, list] = {}
+    if vec_reqs:
+        responses = client.query_batch_points(collection_name=collection, requests=[q for _, q in vec_reqs])
+        vec_hits = {i: _normalize_hits(resp.points) for (i, _), resp in zip(vec_reqs, responses)}
+
+    kw_hits: Dict[int, list] = {}
+    lex = _lexical(collection)
+    if kw_reqs and _lexical_ready(collection):
+        ranked = {i: lex.search(text, n, path) for i, text, n, path in kw_reqs}
+        ids = list(dict.fromkeys(pid for r in ranked.values() for pid, _ in r))
+        rows = get_by_ids(ids, with_vectors, collection=collection)
+        kw_hits = {i: _rank_rows(r, rows) for i, r in ranked.items()}
+    elif kw_reqs:
+        kw_hits = {i: _substring_scan(text, n, path, collection) for i, text, n, path in kw_reqs}
+
+    results = _batch_combine(requests, vec_hits, kw_hits)
+    for r, hits in zip(requests, results):
+        if not hits and (r.get("mode") or "vector") == "vector" and ENABLE_TEXT_FALLBACK and r.get("query_text"):
+            hits.extend(text_fallback(r["query_text"], top_k=r["top_k"], path=r.get("path"), collection=collection))
+    return results
+
+def delete_by_filename(filename: str, collection: str = QDRANT_COLLECTION):
+    init_collection(collection)
+    try:
+        client.delete(
+            collection_name=collection,
+            points_selector=_filename_filter(filename)
         )
-    )
+        lex = _lexical(collection)
+        if lex is not None:
+            lex.delete_filename(filename)
+        delete_manifest(filename, collection)
+    finally:
+        generation.bump()
+
+def delete_points(ids: List[str], batch_size: int = UPSERT_BATCH_SIZE, collection: str = QDRANT_COLLECTION):
+    if not ids:
+        return
+    from qdrant_client.http.models import PointIdsList
+    init_collection(collection)
+    try:
+        for i in range(0, len(ids), batch_size):
+            client.delete(
+                collection_name=collection,
+                points_selector=PointIdsList(points=list(ids[i : i + batch_size]))
+            )
+        lex = _lexical(collection)
+        if lex is not None:
+            lex.delete_ids(ids)
+    finally:
+        generation.bump()
+
+def point_ids_by_filename(filename: str, page_size: int = 1000, collection: str = QDRANT_COLLECTION) -> List[str]:
+    """
+    分页 scroll 取某文件的全部点 id（不带 payload / 向量）。
+    """
+    init_collection(collection)
+    flt = _filename_filter(filename)
+    ids: List[str] = []
+    offset = None
+    while True:
+        pts, offset = client.scroll(
+            collection_name=collection,
+            scroll_filter=flt,
+            limit=page_size,
+            offset=offset,
+            with_payload=False,
+            with_vectors=False,
+        )
+        ids.extend(str(p.id) for p in pts)
+        if offset is None:
+            break
+    return ids
+
+# -------------------- 文件清单 --------------------
+def _manifest_id(filename: str) -> str:
+    return str(uuid.uuid5(MANIFEST_NAMESPACE, filename))
+
+def count_by_filename(filename: str, collection: str = QDRANT_COLLECTION) -> int:
+    return client.count(
+        collection_name=collection, count_filter=_filename_filter(filename), exact=True
+    ).count
 
-def list_files():
-    init_collection()
-    pts, _ = client.scroll(collection_name=QDRANT_COLLECTION, with_payload=True, limit=10000)
+def upsert_manifest(filename: str, collection: str = QDRANT_COLLECTION, **fields: Any):
+    """
+    更新文件清单条目：段数按 filename 索引精确计数，其余字段（content_type / bytes /
+    content_hash 等）由调用方提供；未提供的字段保留旧值。
+    """
+    init_collection(collection)
+    pid = _manifest_id(filename)
+    old = client.retrieve(_manifest(collection), ids=[pid], with_payload=True)
+    payload = dict(old[0].payload or {}) if old else {}
+    payload.update({k: v for k, v in fields.items() if v is not None})
+    payload["filename"] = filename
+    payload["segments"] = count_by_filename(filename, collection)
+    if not payload["segments"]:
+        delete_manifest(filename, collection)
+        return
+    payload.setdefault("ingested_at", time.time())
+    client.upsert(_manifest(collection), points=[PointStruct(id=pid, vector={}, payload=payload)])
+
+def delete_manifest(filename: str, collection: str = QDRANT_COLLECTION):
+    from qdrant_client.http.models import PointIdsList
+    client.delete(_manifest(collection), points_selector=PointIdsList(points=[_manifest_id(filename)]))
+
+def rebuild_manifest(page_size: int = 1000, collection: str = QDRANT_COLLECTION):
+    """
+    从主集合重建文件清单（只取 filename / content_type，不拉文本）。
+    清单集合首次创建时自动执行一次，用于迁移已有数据。
+    """
     from collections import Counter
-    files = [ (p.payload or {}).get("filename", "") for p in pts ]
-    stats = Counter(files)
-    return [{"filename": k, "segments": v} for k, v in stats.items() if k]
+    counts: Counter = Counter()
+    ctypes: Dict[str, Any] = {}
+    paths: Dict[str, str] = {}
+    offset = None
+    while True:
+        pts, offset = client.scroll(
+            collection_name=collection,
+            limit=page_size,
+            offset=offset,
+            with_payload=["filename", "content_type", "path"],
+            with_vectors=False,
+        )
+        for p in pts:
+            pay = p.payload or {}
+            fn = pay.get("filename")
+            if fn:
+                counts[fn] += 1
+                ctypes.setdefault(fn, pay.get("content_type"))
+                paths.setdefault(fn, pay.get("path") or "")
+        if offset is None:
+            break
+    now = time.time()
+    points = [
+        PointStruct(id=_manifest_id(fn), vector={}, payload={
+            "filename": fn, "path": paths.get(fn, ""), "segments": n, "content_type": ctypes.get(fn),
+            "ingested_at": now,
+        })
+        for fn, n in counts.items()
+    ]
+    for i in range(0, len(points), UPSERT_BATCH_SIZE):
+        client.upsert(_manifest(collection), points=points[i : i + UPSERT_BATCH_SIZE])
+    logger.info("Rebuilt manifest %s: %d files", _manifest(collection), len(points))
 
-def get_points_by_filename(filename: str, limit: int = 200):
+def migrate_nested_meta(page_size: int = 1000, collection: str = QDRANT_COLLECTION) -> int:
     """
-    ✅ 这就是你现在缺的函数：按文件名拿到分片
+    迁移旧版同步目录写入的点：payload 为 {"text", "meta": {"filename", ...}}、id 随机，
+    按 filename 的过滤、计数和增量入库都看不到它们，重新同步会写出重复分块。
+    把 meta 展开到顶层（路径为根），之后增量入库按 filename 取到这些点并作为旧分块删除。
+    没有顶层 filename 的点才需要扫描，迁移完成后该扫描为空；返回迁移的点数。
     """
-    init_collection()
-    from qdrant_client.http.models import Filter, FieldCondition, MatchValue
-    pts, _ = client.scroll(
-        collection_name=QDRANT_COLLECTION,
-        with_payload=True,
+    flt = Filter(must=[IsEmptyCondition(is_empty=PayloadField(key="filename"))])
+    groups: Dict[str, Tuple[Dict[str, Any], List[Any]]] = {}
+    offset = None
+    while True:
+        pts, offset = client.scroll(
+            collection_name=collection,
+            scroll_filter=flt,
+            limit=page_size,
+            offset=offset,
+            with_payload=["meta"],
+            with_vectors=False,
+        )
+        for p in pts:
+            meta = (p.payload or {}).get("meta")
+            if isinstance(meta, dict) and meta.get("filename"):
+                flat = {**meta, "path": "", "path_scope": []}
+                key = json.dumps(flat, sort_keys=True, ensure_ascii=False, default=str)
+                groups.setdefault(key, (flat, []))[1].append(p.id)
+        if offset is None:
+            break
+    moved = 0
+    try:
+        for flat, ids in groups.values():
+            for i in range(0, len(ids), UPSERT_BATCH_SIZE):
+                part = ids[i : i + UPSERT_BATCH_SIZE]
+                client.set_payload(collection, payload=flat, points=part)
+                client.delete_payload(collection, keys=["meta"], points=part)
+                moved += len(part)
+    finally:
+        if moved:
+            generation.bump()
+    if moved:
+        logger.info("Migrated %d points with nested meta in %s", moved, collection)
+    return moved
+
+def list_files(page_size: int = 1000, collection: str = QDRANT_COLLECTION):
+    """读文件清单：开销与文件数成正比，与分块数无关。"""
+    init_collection(collection)
+    rows = []
+    offset = None
+    while True:
+        pts, offset = client.scroll(
+            collection_name=_manifest(collection), limit=page_size, offset=offset, with_payload=True
+        )
+        rows.extend(p.payload or {} for p in pts)
+        if offset is None:
+            break
+    rows = [r for r in rows if r.get("filename")]
+    rows.sort(key=lambda r: r["filename"])
+    return rows
+
+# -------------------- 分页 / 字段投影 --------------------
+# fields 为需要返回的字段：text、meta（全部元信息）或具体的元信息键（如 page、filename）；
+# 为空表示全部。id 总是返回。按需只让 Qdrant 返回对应 payload，不拉用不到的分块原文。
+def _with_payload(fields: Optional[Sequence[str]]):
+    if not fields:
+        return True
+    want_text = "text" in fields
+    keys = [f for f in fields if f not in ("id", "text", "meta")]
+    if "meta" in fields:
+        return True if want_text else PayloadSelectorExclude(exclude=["text"])
+    include = (["text"] if want_text else []) + keys
+    return include or False
+
+def _project_rows(pts, fields: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    if not fields:
+        return _point_rows(pts)
+    want_text = "text" in fields
+    want_meta = "meta" in fields or any(f not in ("id", "text") for f in fields)
+    rows = []
+    for p in pts:
+        pay = p.payload or {}
+        row: Dict[str, Any] = {"id": str(getattr(p, "id", ""))}
+        if want_text:
+            row["text"] = pay.get("text", "") or ""
+        if want_meta:
+            row["meta"] = {k: v for k, v in pay.items() if k != "text"}
+        rows.append(row)
+    return rows
+
+def _offset(cursor: Optional[str]):
+    # 游标即下一页第一个点的 id：UUID 或非负整数，其他值 Qdrant 会报错，提前拒绝
+    if not cursor:
+        return None
+    if cursor.isdigit():
+        return int(cursor)
+    try:
+        return str(uuid.UUID(cursor))
+    except ValueError:
+        raise InvalidCursor(f"无效的游标: {cursor}") from None
+
+def _scroll_args(filename: Optional[str], limit: int, cursor: Optional[str], fields,
+                 collection: str = QDRANT_COLLECTION) -> Dict[str, Any]:
+    return dict(
+        collection_name=collection,
+        scroll_filter=_filename_filter(filename) if filename else None,
         limit=limit,
-        scroll_filter=Filter(must=[FieldCondition(key="filename", match=MatchValue(value=filename))])
+        offset=_offset(cursor),
+        with_payload=_with_payload(fields),
+        with_vectors=False,
     )
-    return [
-        {
-            "id": getattr(p, "id", ""),
-            "text": (p.payload or {}).get("text", "") or "",
-            "meta": {k: v for k, v in (p.payload or {}).items() if k != "text"}
-        }
-        for p in pts
-    ]
 
-def get_by_ids(ids: List[str]) -> List[Dict[str, Any]]:
-    if not ids:
-        return []
-    pts = client.retrieve(
-        collection_name=QDRANT_COLLECTION,
-        ids=ids,
-        with_payload=True
-    )
+def scroll_points(filename: Optional[str] = None, limit: int = 200, cursor: Optional[str] = None,
+                  fields: Optional[Sequence[str]] = None,
+                  collection: str = QDRANT_COLLECTION) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    按 id 顺序分页：返回 (本页行, 下一页游标)；游标为 None 表示已到末尾。
+    filename 为空时遍历整个集合。
+    """
+    init_collection(collection)
+    pts, offset = client.scroll(**_scroll_args(filename, limit, cursor, fields, collection))
+    return _project_rows(pts, fields), (str(offset) if offset is not None else None)
+
+def iter_points(filename: Optional[str] = None, fields: Optional[Sequence[str]] = None,
+                page_size: int = 1000, collection: str = QDRANT_COLLECTION) -> Iterator[Dict[str, Any]]:
+    """逐页 scroll 全部点，逐行产出（用于导出，内存只占一页）。"""
+    cursor = None
+    while True:
+        rows, cursor = scroll_points(filename, page_size, cursor, fields, collection)
+        yield from rows
+        if cursor is None:
+            break
+
+def get_points_by_filename(filename: str, limit: int = 200, collection: str = QDRANT_COLLECTION):
+    """
+    按文件名取分片（第一页）；需要全部分片用 scroll_points / iter_points 翻页。
+    """
+    rows, _ = scroll_points(filename, limit, collection=collection)
+    return rows
+
+def _point_rows(pts) -> List[Dict[str, Any]]:
     rows = []
     for p in pts:
         pay = p.payload or {}
@@ -161,27 +792,325 @@ def get_by_ids(ids: List[str]) -> List[Dict[str, Any]]:
             "text": pay.get("text", "") or "",
             "meta": {k: v for k, v in pay.items() if k != "text"},
         })
+        if getattr(p, "vector", None) is not None:
+            rows[-1]["vector"] = p.vector
     return rows
 
+def get_by_ids(ids: List[str], with_vectors: bool = False,
+               fields: Optional[Sequence[str]] = None, collection: str = QDRANT_COLLECTION) -> List[Dict[str, Any]]:
+    if not ids:
+        return []
+    pts = client.retrieve(
+        collection_name=collection,
+        ids=ids,
+        with_payload=_with_payload(fields),
+        with_vectors=with_vectors,
+    )
+    return _project_rows(pts, fields)
+
+def rebuild_lexical_index(page_size: int = 1000, collection: str = QDRANT_COLLECTION) -> int:
+    """
+    从集合全量重建词法索引（只取 text / filename），返回索引的分块数。
+    重建期间关键字检索结果不完整，建议在低峰执行。
+    """
+    lex = _lexical(collection)
+    if lex is None:
+        raise ValueError("词法索引未启用（LEXICAL_INDEX=0）")
+    init_collection(collection)
+    lex.clear()
+    total = 0
+    offset = None
+    while True:
+        pts, offset = client.scroll(
+            collection_name=collection,
+            limit=page_size,
+            offset=offset,
+            with_payload=["text", "filename", "path"],
+            with_vectors=False,
+        )
+        lex.add_many((str(p.id), (p.payload or {}).get("text", ""), (p.payload or {}).get("filename"),
+                      (p.payload or {}).get("path")) for p in pts)
+        total += len(pts)
+        if offset is None:
+            break
+    lex.mark_built()
+    generation.bump()
+    logger.info("Rebuilt lexical index of %s: %d chunks", collection, total)
+    return total
+
+def lexical_stats(collection: str = QDRANT_COLLECTION) -> Optional[Dict[str, Any]]:
+    lex = _lexical(collection)
+    return lex.stats() if lex is not None else None
+
+# -------------------- 异步接口 --------------------
+def get_async_client() -> AsyncQdrantClient:
+    global _aclient
+    if _aclient is None:
+        _aclient = metrics.instrument(AsyncQdrantClient(QDRANT_URL), backend="qdrant")
+    return _aclient
+
+async def ainit_collection(collection: str = QDRANT_COLLECTION):
+    # 就绪状态按进程缓存，只有第一次需要走线程池做检查
+    if collection in _schema_ready:
+        return
+    await asyncio.to_thread(ensure_schema, False, collection)
+
+async def akeyword_search(query_text: str, top_k: int = 10, with_vectors: bool = False,
+                          path: Optional[str] = None, collection: str = QDRANT_COLLECTION) -> List[Dict[str, Any]]:
+    if not query_text:
+        return []
+    if not await asyncio.to_thread(_lexical_ready, collection):
+        return await _asubstring_scan(query_text, top_k, path, collection)
+    lex = _lexical(collection)
+    ranked = await asyncio.to_thread(lex.search, query_text, top_k, normalize_path(path))
+    return _rank_rows(ranked, await aget_by_ids([pid for pid, _ in ranked], with_vectors, collection=collection))
+
+async def atext_fallback(query_text: str, top_k: int = 10, path: Optional[str] = None,
+                         collection: str = QDRANT_COLLECTION) -> List[Dict[str, Any]]:
+    if not query_text:
+        return []
+    if await asyncio.to_thread(_lexical_ready, collection):
+        metrics.inc("vqa_fallback_total", kind="lexical")
+        return await akeyword_search(query_text, top_k, path=path, collection=collection)
+    metrics.inc("vqa_fallback_total", kind="scan")
+    return await _asubstring_scan(query_text, top_k, path, collection)
+
+async def _asubstring_scan(query_text: str, top_k: int, path: Optional[str] = None,
+                           collection: str = QDRANT_COLLECTION) -> List[Dict[str, Any]]:
+    pts, _ = await get_async_client().scroll(
+        collection_name=collection,
+        scroll_filter=_path_filter(path),
+        with_payload=True,
+        limit=FALLBACK_SCAN_LIMIT
+    )
+    return _substring_rows(pts, query_text, top_k)
+
+async def _avector_hits(query_emb: List[float], limit: int, th: Optional[float],
+                        oversampling: Optional[float], rescore: Optional[bool],
+                        with_vectors: bool = False, path: Optional[str] = None,
+                        collection: str = QDRANT_COLLECTION) -> List[Dict[str, Any]]:
+    result = (await get_async_client().query_points(
+        collection_name=collection,
+        query=query_emb,
+        query_filter=_path_filter(path),
+        limit=limit,
+        with_payload=True,
+        with_vectors=with_vectors,
+        score_threshold=th,
+        search_params=_search_params(oversampling, rescore, collection),
+    )).points
+    return _normalize_hits(result)
+
+async def asearch(query_emb: List[float], top_k: int = 15, query_text: Optional[str] = None,
+                  score_threshold: Optional[float] = None,
+                  oversampling: Optional[float] = None, rescore: Optional[bool] = None,
+                  mode: str = "vector", with_vectors: bool = False, path: Optional[str] = None,
+                  collection: str = QDRANT_COLLECTION) -> List[Dict[str, Any]]:
+    """
+    search 的异步版本，不阻塞事件循环；混合检索时向量与关键字两路并发执行。
+    """
+    _check_mode(mode)
+    if not QDRANT_IS_REMOTE:
+        return await asyncio.to_thread(search, query_emb, top_k, query_text, score_threshold,
+                                       oversampling, rescore, mode, with_vectors, path, collection)
+    await ainit_collection(collection)
+    th = _resolve_threshold(score_threshold)
+
+    logger.info("Qdrant.asearch collection=%s mode=%s top_k=%d, threshold=%s, path=%r, query_text=%r",
+                collection, mode, top_k, th, path or "", (query_text or "")[:50])
+
+    if mode == "keyword":
+        return await akeyword_search(query_text, top_k, with_vectors, path, collection)
+    if mode == "hybrid":
+        n = top_k * max(1, HYBRID_CANDIDATES)
+        vec, kw = await asyncio.gather(
+            _avector_hits(query_emb, n, th, oversampling, rescore, with_vectors, path, collection),
+            akeyword_search(query_text, n, with_vectors, path, collection),
+        )
+        return reciprocal_rank_fusion([vec, kw], k=RRF_K)[:top_k]
+
+    hits = _keyword_first(
+        await _avector_hits(query_emb, top_k, th, oversampling, rescore, with_vectors, path, collection),
+        query_text,
+    )
+
+    if not hits and ENABLE_TEXT_FALLBACK and query_text:
+        logger.info("Qdrant.asearch got 0 hits; fallback to keyword search...")
+        hits = await atext_fallback(query_text, top_k=top_k, path=path, collection=collection)
+
+    return hits
+
+async def asearch_batch(requests: List[Dict[str, Any]], with_vectors: bool = False,
+                        collection: str = QDRANT_COLLECTION) -> List[List[Dict[str, Any]]]:
+    """search_batch 的异步版本：向量批量检索与关键字检索并发执行。"""
+    if not requests:
+        return []
+    if not QDRANT_IS_REMOTE:
+        return await asyncio.to_thread(search_batch, requests, with_vectors, collection)
+    await ainit_collection(collection)
+    vec_reqs, kw_reqs = _batch_plan(requests, with_vectors, collection)
+    logger.info("Qdrant.asearch_batch collection=%s n=%d vector=%d keyword=%d",
+                collection, len(requests), len(vec_reqs), len(kw_reqs))
+
+    async def vector_part():
+        if not vec_reqs:
+            return {}
+        responses = await get_async_client().query_batch_points(
+            collection_name=collection, requests=[q for _, q in vec_reqs]
+        )
+        return {i: _normalize_hits(resp.points) for (i, _), resp in zip(vec_reqs, responses)}
+
+    async def keyword_part():
+        if not kw_reqs:
+            return {}
+        lex = _lexical(collection)
+        if not await asyncio.to_thread(_lexical_ready, collection):
+            return {i: await _asubstring_scan(text, n, path, collection) for i, text, n, path in kw_reqs}
+        ranked = await asyncio.to_thread(lambda: {i: lex.search(text, n, path) for i, text, n, path in kw_reqs})
+        ids = list(dict.fromkeys(pid for r in ranked.values() for pid, _ in r))
+        rows = await aget_by_ids(ids, with_vectors, collection=collection)
+        return {i: _rank_rows(r, rows) for i, r in ranked.items()}
+
+    vec_hits, kw_hits = await asyncio.gather(vector_part(), keyword_part())
+    results = _batch_combine(requests, vec_hits, kw_hits)
+    for r, hits in zip(requests, results):
+        if not hits and (r.get("mode") or "vector") == "vector" and ENABLE_TEXT_FALLBACK and r.get("query_text"):
+            hits.extend(await atext_fallback(r["query_text"], top_k=r["top_k"], path=r.get("path"),
+                                             collection=collection))
+    return results
+
+async def aget_by_ids(ids: List[str], with_vectors: bool = False,
+                      fields: Optional[Sequence[str]] = None,
+                      collection: str = QDRANT_COLLECTION) -> List[Dict[str, Any]]:
+    if not ids:
+        return []
+    if not QDRANT_IS_REMOTE:
+        return await asyncio.to_thread(get_by_ids, ids, with_vectors, fields, collection)
+    pts = await get_async_client().retrieve(
+        collection_name=collection,
+        ids=ids,
+        with_payload=_with_payload(fields),
+        with_vectors=with_vectors,
+    )
+    return _project_rows(pts, fields)
+
+async def ascroll_points(filename: Optional[str] = None, limit: int = 200, cursor: Optional[str] = None,
+                         fields: Optional[Sequence[str]] = None,
+                         collection: str = QDRANT_COLLECTION) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    if not QDRANT_IS_REMOTE:
+        return await asyncio.to_thread(scroll_points, filename, limit, cursor, fields, collection)
+    await ainit_collection(collection)
+    pts, offset = await get_async_client().scroll(**_scroll_args(filename, limit, cursor, fields, collection))
+    return _project_rows(pts, fields), (str(offset) if offset is not None else None)
+
+async def aiter_points(filename: Optional[str] = None, fields: Optional[Sequence[str]] = None,
+                       page_size: int = 1000,
+                       collection: str = QDRANT_COLLECTION) -> AsyncIterator[List[Dict[str, Any]]]:
+    """iter_points 的异步版本，按页产出。"""
+    cursor = None
+    while True:
+        rows, cursor = await ascroll_points(filename, page_size, cursor, fields, collection)
+        yield rows
+        if cursor is None:
+            break
+
+async def aclose():
+    global _aclient
+    if _aclient is not None:
+        await _aclient.close()
+        _aclient = None
+
 class QdrantDB:
-    def __init__(self, collection_name):
+    def __init__(self, collection_name: str = QDRANT_COLLECTION):
         self.collection_name = collection_name
 
     def insert(self, vector, text, meta):
-        add_texts([text], [vector], [meta])
+        add_texts([text], [vector], [meta], collection=self.collection_name)
+
+    def insert_many(self, vectors, texts, metas, ids=None):
+        add_texts(texts, vectors, metas, ids=ids, collection=self.collection_name)
+
+    def update_payloads(self, ids, texts, metas):
+        update_payloads(ids, texts, metas, collection=self.collection_name)
+
+    def point_ids(self, filename) -> List[str]:
+        return point_ids_by_filename(filename, collection=self.collection_name)
+
+    def delete_ids(self, ids: List[str]):
+        return delete_points(ids, collection=self.collection_name)
 
     def search(self, query_emb, top_k: int = 15, query_text: Optional[str] = None,
-               score_threshold: Optional[float] = None):
-        return search(query_emb, top_k=top_k, query_text=query_text, score_threshold=score_threshold)
+               score_threshold: Optional[float] = None,
+               oversampling: Optional[float] = None, rescore: Optional[bool] = None,
+               mode: str = "vector", with_vectors: bool = False, path: Optional[str] = None):
+        return search(query_emb, top_k=top_k, query_text=query_text, score_threshold=score_threshold,
+                      oversampling=oversampling, rescore=rescore, mode=mode, with_vectors=with_vectors,
+                      path=path, collection=self.collection_name)
 
     def delete_by_filename(self, filename):
-        return delete_by_filename(filename)
+        return delete_by_filename(filename, collection=self.collection_name)
 
     def list_files(self):
-        return list_files()
+        return list_files(collection=self.collection_name)
+
+    def update_manifest(self, filename, **fields):
+        return upsert_manifest(filename, collection=self.collection_name, **fields)
 
     def file_segments(self, filename, limit=200):
-        return get_points_by_filename(filename, limit=limit)
+        return get_points_by_filename(filename, limit=limit, collection=self.collection_name)
+
+    def scroll(self, filename=None, limit: int = 200, cursor=None, fields=None):
+        return scroll_points(filename, limit=limit, cursor=cursor, fields=fields, collection=self.collection_name)
+
+    def get_by_ids(self, ids: List[str], fields=None):
+        return get_by_ids(ids, fields=fields, collection=self.collection_name)
+
+    def search_batch(self, requests: List[Dict[str, Any]], with_vectors: bool = False):
+        return search_batch(requests, with_vectors=with_vectors, collection=self.collection_name)
+
+    def generation(self) -> str:
+        return generation.current()
+
+    def ensure_schema(self):
+        return ensure_schema(collection=self.collection_name)
+
+    def schema_status(self):
+        return schema_status(self.collection_name)
+
+    def rebuild_lexical(self) -> int:
+        return rebuild_lexical_index(collection=self.collection_name)
+
+    def lexical_stats(self):
+        return lexical_stats(self.collection_name)
+
+class AsyncQdrantDB:
+    """QdrantDB 的异步对应：读路径走 AsyncQdrantClient，供 async 路由使用。"""
+    def __init__(self, collection_name: str = QDRANT_COLLECTION):
+        self.collection_name = collection_name
+
+    async def search(self, query_emb, top_k: int = 15, query_text: Optional[str] = None,
+                     score_threshold: Optional[float] = None,
+                     oversampling: Optional[float] = None, rescore: Optional[bool] = None,
+                     mode: str = "vector", with_vectors: bool = False, path: Optional[str] = None):
+        return await asearch(query_emb, top_k=top_k, query_text=query_text, score_threshold=score_threshold,
+                             oversampling=oversampling, rescore=rescore, mode=mode, with_vectors=with_vectors,
+                             path=path, collection=self.collection_name)
+
+    async def search_batch(self, requests: List[Dict[str, Any]], with_vectors: bool = False):
+        return await asearch_batch(requests, with_vectors=with_vectors, collection=self.collection_name)
+
+    async def get_by_ids(self, ids: List[str], fields=None):
+        return await aget_by_ids(ids, fields=fields, collection=self.collection_name)
+
+    async def scroll(self, filename=None, limit: int = 200, cursor=None, fields=None):
+        return await ascroll_points(filename, limit=limit, cursor=cursor, fields=fields,
+                                    collection=self.collection_name)
+
+    def iter_pages(self, filename=None, fields=None, page_size: int = 1000):
+        return aiter_points(filename, fields=fields, page_size=page_size, collection=self.collection_name)
+
+    def generation(self) -> str:
+        return generation.current()
 
-    def get_by_ids(self, ids: List[str]):
-        return get_by_ids(ids)
+    async def close(self):
+        await aclose()
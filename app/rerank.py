@@ -0,0 +1,137 @@
+# app/rerank.py
+"""
+检索后处理：MMR 去冗余 + 同文件重叠分块合并。
+
+- mmr_select：最大边际相关（Maximal Marginal Relevance），NumPy 向量化；
+  每轮选 argmax(λ·相关度 − (1−λ)·与已选结果的最大相似度)，λ=1 退化为按相关度排序
+- collapse_overlaps：同一文件里首尾文本重叠（overlap_chunks 相邻分块的重叠行）或行号相邻（表格分块）的结果合并成一段，
+  分数取最高，meta 记录合并来源
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+def _unit_rows(m: np.ndarray) -> np.ndarray:
+    return m / np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+
+
+def scaled_scores(hits: List[Dict[str, Any]]) -> np.ndarray:
+    """把分数线性缩放到 [0, 1]，用于 RRF / BM25 这类与余弦相似度量纲不同的分数。"""
+    s = np.asarray([float(h.get("score", 0.0)) for h in hits], dtype=np.float32)
+    if not len(s):
+        return s
+    span = float(s.max() - s.min())
+    return (s - s.min()) / span if span > 0 else np.ones_like(s)
+
+
+def mmr_select(hits: List[Dict[str, Any]], k: int, lambda_: float = 0.5,
+               relevance: Optional[Sequence[float]] = None) -> List[Dict[str, Any]]:
+    """
+    从 hits（需带 "vector"）中按 MMR 选出 k 条，保持选中顺序。
+    relevance 默认取 hits 的 score；没有向量的条目不参与多样性计算，只按相关度排在最后。
+    """
+    if k <= 0 or not hits:
+        return []
+    with_vec = [i for i, h in enumerate(hits) if h.get("vector") is not None]
+    rel_all = np.asarray(relevance if relevance is not None else [float(h.get("score", 0.0)) for h in hits],
+                         dtype=np.float32)
+    if len(with_vec) < 2:
+        order = np.argsort(-rel_all, kind="stable")[:k]
+        return [hits[i] for i in order]
+
+    docs = _unit_rows(np.asarray([hits[i]["vector"] for i in with_vec], dtype=np.float32))
+    rel = rel_all[with_vec]
+    sim = docs @ docs.T
+    n = len(with_vec)
+    chosen: List[int] = []
+    # 每个候选与已选集合的最大相似度，逐轮增量更新，不重复算整张表
+    max_sim = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    for _ in range(min(k, n)):
+        penalty = np.where(np.isfinite(max_sim), max_sim, 0.0)
+        score = lambda_ * rel - (1.0 - lambda_) * penalty
+        score[~available] = -np.inf
+        j = int(np.argmax(score))
+        chosen.append(j)
+        available[j] = False
+        np.maximum(max_sim, sim[j], out=max_sim)
+
+    out = [hits[with_vec[j]] for j in chosen]
+    if len(out) < k:
+        rest = [i for i in np.argsort(-rel_all, kind="stable") if hits[i].get("vector") is None]
+        out.extend(hits[i] for i in rest[: k - len(out)])
+    return out
+
+
+def _overlap_merge(a: str, b: str, min_overlap: int) -> Optional[str]:
+    """a 的结尾与 b 的开头重叠至少 min_overlap 个字符（或一方包含另一方）时返回合并文本。"""
+    if min(len(a), len(b)) < min_overlap:
+        return None
+    if b in a:
+        return a
+    if a in b:
+        return b
+    probe = b[:min_overlap]
+    p = a.find(probe, max(0, len(a) - len(b)))
+    while p != -1:
+        # 最早的匹配位置即最长的重叠
+        if b.startswith(a[p:]):
+            return a + b[len(a) - p:]
+        p = a.find(probe, p + 1)
+    return None
+
+
+def _rows_adjacent(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    ma, mb = a.get("meta") or {}, b.get("meta") or {}
+    if "row_start" not in ma or "row_start" not in mb:
+        return False
+    return ma["row_end"] + 1 == mb["row_start"]
+
+
+def _merge(a: Dict[str, Any], b: Dict[str, Any], min_overlap: int, max_chars: int) -> Optional[Dict[str, Any]]:
+    """尝试把同文件的 a、b 合并（两个方向都试），超过 max_chars 不合并。"""
+    for first, second in ((a, b), (b, a)):
+        text = _overlap_merge(first["text"], second["text"], min_overlap)
+        if text is None and _rows_adjacent(first, second):
+            text = first["text"] + "\n" + second["text"]
+        if text is None or (max_chars and len(text) > max_chars):
+            continue
+        best = a if a.get("score", 0.0) >= b.get("score", 0.0) else b
+        meta = dict(best.get("meta") or {})
+        fm, sm = first.get("meta") or {}, second.get("meta") or {}
+        for lo, hi in (("page", "page_end"), ("row_start", "row_end")):
+            if lo in fm and lo in sm:
+                meta[lo] = min(fm[lo], sm[lo])
+                meta[hi] = max(fm.get(hi, fm[lo]), sm.get(hi, sm[lo]))
+        meta["merged_ids"] = (a.get("meta") or {}).get("merged_ids", [a.get("id")]) \
+            + (b.get("meta") or {}).get("merged_ids", [b.get("id")])
+        return {**best, "text": text, "meta": meta, "score": best.get("score", 0.0)}
+    return None
+
+
+def collapse_overlaps(hits: List[Dict[str, Any]], min_overlap: int = 20, max_chars: int = 0) -> List[Dict[str, Any]]:
+    """
+    合并同一文件中相互重叠 / 相邻的结果，保持原排序（合并后的段落占据其中最靠前那条的位置）。
+    min_overlap 为判定首尾重叠的最少字符数；max_chars > 0 时合并结果不超过该长度。
+    """
+    passages: List[tuple] = []   # (原始名次, 段落)
+    for rank, hit in enumerate(hits):
+        fname = (hit.get("meta") or {}).get("filename")
+        cur, cur_rank = hit, rank
+        merged = fname is not None
+        # 新合并出的段落可能又与其他段落重叠（A、C 先到，B 把它们连起来），循环直到不再合并
+        while merged:
+            merged = False
+            for i, (r, p) in enumerate(passages):
+                if (p.get("meta") or {}).get("filename") != fname:
+                    continue
+                m = _merge(p, cur, min_overlap, max_chars)
+                if m is not None:
+                    passages.pop(i)
+                    cur, cur_rank = m, min(r, cur_rank)
+                    merged = True
+                    break
+        passages.append((cur_rank, cur))
+    passages.sort(key=lambda x: x[0])
+    return [p for _, p in passages]
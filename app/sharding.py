@@ -0,0 +1,402 @@
+# app/sharding.py
+"""
+路径分区：入库时给文件指定 path（如 "tenantA/docs/2024"），检索时只在该路径及其子路径内查找。
+
+- path 规范化为以 "/" 分隔、不含空段 / "." / ".." 的相对路径，"" 表示根
+- 分块 payload 存 path 与 path_scope（各级前缀），Qdrant 对 path_scope 建 keyword 索引，按前缀检索即一次等值过滤
+- 带 path 入库的文件以 "<path>/<文件名>" 作为文件名，清单、删除、增量入库都按这个限定名区分，不同路径下的同名文件互不覆盖
+
+SHARD_MODE=collection 时 ShardedDB / AsyncShardedDB 把数据按 path 第一段拆到独立集合 <集合名>__p_<段>：
+- 写入按分块的 path 路由，按文件名的操作按限定名的第一段路由，不带路径的文件留在主集合
+- 带 path 的检索只查对应分片；不带 path 的检索并发查询全部分片（最多 SHARD_FANOUT 个同时在途），按分数合并 top-k
+- 分片列表从后端集合列表发现，新分片第一次写入后 bump generation.shards.<集合名>，其他 worker 据此刷新
+- 各分片的 BM25 分数基于各自的词频统计，跨分片合并的 keyword 结果排序只是近似
+"""
+import os
+import re
+import bisect
+import asyncio
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .config import CACHE_DIR, SHARD_FANOUT
+from .cache import Generation, default_cache_dir
+from .vector_db import InvalidCursor
+
+logger = logging.getLogger("sharding")
+
+SHARD_INFIX = "__p_"
+_SAFE_RE = re.compile(r"[^A-Za-z0-9_-]+")
+_SLUG_MAX = 40
+
+
+# -------------------- 路径 --------------------
+def normalize_path(path: Optional[str]) -> str:
+    parts = (path or "").replace("\\", "/").split("/")
+    return "/".join(p for p in (s.strip() for s in parts) if p and p not in (".", ".."))
+
+
+def path_scope(path: Optional[str]) -> List[str]:
+    """"a/b/c" → ["a", "a/b", "a/b/c"]；根路径为空列表。"""
+    parts = normalize_path(path).split("/")
+    return ["/".join(parts[: i + 1]) for i in range(len(parts)) if parts[i]]
+
+
+def qualify(filename: str, path: Optional[str]) -> str:
+    path = normalize_path(path)
+    return f"{path}/{filename}" if path else filename
+
+
+def top_segment(path: Optional[str]) -> str:
+    return normalize_path(path).split("/", 1)[0]
+
+
+def shard_name(base: str, segment: str) -> str:
+    """分片集合名；段名含集合名 / 目录名不安全的字符时附 hash 区分。"""
+    slug = _SAFE_RE.sub("_", segment)[:_SLUG_MAX]
+    if slug != segment:
+        slug = f"{slug}_{hashlib.sha1(segment.encode('utf-8')).hexdigest()[:8]}"
+    return f"{base}{SHARD_INFIX}{slug}"
+
+
+def merge_hits(parts: Sequence[List[Dict[str, Any]]], top_k: int, mode: str = "vector",
+               query_text: Optional[str] = None) -> List[Dict[str, Any]]:
+    """多个分片的结果按分数合并取 top_k；vector 模式与单集合一样把包含原词的结果排在前面。"""
+    hits = sorted((h for p in parts for h in p), key=lambda h: h.get("score", 0.0), reverse=True)[:top_k]
+    if mode == "vector" and query_text:
+        contain = [h for h in hits if query_text in (h.get("text") or "")]
+        hits = contain + [h for h in hits if query_text not in (h.get("text") or "")]
+    return hits
+
+
+# -------------------- 分片路由 --------------------
+class ShardedDB:
+    """
+    多个后端集合组成的逻辑集合，接口与 QdrantDB / NumpyDB 相同。
+    factory(集合名) 创建单个集合的后端实例，discover() 返回后端现有的全部集合名。
+    """
+
+    def __init__(self, base: str, factory: Callable[[str], Any], discover: Callable[[], List[str]]):
+        self.collection_name = base
+        self._factory = factory
+        self._discover = discover
+        self._prefix = f"{base}{SHARD_INFIX}"
+        self._gen = Generation(os.path.join(CACHE_DIR or default_cache_dir(), f"generation.shards.{base}"))
+        self._lock = threading.Lock()
+        self._dbs: Dict[str, Any] = {base: factory(base)}
+        self._known: List[str] = [base]
+        self._known_gen: Optional[str] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_pid = None
+
+    # -------------------- 分片列表 --------------------
+    def shards(self) -> List[str]:
+        """主集合在前，其余按名称排序；分片代数变化时重新发现。"""
+        gen = self._gen.current()
+        if gen != self._known_gen:
+            with self._lock:
+                if gen != self._known_gen:
+                    names = sorted(n for n in self._discover() if n.startswith(self._prefix))
+                    self._known = [self.collection_name] + names
+                    self._known_gen = gen
+        return self._known
+
+    def _db(self, name: str):
+        db = self._dbs.get(name)
+        if db is None:
+            with self._lock:
+                db = self._dbs.get(name)
+                if db is None:
+                    db = self._dbs[name] = self._factory(name)
+        return db
+
+    def _shard_of_path(self, path: Optional[str]) -> str:
+        seg = top_segment(path)
+        return shard_name(self.collection_name, seg) if seg else self.collection_name
+
+    def _shard_of_file(self, filename: str) -> str:
+        # 限定名 "<path>/<文件名>" 的第一段即分片；不带路径的文件在主集合
+        return self._shard_of_path(filename) if "/" in filename else self.collection_name
+
+    def _map(self, fn: Callable[[str, Any], Any], names: Sequence[str]) -> List[Any]:
+        """fn(分片名, 后端实例) 在各分片上执行；多个分片时用线程池并发，最多 SHARD_FANOUT 个同时进行。"""
+        if len(names) <= 1:
+            return [fn(n, self._db(n)) for n in names]
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool, self._pool_pid = ThreadPoolExecutor(max(1, SHARD_FANOUT), thread_name_prefix="shard"), os.getpid()
+        return list(self._pool.map(lambda n: fn(n, self._db(n)), names))
+
+    # -------------------- 写入 / 删除 --------------------
+    def insert(self, vector, text, meta):
+        self.insert_many([vector], [text], [meta])
+
+    def insert_many(self, vectors, texts, metas, ids=None):
+        groups: Dict[str, List[int]] = {}
+        for i in range(len(texts)):
+            groups.setdefault(self._shard_of_path(((metas[i] if metas else None) or {}).get("path")), []).append(i)
+        known = set(self.shards())
+        for name, idx in groups.items():
+            self._db(name).insert_many(
+                [vectors[i] for i in idx], [texts[i] for i in idx],
+                [metas[i] for i in idx] if metas else None,
+                ids=[ids[i] for i in idx] if ids else None,
+            )
+        if any(name not in known for name in groups):
+            logger.info("New shard(s) of %s: %s", self.collection_name, sorted(set(groups) - known))
+            self._gen.bump()
+
+    def update_payloads(self, ids, texts, metas):
+        groups: Dict[str, List[int]] = {}
+        for i in range(len(ids)):
+            groups.setdefault(self._shard_of_path((metas[i] or {}).get("path")), []).append(i)
+        for name, idx in groups.items():
+            self._db(name).update_payloads([ids[i] for i in idx], [texts[i] for i in idx], [metas[i] for i in idx])
+
+    def point_ids(self, filename) -> List[str]:
+        return self._db(self._shard_of_file(filename)).point_ids(filename)
+
+    def delete_ids(self, ids: List[str]):
+        if ids:
+            self._map(lambda _, db: db.delete_ids(ids), self.shards())
+
+    def delete_by_filename(self, filename):
+        return self._db(self._shard_of_file(filename)).delete_by_filename(filename)
+
+    # -------------------- 文件清单 / 读取 --------------------
+    def update_manifest(self, filename, **fields):
+        return self._db(self._shard_of_file(filename)).update_manifest(filename, **fields)
+
+    def list_files(self):
+        files = [f for part in self._map(lambda _, db: db.list_files(), self.shards()) for f in part]
+        return sorted(files, key=lambda f: f.get("filename") or "")
+
+    def file_segments(self, filename, limit=200):
+        return self._db(self._shard_of_file(filename)).file_segments(filename, limit=limit)
+
+    def get_by_ids(self, ids: List[str], fields=None):
+        if not ids:
+            return []
+        found = {r["id"]: r for part in self._map(lambda _, db: db.get_by_ids(ids, fields=fields), self.shards())
+                 for r in part}
+        return [found[str(i)] for i in dict.fromkeys(ids) if str(i) in found]
+
+    def scroll(self, filename=None, limit: int = 200, cursor=None, fields=None):
+        """指定文件时只翻对应分片；否则依次翻各分片，游标为 "<分片名>|<分片内游标>"。"""
+        if filename:
+            return self._db(self._shard_of_file(filename)).scroll(filename, limit=limit, cursor=cursor, fields=fields)
+        return _scroll_shards(self.collection_name, self.shards(), cursor, limit,
+                              lambda name, c, n: self._db(name).scroll(None, limit=n, cursor=c, fields=fields))
+
+    # -------------------- 检索 --------------------
+    def search_batch(self, requests: List[Dict[str, Any]], with_vectors: bool = False):
+        if not requests:
+            return []
+        routes = list(_route(self.collection_name, self.shards(), requests).items())
+        reqs = {name: [r for _, r in items] for name, items in routes}
+        parts = self._map(lambda name, db: db.search_batch(reqs[name], with_vectors=with_vectors), list(reqs))
+        return _gather_results(requests, routes, parts)
+
+    def search(self, query_emb, top_k: int = 15, query_text: Optional[str] = None,
+               score_threshold: Optional[float] = None,
+               oversampling: Optional[float] = None, rescore: Optional[bool] = None,
+               mode: str = "vector", with_vectors: bool = False, path: Optional[str] = None):
+        return self.search_batch([_request(query_emb, top_k, query_text, score_threshold,
+                                           oversampling, rescore, mode, path)], with_vectors=with_vectors)[0]
+
+    # -------------------- 维护 --------------------
+    def generation(self) -> str:
+        return _combined_generation(self._gen.current(), [self._db(n).generation() for n in self.shards()])
+
+    def ensure_schema(self):
+        for name in self.shards():
+            self._db(name).ensure_schema()
+
+    def schema_status(self):
+        status = dict(self._db(self.collection_name).schema_status())
+        shards = {n: self._db(n).schema_status() for n in self.shards()[1:]}
+        status["shard_mode"] = "collection"
+        status["shards"] = shards
+        status["ready"] = bool(status.get("ready")) and all(s.get("ready") for s in shards.values())
+        return status
+
+    def rebuild_lexical(self) -> int:
+        return sum(self._db(n).rebuild_lexical() for n in self.shards())
+
+    def lexical_stats(self):
+        stats = {n: self._db(n).lexical_stats() for n in self.shards()}
+        return stats if any(v is not None for v in stats.values()) else None
+
+
+class AsyncShardedDB:
+    """ShardedDB 的异步对应：分片列表与路由沿用同步实例，各分片的读请求用 asyncio.gather 并发。"""
+
+    def __init__(self, db: ShardedDB, afactory: Callable[[str, Any], Any]):
+        self.db = db
+        self.collection_name = db.collection_name
+        self._afactory = afactory
+        self._adbs: Dict[str, Any] = {}
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._sem_loop = None
+
+    def _adb(self, name: str):
+        adb = self._adbs.get(name)
+        if adb is None:
+            adb = self._adbs[name] = self._afactory(name, self.db._db(name))
+        return adb
+
+    async def _shards(self) -> List[str]:
+        # 分片代数变化时 discover 要访问后端，放到线程池里做
+        if self.db._gen.current() != self.db._known_gen:
+            return await asyncio.to_thread(self.db.shards)
+        return self.db._known
+
+    async def _gather(self, fn: Callable[[str, Any], Any], names: Sequence[str]) -> List[Any]:
+        if len(names) <= 1:
+            return [await fn(n, self._adb(n)) for n in names]
+        loop = asyncio.get_running_loop()
+        if self._sem is None or self._sem_loop is not loop:
+            self._sem, self._sem_loop = asyncio.Semaphore(max(1, SHARD_FANOUT)), loop
+
+        async def one(name):
+            async with self._sem:
+                return await fn(name, self._adb(name))
+        return await asyncio.gather(*(one(n) for n in names))
+
+    async def search_batch(self, requests: List[Dict[str, Any]], with_vectors: bool = False):
+        if not requests:
+            return []
+        routes = list(_route(self.collection_name, await self._shards(), requests).items())
+        reqs = {name: [r for _, r in items] for name, items in routes}
+        parts = await self._gather(lambda name, adb: adb.search_batch(reqs[name], with_vectors=with_vectors), list(reqs))
+        return _gather_results(requests, routes, parts)
+
+    async def search(self, query_emb, top_k: int = 15, query_text: Optional[str] = None,
+                     score_threshold: Optional[float] = None,
+                     oversampling: Optional[float] = None, rescore: Optional[bool] = None,
+                     mode: str = "vector", with_vectors: bool = False, path: Optional[str] = None):
+        return (await self.search_batch([_request(query_emb, top_k, query_text, score_threshold,
+                                                  oversampling, rescore, mode, path)], with_vectors=with_vectors))[0]
+
+    async def get_by_ids(self, ids: List[str], fields=None):
+        if not ids:
+            return []
+        parts = await self._gather(lambda _, adb: adb.get_by_ids(ids, fields=fields), await self._shards())
+        found = {r["id"]: r for part in parts for r in part}
+        return [found[str(i)] for i in dict.fromkeys(ids) if str(i) in found]
+
+    async def scroll(self, filename=None, limit: int = 200, cursor=None, fields=None):
+        if filename:
+            return await self._adb(self.db._shard_of_file(filename)).scroll(
+                filename, limit=limit, cursor=cursor, fields=fields)
+        names = await self._shards()
+        i, inner = _cursor_position(self.collection_name, names, cursor)
+        while i < len(names):
+            rows, nxt = await self._adb(names[i]).scroll(None, limit=limit, cursor=inner, fields=fields)
+            if rows or nxt is not None:
+                return rows, _next_cursor(names, i, nxt)
+            i, inner = i + 1, None
+        return [], None
+
+    async def iter_pages(self, filename=None, fields=None, page_size: int = 1000):
+        cursor = None
+        while True:
+            rows, cursor = await self.scroll(filename, page_size, cursor, fields)
+            yield rows
+            if cursor is None:
+                break
+
+    def generation(self) -> str:
+        return self.db.generation()
+
+    async def close(self):
+        for adb in self._adbs.values():
+            await adb.close()
+
+
+# -------------------- 共用 --------------------
+def _request(query_emb, top_k, query_text, score_threshold, oversampling, rescore, mode, path) -> Dict[str, Any]:
+    return {
+        "query_emb": query_emb, "query_text": query_text, "top_k": top_k, "score_threshold": score_threshold,
+        "oversampling": oversampling, "rescore": rescore, "mode": mode, "path": path,
+    }
+
+
+def _route(base: str, shards: List[str], requests: List[Dict[str, Any]]) -> Dict[str, List[Tuple[int, Dict[str, Any]]]]:
+    """
+    把请求分到分片：带 path 的只去 path 第一段对应的分片（path 只有一段时整个分片都在范围内，去掉过滤），
+    分片不存在则无结果；不带 path 的发给全部分片。
+    """
+    routes: Dict[str, List[Tuple[int, Dict[str, Any]]]] = {}
+    known = set(shards)
+    for i, r in enumerate(requests):
+        path = normalize_path(r.get("path"))
+        if not path:
+            for name in shards:
+                routes.setdefault(name, []).append((i, r))
+            continue
+        seg = top_segment(path)
+        name = shard_name(base, seg)
+        if name in known:
+            routes.setdefault(name, []).append((i, {**r, "path": path if path != seg else None}))
+    return routes
+
+
+def _gather_results(requests, routes, parts) -> List[List[Dict[str, Any]]]:
+    per_req: List[List[List[Dict[str, Any]]]] = [[] for _ in requests]
+    for (_, items), results in zip(routes, parts):
+        for (i, _), hits in zip(items, results):
+            per_req[i].append(hits)
+    out = []
+    for r, got in zip(requests, per_req):
+        if len(got) == 1:
+            out.append(got[0])
+        else:
+            out.append(merge_hits(got, r["top_k"], r.get("mode") or "vector", r.get("query_text")))
+    return out
+
+
+def _combined_generation(own: str, gens: Sequence[str]) -> str:
+    return hashlib.sha1("|".join([own, *gens]).encode("utf-8")).hexdigest()[:16]
+
+
+def _parse_cursor(base: str, cursor: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """游标为 "<分片名>|<分片内游标>"，分片内游标为空表示从该分片开头。"""
+    if not cursor:
+        return None, None
+    name, sep, inner = str(cursor).rpartition("|")
+    if not sep or not (name == base or name.startswith(f"{base}{SHARD_INFIX}")):
+        raise InvalidCursor(f"无效的游标: {cursor}")
+    return name, (inner or None)
+
+
+def _cursor_position(base: str, names: Sequence[str], cursor: Optional[str]) -> Tuple[int, Optional[str]]:
+    """
+    按分片名定位，翻页期间出现新分片不会让后续分片错位。
+    主集合固定在第一位、其余分片按名称排序；游标所在分片已不存在时从排在它之后的分片开头继续。
+    """
+    name, inner = _parse_cursor(base, cursor)
+    if name is None:
+        return 0, None
+    if name in names:
+        return list(names).index(name), inner
+    return 1 + bisect.bisect_left(list(names[1:]), name), None
+
+
+def _next_cursor(names: Sequence[str], i: int, inner: Optional[str]) -> Optional[str]:
+    if inner is not None:
+        return f"{names[i]}|{inner}"
+    return f"{names[i + 1]}|" if i + 1 < len(names) else None
+
+
+def _scroll_shards(base: str, names: Sequence[str], cursor: Optional[str], limit: int,
+                   scroll: Callable[[str, Optional[str], int], Tuple[List[Dict[str, Any]], Optional[str]]]):
+    i, inner = _cursor_position(base, names, cursor)
+    while i < len(names):
+        rows, nxt = scroll(names[i], inner, limit)
+        if rows or nxt is not None:
+            return rows, _next_cursor(names, i, nxt)
+        i, inner = i + 1, None
+    return [], None
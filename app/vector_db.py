@@ -0,0 +1,66 @@
+# app/vector_db.py
+"""
+向量库后端选择：VECTOR_BACKEND = qdrant（默认）| numpy（进程内，不依赖 Qdrant 服务）。
+两种后端提供相同的接口（QdrantDB / AsyncQdrantDB 的方法集），调用方只通过这里创建实例。
+SHARD_MODE=collection 时返回按 path 第一段分片的 ShardedDB / AsyncShardedDB（见 app.sharding），接口不变。
+"""
+from .config import VECTOR_BACKEND, QDRANT_COLLECTION, SHARD_MODE
+
+SEARCH_MODES = ("vector", "hybrid", "keyword")
+SHARD_MODES = ("filter", "collection")
+
+
+class SchemaError(RuntimeError):
+    """已有集合与当前配置不兼容（如向量维度不一致），需要人工处理。"""
+
+
+class InvalidCursor(ValueError):
+    """分页游标无法解析（不是本接口上一页返回的游标），接口返回 400。"""
+
+
+def _check_config():
+    if VECTOR_BACKEND not in ("qdrant", "numpy"):
+        raise ValueError(f"不支持的 VECTOR_BACKEND: {VECTOR_BACKEND}")
+    if SHARD_MODE not in SHARD_MODES:
+        raise ValueError(f"不支持的 SHARD_MODE: {SHARD_MODE}（可选 {' / '.join(SHARD_MODES)}）")
+
+
+def _create_single(collection_name: str):
+    if VECTOR_BACKEND == "numpy":
+        from .numpy_db import NumpyDB
+        return NumpyDB(collection_name)
+    from .qdrant_client import QdrantDB
+    return QdrantDB(collection_name)
+
+
+def _list_collections():
+    if VECTOR_BACKEND == "numpy":
+        from .numpy_db import NumpyDB
+        return NumpyDB.list_collections()
+    from .qdrant_client import list_collections
+    return list_collections()
+
+
+def _create_single_async(collection_name: str, db=None):
+    if VECTOR_BACKEND == "numpy":
+        from .numpy_db import AsyncNumpyDB
+        return AsyncNumpyDB(db if db is not None else _create_single(collection_name))
+    from .qdrant_client import AsyncQdrantDB
+    return AsyncQdrantDB(collection_name)
+
+
+def create_db(collection_name: str = QDRANT_COLLECTION):
+    _check_config()
+    if SHARD_MODE == "collection":
+        from .sharding import ShardedDB
+        return ShardedDB(collection_name, _create_single, _list_collections)
+    return _create_single(collection_name)
+
+
+def create_async_db(collection_name: str = QDRANT_COLLECTION, db=None):
+    """异步读接口；numpy 后端需与同步实例共享内存中的索引，传入 create_db 的返回值。"""
+    _check_config()
+    if SHARD_MODE == "collection":
+        from .sharding import AsyncShardedDB
+        return AsyncShardedDB(db if db is not None else create_db(collection_name), _create_single_async)
+    return _create_single_async(collection_name, db)
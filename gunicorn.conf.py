@@ -0,0 +1,27 @@
+# gunicorn.conf.py
+"""
+gunicorn 配置（镜像默认通过 -c gunicorn.conf.py 使用）。
+
+- WEB_CONCURRENCY：worker 数，默认 4
+- PRELOAD=1：preload_app，主进程导入应用和全部解析器后 gc.freeze()，worker fork 后共享这些页面；
+  默认关闭，worker 各自导入，只在第一次处理某种文件类型时才加载对应解析器
+"""
+import gc
+import os
+
+from app.config import PRELOAD
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = PRELOAD
+
+
+def when_ready(server):
+    if not PRELOAD:
+        return
+    from app.parsers import preload
+    server.log.info("Preloaded parsers: %s", ", ".join(preload()))
+    # 主进程已有的对象移出 GC 跟踪：worker 里的 GC 不再写这些对象的头部，共享页面不会因此被复制
+    gc.collect()
+    gc.freeze()
@@ -0,0 +1,353 @@
+"""
+端到端基准：合成语料 → split_file 吞吐 → 入库吞吐 → /search 并发延迟，结果输出 JSON 便于跨提交对比。
+
+- 语料：按 --types 生成 PDF / DOCX / CSV / JSON 文件（中英混排的合成文本，--seed 固定时内容可复现）
+- Embedding：进程内启动 fake_ollama（确定性向量，--latency-ms / --per-item-ms 模拟模型耗时）
+- 向量库：--backend qdrant 用 qdrant-client 本地内存模式（QDRANT_URL=":memory:"），numpy 用进程内后端
+- /search：uvicorn 在后台线程里起真实 HTTP 服务，httpx 以 --concurrency 并发压测，默认关闭结果缓存
+- 内存：各阶段结束时的进程峰值 RSS（ru_maxrss，单调不减）
+
+用法（仓库根目录）：
+    python scripts/bench_e2e.py --files 4 --size-kb 256 --json bench.json
+    python scripts/bench_e2e.py --backend numpy --concurrency 32 --requests 2000 --compare bench.json
+
+--compare 读取之前的 JSON，逐项打印变化百分比。
+"""
+import os
+import sys
+import csv
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS_ZH = (
+    "向量 检索 数据库 模型 文档 分块 索引 查询 相似度 召回 排序 缓存 并发 吞吐 延迟 "
+    "知识库 问答 嵌入 语义 关键字 文件 表格 段落 页面 服务 集群 节点 存储 压缩 量化"
+).split()
+WORDS_EN = (
+    "vector search index query latency throughput cache shard segment payload embedding "
+    "cluster node storage quantization recall ranking document chunk table page"
+).split()
+
+
+def peak_rss_mb() -> float:
+    # Linux 上 ru_maxrss 单位为 KB，macOS 为字节
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return ""
+
+
+def percentiles(values) -> dict:
+    a = np.asarray(values, dtype=np.float64)
+    if not len(a):
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    return {f"p{p}_ms": round(float(np.percentile(a, p)), 2) for p in (50, 95, 99)}
+
+
+# -------------------- 合成语料 --------------------
+def sentence(rng: random.Random) -> str:
+    n = rng.randint(6, 16)
+    words = [rng.choice(WORDS_ZH) if rng.random() < 0.7 else rng.choice(WORDS_EN) for _ in range(n)]
+    return "".join(w if w in WORDS_ZH else f" {w} " for w in words).strip() + "。"
+
+
+def paragraphs(rng: random.Random, size: int):
+    """产出段落直到累计约 size 字节（UTF-8）。"""
+    total = 0
+    while total < size:
+        p = "".join(sentence(rng) for _ in range(rng.randint(3, 8)))
+        total += len(p.encode("utf-8"))
+        yield p
+
+
+def write_pdf(path: str, rng: random.Random, size: int):
+    import fitz
+    doc = fitz.open()
+    buf = []
+
+    def flush():
+        if buf:
+            p = doc.new_page()
+            p.insert_textbox(fitz.Rect(40, 40, 555, 800), "\n".join(buf), fontname="china-s", fontsize=9)
+            buf.clear()
+
+    for para in paragraphs(rng, size):
+        buf.append(para)
+        if sum(len(b) for b in buf) > 1500:
+            flush()
+    flush()
+    doc.save(path)
+    doc.close()
+
+
+def write_docx(path: str, rng: random.Random, size: int):
+    import docx
+    doc = docx.Document()
+    for para in paragraphs(rng, size):
+        doc.add_paragraph(para)
+    doc.save(path)
+
+
+def write_csv(path: str, rng: random.Random, size: int):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["id", "name", "category", "score", "description"])
+        i = 0
+        while f.tell() < size:
+            w.writerow([i, rng.choice(WORDS_EN), rng.choice(WORDS_ZH), round(rng.random() * 100, 2), sentence(rng)])
+            i += 1
+
+
+def write_json(path: str, rng: random.Random, size: int):
+    records, total = [], 0
+    while total < size:
+        rec = {"id": len(records), "title": rng.choice(WORDS_ZH) + rng.choice(WORDS_ZH),
+               "tags": rng.sample(WORDS_EN, 3), "body": "".join(sentence(rng) for _ in range(rng.randint(2, 5)))}
+        total += len(json.dumps(rec, ensure_ascii=False).encode("utf-8"))
+        records.append(rec)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False)
+
+
+WRITERS = {"pdf": write_pdf, "docx": write_docx, "csv": write_csv, "json": write_json}
+
+
+def make_corpus(root: str, types, files: int, size_kb: int, seed: int):
+    out = {}
+    for ext in types:
+        paths = []
+        for i in range(files):
+            path = os.path.join(root, f"{ext}_{i:03d}.{ext}")
+            WRITERS[ext](path, random.Random(f"{seed}-{ext}-{i}"), size_kb * 1024)
+            paths.append(path)
+        out[ext] = paths
+    return out
+
+
+# -------------------- 各阶段 --------------------
+def bench_split(corpus, max_chars: int, overlap: float):
+    from app.file_loader import split_file
+    rows = {}
+    for ext, paths in corpus.items():
+        size = sum(os.path.getsize(p) for p in paths)
+        t0 = time.perf_counter()
+        chunks = sum(len(split_file(p, max_chars=max_chars, overlap_ratio=overlap)) for p in paths)
+        dt = time.perf_counter() - t0
+        rows[ext] = {
+            "files": len(paths), "bytes": size, "chunks": chunks, "seconds": round(dt, 3),
+            "mb_per_s": round(size / 2**20 / dt, 2) if dt else None,
+        }
+    return rows
+
+
+def bench_ingest(corpus, max_chars: int, overlap: float):
+    from app.config import QDRANT_COLLECTION
+    from app.embedder import get_embedder
+    from app.ingest import ingest_file
+    from app.vector_db import create_db
+
+    embedder, db = get_embedder(), create_db(QDRANT_COLLECTION)
+    db.ensure_schema()
+    rows = {}
+    for ext, paths in corpus.items():
+        t0 = time.perf_counter()
+        chunks = sum(ingest_file(p, os.path.basename(p), embedder, db, max_chars=max_chars, overlap_ratio=overlap)
+                     for p in paths)
+        dt = time.perf_counter() - t0
+        rows[ext] = {
+            "files": len(paths), "chunks": chunks, "seconds": round(dt, 3),
+            "chunks_per_s": round(chunks / dt, 1) if dt else None,
+        }
+    return rows
+
+
+def start_server(port: int):
+    import uvicorn
+    from app.main import app
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    threading.Thread(target=server.run, name="uvicorn", daemon=True).start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("uvicorn 启动超时")
+        time.sleep(0.05)
+    return server
+
+
+async def _load(url: str, queries, concurrency: int, body: dict):
+    import httpx
+    latencies, errors = [], 0
+    it = iter(queries)
+    async with httpx.AsyncClient(base_url=url, timeout=60,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def worker():
+            nonlocal errors
+            for q in it:
+                t0 = time.perf_counter()
+                r = await client.post("/search", json={**body, "query": q})
+                latencies.append((time.perf_counter() - t0) * 1000)
+                errors += r.status_code != 200
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - t0
+    return latencies, errors, wall
+
+
+def bench_search(port: int, requests: int, concurrency: int, top_k: int, mode: str, seed: int, warmup: int):
+    rng = random.Random(seed)
+    # 随机组合查询词，基本不重复（结果缓存另行关闭）
+    queries = [" ".join(rng.sample(WORDS_ZH + WORDS_EN, rng.randint(1, 3))) for _ in range(requests + warmup)]
+    server = start_server(port)
+    try:
+        url = f"http://127.0.0.1:{port}"
+        body = {"top_k": top_k, "mode": mode}
+        asyncio.run(_load(url, queries[:warmup], concurrency, body))
+        latencies, errors, wall = asyncio.run(_load(url, queries[warmup:], concurrency, body))
+    finally:
+        server.should_exit = True
+    return {
+        "mode": mode, "requests": len(latencies), "concurrency": concurrency, "errors": errors,
+        "seconds": round(wall, 3), "qps": round(len(latencies) / wall, 1) if wall else None,
+        **percentiles(latencies),
+    }
+
+
+# -------------------- 对比 --------------------
+def _flatten(d, prefix=""):
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            yield from _flatten(v, key + ".")
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            yield key, v
+
+
+def compare(old: dict, new: dict):
+    before = dict(_flatten({k: old.get(k, {}) for k in ("split", "ingest", "search")}))
+    after = dict(_flatten({k: new.get(k, {}) for k in ("split", "ingest", "search")}))
+    before["peak_rss_mb"], after["peak_rss_mb"] = old.get("peak_rss_mb"), new.get("peak_rss_mb")
+    print(f"\ncompare with {old.get('commit') or '?'} → {new.get('commit') or '?'}")
+    for key in sorted(after):
+        a, b = before.get(key), after[key]
+        if a is None or b is None or key.endswith((".files", ".bytes", ".requests", ".concurrency")):
+            continue
+        delta = f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+        print(f"  {key:<32}{a:>12g}{b:>12g}{delta:>10}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="端到端基准：split_file / 入库 / 并发检索")
+    ap.add_argument("--types", default="pdf,docx,csv,json")
+    ap.add_argument("--files", type=int, default=4, help="每种类型的文件数")
+    ap.add_argument("--size-kb", type=int, default=256, help="每个文件的目标大小")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--max-chars", type=int, default=500)
+    ap.add_argument("--overlap", type=float, default=0.2)
+    ap.add_argument("--backend", choices=("qdrant", "numpy"), default="qdrant")
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--latency-ms", type=float, default=5.0, help="fake ollama 每请求延迟")
+    ap.add_argument("--per-item-ms", type=float, default=0.2, help="fake ollama 每条文本延迟")
+    ap.add_argument("--ollama-parallel", type=int, default=0, help="fake ollama 同时处理的请求数，0 不限")
+    ap.add_argument("--requests", type=int, default=500)
+    ap.add_argument("--warmup", type=int, default=20)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--top-k", type=int, default=10)
+    ap.add_argument("--mode", default="vector", help="检索模式 vector / hybrid / keyword")
+    ap.add_argument("--port", type=int, default=18080)
+    ap.add_argument("--search-cache", action="store_true", help="保留 /search 结果缓存（默认关闭）")
+    ap.add_argument("--workdir", default="", help="语料与数据目录（默认临时目录，结束后保留路径打印出来）")
+    ap.add_argument("--json", default="", help="结果写入该文件")
+    ap.add_argument("--compare", default="", help="与之前的结果 JSON 对比")
+    ap.add_argument("--label", default="")
+    ap.add_argument("--log-level", default="WARNING", help="应用日志级别（默认 WARNING，避免逐请求日志影响计时）")
+    args = ap.parse_args(argv)
+
+    # 先于 app.main 配置根 logger，app 里的 basicConfig 不再生效
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    from fake_ollama import start as start_fake_ollama
+
+    work = args.workdir or tempfile.mkdtemp(prefix="bench_e2e_")
+    corpus_dir, data_dir = os.path.join(work, "corpus"), os.path.join(work, "data")
+    os.makedirs(corpus_dir, exist_ok=True)
+    fake = start_fake_ollama(dim=args.dim, latency_ms=args.latency_ms, per_item_ms=args.per_item_ms,
+                             parallel=args.ollama_parallel)
+
+    # app.config 在导入时读环境变量，必须先设置好再导入 app 模块
+    os.environ.update({
+        "OLLAMA_BASE_URL": f"http://127.0.0.1:{fake.server_address[1]}",
+        "EMBEDDING_DIM": str(args.dim),
+        "VECTOR_BACKEND": args.backend,
+        "QDRANT_URL": ":memory:",
+        "DATA_DIR": data_dir,
+        "CACHE_DIR": os.path.join(data_dir, "cache"),
+        "CACHE_BACKEND": "memory",
+    })
+    if not args.search_cache:
+        os.environ["SEARCH_CACHE_SIZE"] = "0"
+
+    types = [t.strip() for t in args.types.split(",") if t.strip()]
+    unknown = set(types) - set(WRITERS)
+    if unknown:
+        ap.error(f"不支持的类型: {','.join(sorted(unknown))}（可选 {','.join(WRITERS)}）")
+
+    result = {
+        "label": args.label, "commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("json", "compare", "workdir")},
+    }
+    t0 = time.perf_counter()
+    corpus = make_corpus(corpus_dir, types, args.files, args.size_kb, args.seed)
+    result["corpus_seconds"] = round(time.perf_counter() - t0, 2)
+    print(f"corpus: {work} ({result['corpus_seconds']}s)")
+
+    result["split"] = bench_split(corpus, args.max_chars, args.overlap)
+    result["rss_after_split_mb"] = peak_rss_mb()
+    for ext, r in result["split"].items():
+        print(f"split  {ext:<5} {r['chunks']:>7} chunks {r['mb_per_s']:>8} MB/s")
+
+    result["ingest"] = bench_ingest(corpus, args.max_chars, args.overlap)
+    result["rss_after_ingest_mb"] = peak_rss_mb()
+    result["embedding_requests"] = fake.stats()
+    for ext, r in result["ingest"].items():
+        print(f"ingest {ext:<5} {r['chunks']:>7} chunks {r['chunks_per_s']:>8} chunks/s")
+
+    result["search"] = bench_search(args.port, args.requests, args.concurrency, args.top_k, args.mode,
+                                    args.seed, args.warmup)
+    result["peak_rss_mb"] = peak_rss_mb()
+    s = result["search"]
+    print(f"search {s['mode']} c={s['concurrency']} n={s['requests']} qps={s['qps']} "
+          f"p50={s['p50_ms']}ms p95={s['p95_ms']}ms p99={s['p99_ms']}ms errors={s['errors']}")
+    print(f"peak RSS {result['peak_rss_mb']} MB")
+    fake.shutdown()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), result)
+    return 1 if s["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+embedding 节点池基准：进程内启动多个 fake_ollama，验证吞吐随节点数扩展、以及节点宕机 / 变慢时的切换。
+
+- scale：节点数从 1 到 --hosts，各跑一次 Embedder.embed（同步入库路径）与 aembed（异步路径），记录 texts/s
+- failover：--hosts 个节点同时工作，跑到一半时第一个节点宕机（全部返回 503）、第二个节点延迟放大 --slow-x 倍，
+  要求全部文本仍然成功，并报告重试次数、剔除原因、各节点承接的请求数
+
+每个 fake 节点 --parallel 个并发槽（模拟 OLLAMA_NUM_PARALLEL），所以单节点吞吐有上限，多节点时才能看出线性扩展。
+
+用法（仓库根目录）：
+    PYTHONPATH=. python scripts/bench_embed_pool.py --hosts 4 --texts 4000 --latency-ms 20 --json pool.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_texts(n: int, tag: str) -> list:
+    return [f"{tag} 文本 {i} vector embedding pool benchmark" for i in range(n)]
+
+
+def run_scale(fakes, args) -> list:
+    from app.embedder import Embedder
+
+    rows = []
+    for n in range(1, len(fakes) + 1):
+        os.environ["OLLAMA_BASE_URL"] = ",".join(f"http://127.0.0.1:{f.server_address[1]}" for f in fakes[:n])
+        emb = Embedder()
+        t0 = time.perf_counter()
+        emb.embed(make_texts(args.texts, f"sync{n}"))
+        sync_s = time.perf_counter() - t0
+
+        async def run_async():
+            t0 = time.perf_counter()
+            await emb.aembed(make_texts(args.texts, f"async{n}"))
+            dt = time.perf_counter() - t0
+            await emb.aclose()
+            return dt
+
+        async_s = asyncio.run(run_async())
+        emb.close()
+        row = {"hosts": n, "sync_texts_per_s": round(args.texts / sync_s), "async_texts_per_s": round(args.texts / async_s)}
+        rows.append(row)
+        print(f"scale  hosts={n}  sync {row['sync_texts_per_s']:>7} texts/s  async {row['async_texts_per_s']:>7} texts/s")
+    return rows
+
+
+def run_failover(fakes, args) -> dict:
+    from app import metrics
+    from app.embedder import Embedder
+
+    os.environ["OLLAMA_BASE_URL"] = ",".join(f"http://127.0.0.1:{f.server_address[1]}" for f in fakes)
+    emb = Embedder()
+    before = [f.stats()["requests"] for f in fakes]
+    texts = make_texts(args.texts, "failover")
+
+    def degrade():
+        time.sleep(args.fail_after)
+        fakes[0].down = True
+        if len(fakes) > 2:
+            fakes[1].latency_ms *= args.slow_x
+
+    threading.Thread(target=degrade, daemon=True).start()
+    t0 = time.perf_counter()
+    vecs = emb.embed(texts)
+    dt = time.perf_counter() - t0
+    counters, _ = metrics.registry.collect()
+    result = {
+        "texts": len(vecs),
+        "texts_per_s": round(len(vecs) / dt),
+        "retries": sum(v for (n, _), v in counters.items() if n == "vqa_embed_retries_total"),
+        "ejections": {dict(labels)["host"] + " " + dict(labels)["reason"]: v
+                      for (n, labels), v in counters.items() if n == "vqa_embed_ejections_total"},
+        "host_requests": [f.stats()["requests"] - b for f, b in zip(fakes, before)],
+        "pool": emb.hosts.stats(),
+    }
+    emb.close()
+    print(f"failover {result['texts']} texts ok, {result['texts_per_s']} texts/s, retries={result['retries']:.0f}")
+    print(f"  requests per host: {result['host_requests']}")
+    for k, v in result["ejections"].items():
+        print(f"  ejected {k} x{v:.0f}")
+    return result
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="embedding 节点池吞吐与故障切换基准")
+    ap.add_argument("--hosts", type=int, default=4, help="fake_ollama 节点数")
+    ap.add_argument("--texts", type=int, default=4000, help="每轮向量化的文本数")
+    ap.add_argument("--dim", type=int, default=64)
+    ap.add_argument("--latency-ms", type=float, default=20.0, help="每个请求的固定延迟")
+    ap.add_argument("--per-item-ms", type=float, default=0.2, help="每条文本追加的延迟")
+    ap.add_argument("--parallel", type=int, default=2, help="每个节点同时处理的请求数")
+    ap.add_argument("--fail-after", type=float, default=0.5, help="failover 场景开始多少秒后让节点宕机 / 变慢")
+    ap.add_argument("--slow-x", type=float, default=10.0, help="变慢节点的延迟倍数")
+    ap.add_argument("--json", default="", help="结果写入该文件")
+    args = ap.parse_args(argv)
+
+    # app.config 在导入时读环境变量：关掉持久化存储与缓存，每次都真正请求节点；剔除 / 探活周期缩短到基准的时间尺度
+    os.environ.update({
+        "EMBED_STORE": "0", "QUERY_CACHE_SIZE": "0", "METRICS_DIR": os.path.join("/tmp", f"bench_pool_{os.getpid()}"),
+        "EMBED_HEALTH_INTERVAL": os.environ.get("EMBED_HEALTH_INTERVAL", "0.5"),
+        "EMBED_EJECT_SECONDS": os.environ.get("EMBED_EJECT_SECONDS", "5"),
+    })
+    from fake_ollama import start as start_fake_ollama
+
+    fakes = [start_fake_ollama(dim=args.dim, latency_ms=args.latency_ms, per_item_ms=args.per_item_ms,
+                               parallel=args.parallel) for _ in range(args.hosts)]
+    result = {"params": vars(args), "scale": run_scale(fakes, args), "failover": run_failover(fakes, args)}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""
+量化方案对比：在自己的数据上测 recall@k / 延迟 / 向量内存。
+
+从现有集合抽样 N 个点的向量，按每种量化方式（none / int8 / binary）各建一个临时集合写入，
+另取 Q 个未写入的向量作查询（或 --queries-file 给出真实查询文本，用 Embedder 向量化），
+以 numpy 精确余弦 top-k 为标准答案，遍历 oversampling × rescore 组合计时。
+
+用法（仓库根目录）：
+    PYTHONPATH=. python scripts/bench_quantization.py --limit 20000 --queries 200 --top-k 10
+    PYTHONPATH=. python scripts/bench_quantization.py --modes int8,binary --oversampling 1,2,4 --json out.json
+
+内存为估算值：none 为 N*dim*4 常驻内存；int8 / binary 的量化向量常驻内存（N*dim / N*dim/8），
+原始向量放磁盘（N*dim*4）；不含 HNSW 图与 payload。
+"""
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+from qdrant_client.http.models import (
+    VectorParams, Distance, PointStruct, SearchParams, QuantizationSearchParams,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    BinaryQuantization, BinaryQuantizationConfig,
+)
+
+from app.config import QDRANT_COLLECTION
+from app.qdrant_client import client
+
+
+def quantization_config(mode):
+    if mode == "int8":
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True))
+    if mode == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    return None
+
+
+def sample_vectors(collection, limit):
+    vecs, offset = [], None
+    while len(vecs) < limit:
+        pts, offset = client.scroll(
+            collection_name=collection,
+            limit=min(1000, limit - len(vecs)),
+            with_payload=False,
+            with_vectors=True,
+            offset=offset,
+        )
+        vecs.extend(p.vector for p in pts if p.vector)
+        if offset is None:
+            break
+    return np.asarray(vecs, dtype=np.float32)
+
+
+def normalize(m):
+    return m / np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+
+
+def exact_topk(base, queries, k):
+    scores = normalize(queries) @ normalize(base).T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row.tolist()) for row in top]
+
+
+def build_collection(name, mode, base, batch=512):
+    if client.collection_exists(name):
+        client.delete_collection(name)
+    client.create_collection(
+        collection_name=name,
+        vectors_config=VectorParams(size=base.shape[1], distance=Distance.COSINE, on_disk=mode != "none"),
+        quantization_config=quantization_config(mode),
+    )
+    for i in range(0, len(base), batch):
+        client.upsert(
+            collection_name=name,
+            points=[PointStruct(id=i + j, vector=v.tolist()) for j, v in enumerate(base[i : i + batch])],
+            wait=True,
+        )
+    # 等索引 / 量化数据建完再测
+    while str(client.get_collection(name).status).lower().endswith("yellow"):
+        time.sleep(1)
+
+
+def run_queries(name, queries, k, oversampling, rescore, mode):
+    params = None
+    if mode != "none":
+        params = SearchParams(quantization=QuantizationSearchParams(rescore=rescore, oversampling=oversampling))
+    latencies, results = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        pts = client.query_points(
+            collection_name=name, query=q.tolist(), limit=k, with_payload=False, search_params=params,
+        ).points
+        latencies.append((time.perf_counter() - t0) * 1000)
+        results.append({int(p.id) for p in pts})
+    return latencies, results
+
+
+def memory_estimate(mode, n, dim):
+    if mode == "int8":
+        return {"ram_vectors_bytes": n * dim, "disk_vectors_bytes": n * dim * 4}
+    if mode == "binary":
+        return {"ram_vectors_bytes": n * ((dim + 7) // 8), "disk_vectors_bytes": n * dim * 4}
+    return {"ram_vectors_bytes": n * dim * 4, "disk_vectors_bytes": 0}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="量化 recall@k / 延迟 / 内存对比")
+    ap.add_argument("--source", default=QDRANT_COLLECTION, help="抽样向量的集合")
+    ap.add_argument("--limit", type=int, default=20000, help="写入临时集合的向量数")
+    ap.add_argument("--queries", type=int, default=200, help="查询数（从抽样中留出，不写入）")
+    ap.add_argument("--queries-file", default="", help="每行一条查询文本，用 Embedder 向量化")
+    ap.add_argument("--top-k", type=int, default=10)
+    ap.add_argument("--modes", default="none,int8,binary")
+    ap.add_argument("--oversampling", default="1,2,4")
+    ap.add_argument("--json", default="", help="结果另存为 JSON")
+    ap.add_argument("--keep", action="store_true", help="保留临时集合")
+    args = ap.parse_args(argv)
+
+    k = args.top_k
+    if args.queries_file:
+        from app.embedder import get_embedder
+        with open(args.queries_file, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        queries = np.asarray(get_embedder().embed(texts), dtype=np.float32)
+        base = sample_vectors(args.source, args.limit)
+    else:
+        sample = sample_vectors(args.source, args.limit + args.queries)
+        rng = np.random.default_rng(0)
+        rng.shuffle(sample)
+        queries, base = sample[: args.queries], sample[args.queries :]
+    if len(base) < k or not len(queries):
+        print(f"集合 {args.source} 中的向量不足（base={len(base)} queries={len(queries)}）")
+        return 1
+    n, dim = base.shape
+    print(f"base={n} queries={len(queries)} dim={dim} top_k={k}")
+
+    truth = exact_topk(base, queries, k)
+    rows = []
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        name = f"{args.source}__bench_{mode}"
+        t0 = time.perf_counter()
+        build_collection(name, mode, base)
+        build_s = time.perf_counter() - t0
+        combos = [(1.0, False)] if mode == "none" else [
+            (float(o), r) for o in args.oversampling.split(",") for r in (True, False)
+        ]
+        try:
+            for oversampling, rescore in combos:
+                lat, res = run_queries(name, queries, k, oversampling, rescore, mode)
+                recall = float(np.mean([len(r & t) / k for r, t in zip(res, truth)]))
+                lat = np.asarray(lat)
+                rows.append({
+                    "mode": mode,
+                    "oversampling": oversampling,
+                    "rescore": rescore,
+                    f"recall@{k}": round(recall, 4),
+                    "p50_ms": round(float(np.percentile(lat, 50)), 2),
+                    "p95_ms": round(float(np.percentile(lat, 95)), 2),
+                    "build_s": round(build_s, 1),
+                    **memory_estimate(mode, n, dim),
+                })
+        finally:
+            if not args.keep:
+                client.delete_collection(name)
+
+    header = f"{'mode':<7}{'overs':>6}{'rescore':>9}{'recall@' + str(k):>11}{'p50ms':>8}{'p95ms':>8}{'ramMB':>9}{'diskMB':>9}"
+    print(header)
+    for r in rows:
+        print(f"{r['mode']:<7}{r['oversampling']:>6g}{str(r['rescore']):>9}{r[f'recall@{k}']:>11.4f}"
+              f"{r['p50_ms']:>8.2f}{r['p95_ms']:>8.2f}"
+              f"{r['ram_vectors_bytes'] / 2**20:>9.1f}{r['disk_vectors_bytes'] / 2**20:>9.1f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"base": n, "queries": len(queries), "dim": dim, "top_k": k, "results": rows},
+                      f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
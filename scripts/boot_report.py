@@ -0,0 +1,161 @@
+"""
+API worker 启动报告：导入耗时、RSS、加载了哪些重依赖，以及 fork 多个 worker 时每个 worker 的私有内存。
+
+- import：每个场景起一个全新解释器导入 app.main，记录导入耗时、导入后 RSS、已加载的重依赖
+    lazy    只导入 app.main（解析器按需加载，等同只服务 /search 的 worker）
+    eager   导入 app.main 后再加载全部解析器（等同处理过各类文件的 worker / 旧版的行为）
+- importtime：python -X importtime 导入 app.main，按累计耗时列出最慢的模块
+- fork：模拟 gunicorn 起 --workers 个 worker，读 /proc/<pid>/smaps_rollup 的 USS / PSS
+    per-worker  主进程不导入应用，每个 worker fork 后自己导入 app.main + 全部解析器（PRELOAD=0）
+    preload     主进程导入 app.main + 全部解析器并 gc.freeze() 后再 fork（PRELOAD=1）
+
+用法（仓库根目录）：
+    PYTHONPATH=. python scripts/boot_report.py --workers 4 --json boot.json
+不连接 Qdrant / Ollama（连接都是按需创建的）；fork 场景只支持 Linux。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+HEAVY = ("pandas", "fitz", "docx", "openpyxl", "PIL", "qdrant_client", "numpy", "fastapi")
+
+_PROBE = r"""
+import gc, json, os, sys, time
+t0 = time.perf_counter()
+import app.main
+if {eager}:
+    from app.parsers import preload
+    preload()
+dt = time.perf_counter() - t0
+gc.collect()
+print(json.dumps({{"import_s": round(dt, 3), "rss_mb": rss_mb(),
+                  "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+_FORK = r"""
+import gc, json, os, sys, time
+
+def load():
+    import app.main
+    from app.parsers import preload
+    preload()
+    gc.collect()
+
+if {preload}:
+    load()
+    gc.freeze()
+r, w = os.pipe()
+pids = []
+for _ in range({workers}):
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        if not {preload}:
+            load()
+        # 模拟 worker 运行一段时间：完整 GC 一次，会触碰所有仍被跟踪的对象
+        gc.collect()
+        os.write(w, json.dumps(smaps()).encode() + b"\n")
+        time.sleep(2)
+        os._exit(0)
+    pids.append(pid)
+os.close(w)
+with os.fdopen(r) as f:
+    rows = [json.loads(line) for line in f]
+for pid in pids:
+    os.waitpid(pid, 0)
+print(json.dumps(rows))
+"""
+
+_HELPERS = r"""
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    import resource
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def smaps():
+    out = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].rstrip(":") in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                out[parts[0].rstrip(":")] = int(parts[1])
+    return {"rss_mb": round(out["Rss"] / 1024, 1), "pss_mb": round(out["Pss"] / 1024, 1),
+            "uss_mb": round((out["Private_Clean"] + out["Private_Dirty"]) / 1024, 1)}
+"""
+
+
+def run_python(code: str, *args: str) -> subprocess.CompletedProcess:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")]))}
+    return subprocess.run([sys.executable, *args, "-c", _HELPERS + code], capture_output=True, text=True,
+                          env=env, check=True)
+
+
+def import_report(eager: bool, repeat: int) -> dict:
+    runs = [json.loads(run_python(_PROBE.format(eager=eager, heavy=HEAVY)).stdout.strip().splitlines()[-1])
+            for _ in range(repeat)]
+    best = min(runs, key=lambda r: r["import_s"])
+    return {**best, "import_s_all": [r["import_s"] for r in runs]}
+
+
+def importtime_report(top: int) -> list:
+    err = run_python("import app.main", "-X", "importtime").stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cum_us, name = line[len("import time:"):].split("|")
+        rows.append({"module": name.strip(), "cumulative_ms": round(int(cum_us) / 1000, 1)})
+    # 只保留顶层包，避免同一依赖的子模块刷屏
+    rows = [r for r in rows if "." not in r["module"] or r["module"].startswith("app.")]
+    return sorted(rows, key=lambda r: r["cumulative_ms"], reverse=True)[:top]
+
+
+def fork_report(workers: int, preload: bool) -> dict:
+    rows = json.loads(run_python(_FORK.format(workers=workers, preload=preload)).stdout.strip().splitlines()[-1])
+    return {
+        "workers": rows,
+        "uss_mb_total": round(sum(r["uss_mb"] for r in rows), 1),
+        "pss_mb_total": round(sum(r["pss_mb"] for r in rows), 1),
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="API worker 启动耗时与内存报告")
+    ap.add_argument("--repeat", type=int, default=3, help="每个导入场景跑几次（取最快一次）")
+    ap.add_argument("--top", type=int, default=15, help="importtime 列出的模块数")
+    ap.add_argument("--workers", type=int, default=4, help="fork 场景的 worker 数，0 跳过")
+    ap.add_argument("--json", default="", help="结果写入该文件")
+    args = ap.parse_args(argv)
+
+    report = {"python": sys.version.split()[0], "started_at": time.time(), "import": {}, "fork": {}}
+    for name, eager in (("lazy", False), ("eager", True)):
+        r = report["import"][name] = import_report(eager, args.repeat)
+        print(f"import {name:<6} {r['import_s']:.3f}s  rss={r['rss_mb']}MB  loaded={','.join(r['loaded'])}")
+
+    report["importtime"] = importtime_report(args.top)
+    print("slowest imports (app.main, cumulative):")
+    for r in report["importtime"]:
+        print(f"  {r['cumulative_ms']:>8.1f} ms  {r['module']}")
+
+    if args.workers > 0 and sys.platform.startswith("linux"):
+        for name, preload in (("per-worker", False), ("preload", True)):
+            r = report["fork"][name] = fork_report(args.workers, preload)
+            print(f"fork {name:<10} workers={args.workers} USS total={r['uss_mb_total']}MB "
+                  f"PSS total={r['pss_mb_total']}MB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
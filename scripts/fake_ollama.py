@@ -0,0 +1,141 @@
+"""
+本地 Ollama 替身：实现 /api/embed（input 为字符串或列表）与旧版 /api/embeddings（prompt），
+向量由文本 sha256 决定（同一文本永远得到同一向量），可配置固定延迟与按条延迟，用于压测 / CI。
+--parallel N 限制同时处理的请求数（真实 Ollama 按 OLLAMA_NUM_PARALLEL 串行处理，多出的请求排队），0 不限。
+--fail-rate 让一部分 embed 请求返回 500；进程内启动时可把 server.down 设为 True 模拟节点宕机（所有请求返回 503），
+latency_ms 也可在运行中修改以模拟节点变慢。
+
+用法（仓库根目录）：
+    python scripts/fake_ollama.py --port 11434 --dim 1024 --latency-ms 20 --per-item-ms 0.5
+    OLLAMA_BASE_URL=http://127.0.0.1:11434 EMBEDDING_DIM=1024 uvicorn app.main:app
+
+也可在进程内启动：
+    from scripts.fake_ollama import start
+    server = start(port=0, dim=64)      # server.server_address[1] 为实际端口
+"""
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+
+def fake_vector(text: str, dim: int) -> list:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (v / max(float(np.linalg.norm(v)), 1e-12)).tolist()
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, dim: int, latency_ms: float = 0.0, per_item_ms: float = 0.0, parallel: int = 0,
+                 fail_rate: float = 0.0):
+        super().__init__(addr, _Handler)
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.per_item_ms = per_item_ms
+        self.slots = threading.BoundedSemaphore(parallel) if parallel > 0 else None
+        self.fail_rate = fail_rate
+        self.down = False
+        self.requests = 0
+        self.items = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "items": self.items, "failed": self.failed}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive，和真实 Ollama 一样复用连接
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.server.down:
+            self._send(503, {"error": "down"})
+        elif self.path in ("/api/version", "/"):
+            self._send(200, {"version": "fake", **self.server.stats()})
+        elif self.path == "/api/tags":
+            self._send(200, {"models": [{"name": "fake"}]})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        srv: FakeOllamaServer = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if self.path == "/api/embed":
+            inputs = body.get("input", "")
+            inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+        elif self.path == "/api/embeddings":
+            inputs = [body.get("prompt", "")]
+        else:
+            self._send(404, {"error": "not found"})
+            return
+        if srv.down or (srv.fail_rate > 0 and random.random() < srv.fail_rate):
+            with srv._lock:
+                srv.failed += 1
+            self._send(503 if srv.down else 500, {"error": "down" if srv.down else "injected failure"})
+            return
+        with srv._lock:
+            srv.requests += 1
+            srv.items += len(inputs)
+        delay = srv.latency_ms + srv.per_item_ms * len(inputs)
+        if delay > 0:
+            if srv.slots is None:
+                time.sleep(delay / 1000.0)
+            else:
+                with srv.slots:
+                    time.sleep(delay / 1000.0)
+        vecs = [fake_vector(t, srv.dim) for t in inputs]
+        if self.path == "/api/embed":
+            self._send(200, {"model": body.get("model", ""), "embeddings": vecs})
+        else:
+            self._send(200, {"embedding": vecs[0]})
+
+
+def start(port: int = 0, dim: int = 1024, latency_ms: float = 0.0, per_item_ms: float = 0.0,
+          host: str = "127.0.0.1", parallel: int = 0, fail_rate: float = 0.0) -> FakeOllamaServer:
+    """后台线程启动，返回 server；port=0 时由系统分配端口。"""
+    server = FakeOllamaServer((host, port), dim, latency_ms, per_item_ms, parallel, fail_rate)
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="本地 Ollama embedding 替身")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11434)
+    ap.add_argument("--dim", type=int, default=1024)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="每个请求的固定延迟")
+    ap.add_argument("--per-item-ms", type=float, default=0.0, help="每条文本追加的延迟")
+    ap.add_argument("--parallel", type=int, default=0, help="同时处理的请求数上限，0 不限")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="embed 请求返回 500 的比例")
+    args = ap.parse_args(argv)
+    server = FakeOllamaServer((args.host, args.port), args.dim, args.latency_ms, args.per_item_ms, args.parallel,
+                              args.fail_rate)
+    print(f"fake ollama on http://{args.host}:{server.server_address[1]} dim={args.dim}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,15 @@
-import sys
+"""
+兼容旧入口：等价于 python -m app.bulk_ingest（支持 split_file 的全部类型，可传多个文件或目录）。
+
+用法（仓库根目录）：
+    python scripts/ingest_pdf.py path/to/your.pdf [更多文件或目录...]
+"""
 import os
-from app.pdf_loader import load_and_split_pdf
-from app.embedder import DeepSeekEmbedder
-from app.qdrant_client import add_texts, init_collection
+import sys
 
-def ingest(pdf_path):
-    print(f"Loading PDF: {pdf_path}")
-    chunks = load_and_split_pdf(pdf_path)
-    print(f"Chunked into {len(chunks)} segments.")
-    embedder = DeepSeekEmbedder()
-    embeddings = embedder.embed(chunks)
-    print(f"Embeddings obtained. Uploading to Qdrant...")
-    init_collection()
-    add_texts(chunks, embeddings)
-    print("Upload done.")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python scripts/ingest_pdf.py path/to/your.pdf")
-        sys.exit(1)
-    ingest(sys.argv[1])
+from app.bulk_ingest import main
 
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,10 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+# app.config 在导入时读取环境变量：测试不落持久化存储、不写指标快照
+os.environ.setdefault("EMBED_STORE", "0")
+os.environ.setdefault("METRICS", "0")
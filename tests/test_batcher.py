@@ -0,0 +1,100 @@
+"""
+异步微批：大量并发提交都能拿到结果，排队满时拒绝，关闭时排队中的等待者收到异常。
+"""
+import asyncio
+import random
+
+import pytest
+
+from app.batcher import MicroBatcher, Overloaded
+
+
+def test_every_submit_resolves_with_tiny_max_wait():
+    async def fn(items):
+        await asyncio.sleep(random.random() * 0.001)
+        return [x * 2 for x in items]
+
+    async def main():
+        b = MicroBatcher(fn, max_batch=8, max_wait=0.0003, max_queue=10000, max_inflight=2)
+
+        async def one(i):
+            await asyncio.sleep(random.random() * 0.01)
+            return await b.submit(i, i)
+
+        try:
+            return await asyncio.wait_for(asyncio.gather(*(one(i) for i in range(5000))), 30)
+        finally:
+            await b.aclose()
+
+    assert asyncio.run(main()) == [i * 2 for i in range(5000)]
+
+
+def test_same_key_in_batch_computed_once():
+    seen = []
+
+    async def fn(items):
+        seen.append(list(items))
+        return [x.upper() for x in items]
+
+    async def main():
+        b = MicroBatcher(fn, max_batch=16, max_wait=0.01)
+        try:
+            return await asyncio.gather(*(b.submit(k, k) for k in ["a", "b", "a", "a"]))
+        finally:
+            await b.aclose()
+
+    assert asyncio.run(main()) == ["A", "B", "A", "A"]
+    assert seen == [["a", "b"]]
+
+
+def test_full_queue_raises_overloaded():
+    release = None
+
+    async def fn(items):
+        await release.wait()
+        return items
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        b = MicroBatcher(fn, max_batch=1, max_wait=0, max_queue=2, max_inflight=1)
+        # 第一条在途、第二条已取出等在途名额，其后两条占满队列
+        waiters = []
+        for i in range(4):
+            waiters.append(asyncio.ensure_future(b.submit(i, i)))
+            await asyncio.sleep(0.01)
+        with pytest.raises(Overloaded):
+            await b.submit(99, 99)
+        release.set()
+        try:
+            return await asyncio.wait_for(asyncio.gather(*waiters), 5)
+        finally:
+            await b.aclose()
+
+    assert asyncio.run(main()) == [0, 1, 2, 3]
+
+
+def test_aclose_fails_pending_waiters():
+    release = None
+
+    async def fn(items):
+        await release.wait()
+        return items
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        b = MicroBatcher(fn, max_batch=1, max_wait=0, max_queue=8, max_inflight=1)
+        waiters = []
+        for i in range(4):
+            waiters.append(asyncio.ensure_future(b.submit(i, i)))
+            await asyncio.sleep(0.01)
+        closing = asyncio.ensure_future(b.aclose())
+        await asyncio.sleep(0.01)
+        release.set()     # 在途批次正常完成，aclose 等它结束
+        await asyncio.wait_for(closing, 5)
+        return await asyncio.wait_for(asyncio.gather(*waiters, return_exceptions=True), 5)
+
+    results = asyncio.run(main())
+    assert results[0] == 0
+    assert all(isinstance(r, Overloaded) for r in results[1:])
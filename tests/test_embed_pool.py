@@ -0,0 +1,105 @@
+"""
+embedding 节点池：进程内启动几个 fake_ollama，检查选择、换节点重试、剔除与探活恢复。
+"""
+import time
+
+import httpx
+import pytest
+
+from fake_ollama import fake_vector, start
+
+from app.embed_pool import EndpointPool, is_host_fault
+from app.embedder import Embedder
+
+DIM = 16
+
+
+def _url(server) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def make(**kw):
+        srv = start(port=0, dim=DIM, **kw)
+        started.append(srv)
+        return srv
+
+    yield make
+    for srv in started:
+        srv.shutdown()
+        srv.server_close()
+
+
+def _embedder(monkeypatch, servers, **pool_kw) -> Embedder:
+    monkeypatch.setenv("OLLAMA_BASE_URL", ",".join(_url(s) for s in servers))
+    emb = Embedder()
+    emb.hosts = EndpointPool([_url(s) for s in servers], **pool_kw)
+    return emb
+
+
+def _host(emb: Embedder, server) -> dict:
+    return next(h for h in emb.hosts.stats()["hosts"] if h["url"] == _url(server))
+
+
+def test_acquire_prefers_least_outstanding():
+    pool = EndpointPool(["http://a", "http://b", "http://c"], health_interval=0)
+    first = [pool.acquire() for _ in range(3)]
+    assert sorted(e.url for e in first) == ["http://a", "http://b", "http://c"]
+
+    pool.release(first[1], 0.01)
+    assert pool.acquire() is first[1]
+
+
+def test_retry_moves_to_healthy_host_and_ejects_bad_ones(monkeypatch, servers):
+    down, flaky, healthy = servers(), servers(fail_rate=1.0), servers()
+    down.down = True
+    emb = _embedder(monkeypatch, [down, flaky, healthy],
+                    retries=2, eject_failures=1, eject_seconds=60, health_interval=0)
+    try:
+        texts = ["第一条", "second"]
+        assert emb._embed_batch(texts) == [pytest.approx(fake_vector(t, DIM)) for t in texts]
+
+        # 两个坏节点各失败一次即被剔除，之后直接走健康节点
+        assert _host(emb, down)["eject_reason"] == "error"
+        assert _host(emb, flaky)["eject_reason"] == "error"
+        assert emb.hosts.stats()["healthy"] == 1
+        for _ in range(5):
+            emb._embed_batch(["again"])
+        assert healthy.stats()["requests"] == 6
+        assert down.stats()["failed"] == 1 and flaky.stats()["failed"] == 1
+    finally:
+        emb.close()
+
+
+def test_only_host_faults_are_retried():
+    req = httpx.Request("POST", "http://a/api/embed")
+    assert is_host_fault(httpx.ConnectError("refused", request=req))
+    assert is_host_fault(httpx.HTTPStatusError("503", request=req, response=httpx.Response(503, request=req)))
+    assert is_host_fault(ValueError("embedding 数量不匹配"))
+    assert not is_host_fault(httpx.HTTPStatusError("400", request=req, response=httpx.Response(400, request=req)))
+
+
+def test_probe_readmits_recovered_host(monkeypatch, servers):
+    flapping, healthy = servers(), servers()
+    flapping.down = True
+    emb = _embedder(monkeypatch, [flapping, healthy],
+                    retries=1, eject_failures=1, eject_seconds=60, health_interval=0.05)
+    try:
+        emb._embed_batch(["x"])
+        assert not _host(emb, flapping)["healthy"]
+
+        flapping.down = False
+        deadline = time.monotonic() + 5
+        while not _host(emb, flapping)["healthy"] and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert _host(emb, flapping)["healthy"]
+
+        # 恢复后重新参与分配（两个节点都空闲时按顺序先选它）
+        before = flapping.stats()["requests"]
+        emb._embed_batch(["y"])
+        assert flapping.stats()["requests"] == before + 1
+    finally:
+        emb.close()
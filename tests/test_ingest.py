@@ -0,0 +1,74 @@
+"""
+增量入库：文件中间插入内容后只重新 embedding 附近的分块，其后分块保持原 id，位置类元信息被刷新。
+"""
+import random
+
+import numpy as np
+import pytest
+
+import app.numpy_db as numpy_db
+from app.file_loader import overlap_chunks, stream_overlap_chunks
+from app.ingest import ingest_file
+from app.numpy_db import NumpyDB
+
+DIM = 8
+WORDS = "alpha beta gamma delta epsilon zeta eta theta iota kappa".split()
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.count = 0
+
+    def embed(self, texts):
+        self.count += len(texts)
+        return np.random.default_rng(self.count).standard_normal((len(texts), DIM)).tolist()
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(numpy_db, "CACHE_DIR", str(tmp_path / "cache"))
+    db = NumpyDB("ingest", root=str(tmp_path / "db"), dim=DIM)
+    db.ensure_schema()
+    return db
+
+
+def _lines(n, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 15))) for _ in range(n)]
+
+
+def test_insert_only_changes_nearby_chunks():
+    lines = _lines(2000)
+    before = {c["text"] for c in overlap_chunks("\n".join(lines), 500, 0.2, {})}
+    after = [c["text"] for c in overlap_chunks("\n".join(lines[:50] + ["a brand new line"] + lines[50:]), 500, 0.2, {})]
+    assert len(set(after) - before) <= 4
+    assert max(len(t) for t in after) <= 500
+
+
+def test_stream_matches_whole_text_and_tracks_pages():
+    text = "\n".join(_lines(800))
+    cuts = [0, 3000, 3001, 9000, len(text)]
+    pages = [(i + 1, text[a:b]) for i, (a, b) in enumerate(zip(cuts, cuts[1:]))]
+    streamed = list(stream_overlap_chunks(iter(pages), 300, 0.2, {}))
+    assert [c["text"] for c in streamed] == [c["text"] for c in overlap_chunks(text, 300, 0.2, {})]
+    assert streamed[0]["meta"]["page"] == 1 and streamed[-1]["meta"]["page_end"] == len(pages)
+
+
+def test_reingest_embeds_only_new_chunks_and_refreshes_meta(db, tmp_path):
+    rng = random.Random(0)
+    rows = ["id,name"] + [f"{i},{'v' * rng.randint(1, 40)}" for i in range(1000)]
+    path = tmp_path / "t.csv"
+    path.write_text("\n".join(rows))
+    emb = CountingEmbedder()
+    total = ingest_file(str(path), "t.csv", emb, db)
+    assert emb.count == total
+
+    path.write_text("\n".join(rows[:10] + ["999999,inserted"] + rows[10:]))
+    emb.count = 0
+    ingest_file(str(path), "t.csv", emb, db)
+    assert emb.count <= 2
+
+    got, _ = db.scroll("t.csv", limit=10000, fields=["meta"])
+    spans = sorted((r["meta"]["row_start"], r["meta"]["row_end"]) for r in got)
+    assert spans[0][0] == 1 and spans[-1][1] == 1001
+    assert all(a[1] + 1 == b[0] for a, b in zip(spans, spans[1:]))
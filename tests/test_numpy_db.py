@@ -0,0 +1,151 @@
+"""
+进程内 numpy 向量库：写入 / 检索 / 删除、path 范围、关键字模式、IVF 与精确检索的召回，以及检索与写入并发。
+"""
+import threading
+
+import numpy as np
+import pytest
+
+import app.numpy_db as numpy_db
+from app.numpy_db import NumpyDB
+
+DIM = 16
+
+
+@pytest.fixture
+def make_db(tmp_path, monkeypatch):
+    # 代数文件默认在 /dev/shm，测试放到临时目录
+    monkeypatch.setattr(numpy_db, "CACHE_DIR", str(tmp_path / "cache"))
+
+    def make(name="t"):
+        db = NumpyDB(name, root=str(tmp_path / "db"), dim=DIM)
+        db.ensure_schema()
+        return db
+    return make
+
+
+def _vectors(n, seed=0, centers=None):
+    rng = np.random.default_rng(seed)
+    if centers is None:
+        return rng.standard_normal((n, DIM)).astype(np.float32)
+    c = rng.standard_normal((centers, DIM)).astype(np.float32) * 3
+    return c[rng.integers(0, centers, n)] + rng.standard_normal((n, DIM)).astype(np.float32)
+
+
+def _insert(db, vecs, filename="f.txt", path="", start=0):
+    ids = [f"00000000-0000-0000-0000-{start + i:012d}" for i in range(len(vecs))]
+    db.insert_many(vecs.tolist(), [f"text {start + i}" for i in range(len(vecs))],
+                   [{"filename": filename, "path": path} for _ in ids], ids=ids)
+    return ids
+
+
+def test_insert_search_delete(make_db):
+    db = make_db()
+    vecs = _vectors(50)
+    ids = _insert(db, vecs[:30], "a.txt")
+    ids += _insert(db, vecs[30:], "b.txt", start=30)
+
+    hits = db.search(vecs[7].tolist(), top_k=3)
+    assert hits[0]["id"] == ids[7]
+    assert hits[0]["score"] == pytest.approx(1.0, abs=1e-5)
+    assert hits[0]["text"] == "text 7" and hits[0]["meta"]["filename"] == "a.txt"
+
+    db.delete_ids([ids[7]])
+    assert ids[7] not in {h["id"] for h in db.search(vecs[7].tolist(), top_k=50)}
+
+    db.delete_by_filename("b.txt")
+    assert db.point_ids("b.txt") == []
+    left = {h["id"] for h in db.search(vecs[40].tolist(), top_k=50)}
+    assert left == set(ids[:30]) - {ids[7]}
+
+    # 删除腾出的槽位被复用，新点能查到
+    new = _insert(db, vecs[40:41], "c.txt", start=100)
+    assert db.search(vecs[40].tolist(), top_k=1)[0]["id"] == new[0]
+
+
+def test_path_scope(make_db):
+    db = make_db()
+    vecs = _vectors(4)
+    ids = []
+    for i, path in enumerate(["a", "a/b", "ab", ""]):
+        ids += _insert(db, vecs[i : i + 1], f"{i}.txt", path=path, start=i)
+
+    scoped = {h["id"] for h in db.search(vecs[2].tolist(), top_k=10, path="a")}
+    assert scoped == {ids[0], ids[1]}
+    assert {h["id"] for h in db.search(vecs[2].tolist(), top_k=10, path="a/b")} == {ids[1]}
+    assert len(db.search(vecs[2].tolist(), top_k=10)) == 4
+
+
+def test_keyword_mode_with_and_without_lexical_index(make_db):
+    db = make_db()
+    vecs = _vectors(3)
+    db.insert_many(vecs.tolist(), ["苹果 apple pie", "香蕉 banana", "apple juice"],
+                   [{"filename": "k.txt"}] * 3, ids=[f"00000000-0000-0000-0000-00000000000{i}" for i in range(3)])
+    q = vecs[1].tolist()
+
+    hits = db.search(q, top_k=5, query_text="apple", mode="keyword")
+    assert {h["text"] for h in hits} == {"苹果 apple pie", "apple juice"}
+
+    # 索引未建好时退回子串扫描，结果不缺
+    if db.lexical is not None:
+        db.lexical.clear()
+    hits = db.search(q, top_k=5, query_text="apple", mode="keyword")
+    assert {h["text"] for h in hits} == {"苹果 apple pie", "apple juice"}
+
+
+def test_ivf_recall_matches_exact(make_db, monkeypatch):
+    monkeypatch.setattr(numpy_db, "NUMPY_IVF_LISTS", 16)
+    monkeypatch.setattr(numpy_db, "NUMPY_IVF_NPROBE", 4)
+    monkeypatch.setattr(numpy_db, "NUMPY_IVF_MIN_POINTS", 500)
+    db = make_db()
+    vecs = _vectors(3000, centers=32)
+    ids = _insert(db, vecs)
+    snap = db._snapshot()
+    assert snap.ivf is not None
+
+    unit = vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+    queries = _vectors(50, seed=1, centers=32)
+    recall = []
+    for q in queries:
+        exact = np.argsort(-(unit @ (q / np.linalg.norm(q))))[:10]
+        got = {h["id"] for h in db.search(q.tolist(), top_k=10)}
+        recall.append(len(got & {ids[i] for i in exact}) / 10)
+    assert np.mean(recall) >= 0.9
+
+    # 增量写入只给新槽位分簇，生成新的 assign，不改旧快照正在用的那份
+    before = snap.ivf.assign.copy()
+    extra = _insert(db, _vectors(10, seed=2, centers=32), "new.txt", start=5000)
+    new_snap = db._snapshot()
+    assert new_snap is not snap and new_snap.ivf.assign is not snap.ivf.assign
+    assert np.array_equal(snap.ivf.assign, before)
+    probe = db.get_by_ids([extra[0]], with_vectors=True)[0]["vector"]
+    assert db.search(probe, top_k=1)[0]["id"] == extra[0]
+
+
+def test_search_while_writing(make_db):
+    db = make_db()
+    vecs = _vectors(400)
+    _insert(db, vecs[:100])
+    errors = []
+    stop = threading.Event()
+
+    def reader():
+        try:
+            while not stop.is_set():
+                for h in db.search(vecs[0].tolist(), top_k=5):
+                    assert h["text"].startswith("text ")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    try:
+        for i in range(100, 400, 20):
+            ids = _insert(db, vecs[i : i + 20], start=i)
+            db.delete_ids(ids[:5])
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+    assert not errors